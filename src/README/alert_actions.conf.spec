@@ -1,3 +1,134 @@
 [make_a_log_message]
 param.message = <string>
 param.importance = <integer>
+
+# The following parameters control how the alert is executed (see ModularAlert.EXECUTION_PARAMETERS)
+param.batch_size = <integer>
+* If set, the alert runs against each of the search results in chunks of this many results.
+
+param.executor = thread | process
+* If set, the alert runs against each of the search results concurrently using a pool of threads (for
+  I/O-bound actions) or processes (for CPU-bound actions).
+
+param.max_workers = <integer>
+* The maximum number of threads or processes used by the executor.
+
+param.ordered = <boolean>
+* Indicates if the values returned for each result are collected in the order of the results (rather
+  than in the order in which they completed) before being passed to on_batch_results().
+* Defaults to true.
+
+param.max_failure_ratio = <decimal>
+* The largest fraction of the search results (between 0 and 1) that may fail while still considering
+  the alert to have executed successfully. A result fails when run() raises an exception or returns
+  False.
+* Defaults to 0 (every result must succeed).
+
+param.log_metrics = <boolean>
+* If true, the wall-clock and CPU time spent reading, parsing, validating, running and writing output
+  is logged as a key-value event ("Execution metrics: ...") when the alert completes.
+* Defaults to false.
+
+param.profile = <boolean>
+* If true, the execution of the alert is profiled using cProfile and the statistics are written to
+  $SPLUNK_HOME/var/run/splunk/profiles.
+* Defaults to false.
+
+param.dedup_fields = <comma-separated list>
+* If set, results whose fingerprint (computed from these fields, or all fields if the list contains no
+  names) was already seen by a previous invocation are skipped. The fingerprints are stored under
+  $SPLUNK_HOME/var/lib/splunk/modalerts.
+* Results that fail (or all of the results, if the execution fails entirely) aren't recorded as seen,
+  so the next invocation processes them again.
+
+param.dedup_ttl = <duration>
+* How long a fingerprint is remembered (e.g. 1h, 2d).
+* Defaults to 1d.
+
+param.dedup_max_entries = <integer>
+* The maximum number of fingerprints to remember (the least recently seen are forgotten first).
+* Defaults to 100000.
+
+param.spool_failures = <boolean>
+* If true, executions that fail (or, for batched alerts, the results that fail) are appended to a
+  spool under $SPLUNK_HOME/var/lib/splunk/modalerts so that they can be replayed later by running
+  the alert script with --replay.
+* When the execution of a batched alert fails entirely, its results are spooled (rather than just
+  the payload) since Splunk may remove the results file before the entry is replayed.
+* Defaults to false.
+
+param.results_index = <boolean>
+* If true and the alert filters the results (see ModularAlert.get_row_filter()), an index of the
+  columns that the filter refers to is kept next to the results file so that later scans of the same
+  file only need to parse the matching results.
+* Defaults to false.
+
+param.rate_limit = <decimal>
+* If set, the number of actions per second (for each destination) that the alert may perform across
+  all of the processes running it on the host (see ModularAlert.acquire_rate_limit()).
+
+param.rate_limit_burst = <integer>
+* The number of actions that may be performed at once before the rate limit applies.
+* Defaults to the rate limit (rounded up).
+
+param.rate_limit_mode = block | drop
+* Indicates whether actions beyond the rate limit wait until they are allowed or are dropped (the
+  number dropped is logged).
+* Defaults to block.
+
+param.validation_cache = <boolean>
+* If true, the cleaned parameters of the configuration are also remembered across invocations of the
+  alert in a cache under $SPLUNK_HOME/var/lib/splunk/modalerts (each process always remembers the
+  configurations that it validated). This is only worthwhile for alerts whose parameters are expensive
+  to validate (e.g. those that check a remote system), since values such as regular expressions must
+  still be compiled again by each process.
+* Defaults to false.
+
+param.memory_budget = <integer>
+* If set, the number of megabytes of results that each row buffer (see ModularAlert.make_row_buffer())
+  holds in memory before spilling them to temporary files. The peak memory used and the number of
+  results spilled are logged when the alert completes.
+
+param.trace_memory = <boolean>
+* If true, the memory allocated while the alert runs is traced (using tracemalloc) and the peak along
+  with the lines that allocated the most memory is logged when the alert completes. Tracing slows the
+  alert down considerably so only use this while investigating memory use.
+* Defaults to false.
+
+param.output_format = kv | json
+* The format of the events written by ModularAlert.output_event() and output_events(): key-value pairs
+  (which need KV_MODE = auto_escaped to extract quoted values) or JSON lines in the HTTP Event
+  Collector format (with the index, sourcetype, source and host of the events filled in).
+* Defaults to kv.
+
+param.prefetch = thread | process
+* If set, the results are read ahead of the alert by a thread (which helps alerts that wait on I/O
+  such as network requests) or by another process (which also takes the parsing of the results off of
+  the alert's process, helping CPU-bound alerts on hosts with a spare CPU). Only a few chunks of
+  results are read ahead so memory use stays bounded.
+
+param.group_by = <comma-separated list>
+* If set, the results are grouped by the values of these fields and the alert runs once for each group
+  instead of once for each result. run() gets the group in payload['group'] (a dictionary of the
+  "by" values, the "count" of results, the "first" and "last" results and the "distinct" values of
+  the group_distinct fields) and the group's first result in payload['result']. Only these aggregates
+  are kept in memory, so memory use depends on the number of groups rather than the number of results.
+
+param.group_distinct = <comma-separated list>
+* The fields whose distinct values are collected for each group (see group_by).
+
+param.group_max_distinct = <integer>
+* The maximum number of distinct values collected for each field of a group; the fields that had more
+  are listed in the group's "truncated" entry.
+* Defaults to 100.
+
+param.rest_cache_ttl = <duration>
+* How long the responses to GET requests made with ModularAlert.rest_client (the client of splunkd's
+  REST API) are cached for (e.g. 30s, 5m); 0 disables the cache.
+* Defaults to 60s.
+
+param.lookup_file = <string>
+* The CSV lookup file (which may be gzipped) that ModularAlert.enrich() adds fields from; relative
+  paths are in the app's lookups directory. An index of the lookup is built under
+  $SPLUNK_HOME/var/lib/splunk/modalerts the first time that it is used (and whenever the lookup
+  changes) and is memory-mapped by the processes running the alert.
@@ -27,11 +27,23 @@ class MakeLogMessageAlert(ModularAlert):
         # This shows how one can get data from the search results
         source_field = payload['result'].get('source', 'source was undefined')
         self.logger.info("The source was: " + source_field)
+        
+        # When the "group_by" parameter is set, the alert runs once for each group of results instead of once per result
+        group = payload.get('group')
+        
+        if group is not None:
+            self.logger.info("The group was: %r (%i results)", group['by'], group['count'])
 
         # Get the information we need to execute the alert action
         importance = cleaned_params.get('importance', 0)
         message = cleaned_params.get('message', "(blank)")
         self.logger.info("Ok, here we go...")
+
+        # Don't flood the log when many alerts fire at once (this waits or returns false once the "rate_limit" parameter is exceeded)
+        if not self.acquire_rate_limit():
+            self.logger.info("Skipped the log message since the rate limit was exceeded")
+            return True
+
         self.make_the_log_message(message, importance)
         self.logger.info("Successfully executed the modular alert. You are a total pro.")
         
@@ -45,13 +57,58 @@ if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1] == "--execute":
         
         try:
-            modular_alert = MakeLogMessageAlert()
-            modular_alert.execute()
+            # The worker needs Unix sockets (which aren't available on Windows)
+            try:
+                from modular_alert_example_app.worker import execute_alert, get_socket_path
+            except (ImportError, AttributeError):
+                execute_alert = None
+            
+            if execute_alert is not None:
+                # Hand the payload to the worker if it is running (otherwise, the alert will be executed in this process);
+                # the worker relays the alert's events and log messages back so that they are written by this process
+                execute_alert(MakeLogMessageAlert, get_socket_path("make_a_log_message"))
+            else:
+                alert = MakeLogMessageAlert()
+                
+                try:
+                    alert.execute(sys.stdin)
+                finally:
+                    alert.shutdown()
+            
             sys.exit(0)
         except Exception as e:
-            print >> sys.stderr, "Unhandled exception was caught, this may be due to a defect in the script:" + str(e) # This logs general exceptions that would have been unhandled otherwise (such as coding errors)
+            sys.stderr.write("Unhandled exception was caught, this may be due to a defect in the script:" + str(e) + "\n") # This logs general exceptions that would have been unhandled otherwise (such as coding errors)
             raise
+    
+    # Run a worker that keeps the alert warm so that it can execute alerts forwarded from the --execute calls
+    elif len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        
+        from modular_alert_example_app.worker import AlertWorker, get_socket_path
+        
+        socket_path = get_socket_path("make_a_log_message")
+        
+        # The socket is only put in Splunk's run directory (see get_socket_path())
+        if socket_path is None:
+            sys.stderr.write("The worker can only be run when SPLUNK_HOME is set (e.g. via splunk cmd python)\n")
+            sys.exit(1)
+        
+        worker = AlertWorker(MakeLogMessageAlert, socket_path)
+        
+        try:
+            worker.serve_forever()
+        finally:
+            worker.server_close()
+        
+    # Replay the executions that failed and were spooled (optionally followed by the number to replay at once)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--replay":
+        
+        from modular_alert_example_app.spool import replay_spool
+        
+        concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        replayed = replay_spool(MakeLogMessageAlert, concurrency)
+        
+        sys.stdout.write("Replayed %i spooled executions\n" % replayed)
         
     else:
-        print >> sys.stderr, "Unsupported execution mode (expected --execute flag)"
-        sys.exit(1)
\ No newline at end of file
+        sys.stderr.write("Unsupported execution mode (expected --execute, --worker or --replay flag)\n")
+        sys.exit(1)
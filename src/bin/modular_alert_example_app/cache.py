@@ -0,0 +1,174 @@
+"""
+This module contains a persistent cache that can be shared by concurrent alert processes.
+
+The cache is stored in a SQLite database. Entries expire after a time-to-live and the least-recently
+used entries are evicted once the cache holds more than a maximum number of entries.
+"""
+
+import os
+import sqlite3
+import time
+
+class PersistentCache(object):
+    """
+    A persistent key-value cache. Many processes can use the same cache at once; SQLite serializes
+    the writes so that checking for and adding a key (see add_new()) is atomic.
+    """
+
+    # The number of seconds to wait for another process to release its lock on the database
+    LOCK_TIMEOUT = 30
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        """
+        Open the cache (creating it if necessary).
+
+        Arguments:
+        path -- The path of the database file
+        ttl -- The number of seconds after which an entry expires (or None if entries don't expire)
+        max_entries -- The maximum number of entries to keep (or None if there is no limit)
+        """
+
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        directory = os.path.dirname(path)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Transactions are managed explicitly (see _transaction())
+        self._connection = sqlite3.connect(path, timeout=self.LOCK_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self._transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)')
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    def _expires(self, now):
+        if self.ttl is None:
+            return None
+
+        return now + self.ttl
+
+    def add_new(self, keys):
+        """
+        Add the keys to the cache and return the set of those that weren't already in the cache (or
+        had expired). The keys that were already in the cache are marked as recently used.
+
+        Arguments:
+        keys -- An iterable of keys
+        """
+
+        now = time.time()
+        expires = self._expires(now)
+        new_keys = set()
+
+        with self._transaction() as cursor:
+            for key in keys:
+                row = cursor.execute('SELECT expires FROM entries WHERE key = ?', (key,)).fetchone()
+
+                if row is None or (row[0] is not None and row[0] <= now):
+                    new_keys.add(key)
+                    cursor.execute('INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, NULL, ?, ?)', (key, expires, now))
+                else:
+                    cursor.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+
+            self._evict(cursor, now)
+
+        return new_keys
+
+    def remove(self, keys):
+        """
+        Remove the keys from the cache (so that add_new() considers them new again).
+
+        Arguments:
+        keys -- An iterable of keys
+        """
+
+        with self._transaction() as cursor:
+            cursor.executemany('DELETE FROM entries WHERE key = ?', ((key,) for key in keys))
+
+    def get(self, key):
+        """
+        Get the value for the key (or None if the key isn't in the cache).
+
+        Arguments:
+        key -- The key
+        """
+
+        now = time.time()
+
+        with self._transaction() as cursor:
+            row = cursor.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+
+            if row is None or (row[1] is not None and row[1] <= now):
+                return None
+
+            cursor.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+
+            return row[0]
+
+    def set(self, key, value):
+        """
+        Set the value for the key.
+
+        Arguments:
+        key -- The key
+        value -- The value (as a string)
+        """
+
+        now = time.time()
+
+        with self._transaction() as cursor:
+            cursor.execute('INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)', (key, value, self._expires(now), now))
+            self._evict(cursor, now)
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def _evict(self, cursor, now):
+        """
+        Remove the expired entries and then the least recently used entries beyond the maximum.
+        """
+
+        if self.ttl is not None:
+            cursor.execute('DELETE FROM entries WHERE expires <= ?', (now,))
+
+        if self.max_entries is not None:
+            count = cursor.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+            if count > self.max_entries:
+                cursor.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)', (count - self.max_entries,))
+
+    def close(self):
+        self._connection.close()
+
+class _Transaction(object):
+    """
+    Runs the statements within the "with" block in a transaction that holds the write lock from the
+    start (so that reads and the writes that depend on them are atomic across processes).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = None
+
+    def __enter__(self):
+        self.cursor = self.connection.cursor()
+        self.cursor.execute('BEGIN IMMEDIATE')
+
+        return self.cursor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.cursor.execute('COMMIT')
+        else:
+            self.cursor.execute('ROLLBACK')
+
+        self.cursor.close()
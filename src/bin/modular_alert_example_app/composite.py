@@ -0,0 +1,250 @@
+"""
+This module allows several alert actions to be run by a single process.
+
+When a search triggers several alert actions, Splunk starts a process for each of them and each
+process reads and parses the same payload and results file. A CompositeAlert runs several alerts
+against one payload: the payload is parsed and the results file is read once and the results are
+fed to each of the alerts (each of which runs on its own thread). The results are streamed to the
+alerts a chunk at a time and aren't read at all if none of the alerts is batched.
+
+See "How do I run several alert actions without reading the results once for each of them?" in the
+README for how to register a composite alert as an alert action.
+"""
+
+import collections
+import os
+import threading
+
+from configparser import RawConfigParser
+
+from modular_alert_example_app.modular_alert import ModularAlert
+
+# The prefix of the settings in alert_actions.conf that are passed to the alert action as its configuration
+PARAM_PREFIX = 'param.'
+
+def read_alert_action_params(stanza, app_directory=None):
+    """
+    Get the parameters of the alert action from the app's alert_actions.conf (the settings in the
+    local directory take precedence over those in the default directory). Returns a dictionary of the
+    parameters (without the "param." prefix).
+
+    Arguments:
+    stanza -- The name of the alert action (e.g. "make_a_log_message")
+    app_directory -- The directory of the app (defaults to the app that this module is in)
+    """
+
+    if app_directory is None:
+        app_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    parser = RawConfigParser(strict=False)
+
+    # Keep the case of the parameter names
+    parser.optionxform = str
+
+    parser.read([os.path.join(app_directory, directory, 'alert_actions.conf') for directory in ['default', 'local']])
+
+    if not parser.has_section(stanza):
+        return {}
+
+    return dict((name[len(PARAM_PREFIX):], value) for name, value in parser.items(stanza) if name.startswith(PARAM_PREFIX))
+
+class ResultsQueue(object):
+    """
+    A bounded queue of chunks of results that is consumed by one of the alerts. The reader waits
+    while the queue is full so that a slow alert limits how far ahead the results are read. A closed
+    queue (see close()) discards the chunks put on it so that an alert that stops consuming the
+    results (e.g. one that isn't batched) doesn't block the others. The reader can wait to find out
+    whether the alert will consume the results at all (see wait_until_needed()).
+    """
+
+    def __init__(self, max_size):
+        """
+        Arguments:
+        max_size -- The maximum number of chunks held by the queue
+        """
+
+        self.max_size = max_size
+        self._chunks = collections.deque()
+        self._finished = False
+        self._closed = False
+        self._started = False
+        self._condition = threading.Condition()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def wait_until_needed(self):
+        """
+        Wait until the alert starts consuming the results or is done without them. Returns true if
+        the results are needed.
+        """
+
+        with self._condition:
+            while not self._started and not self._closed:
+                self._condition.wait()
+
+            return not self._closed
+
+    def put(self, chunk):
+        with self._condition:
+            while len(self._chunks) >= self.max_size and not self._closed:
+                self._condition.wait()
+
+            if not self._closed:
+                self._chunks.append(chunk)
+                self._condition.notify_all()
+
+    def finish(self):
+        """
+        Indicate that all of the results have been put on the queue.
+        """
+
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        Stop accepting results (called once the alert is done).
+        """
+
+        with self._condition:
+            self._closed = True
+            self._chunks.clear()
+            self._condition.notify_all()
+
+    def __iter__(self):
+        """
+        Iterate through the results (blocking until they are available).
+        """
+
+        with self._condition:
+            self._started = True
+            self._condition.notify_all()
+
+        while True:
+            with self._condition:
+                while not self._chunks and not self._finished and not self._closed:
+                    self._condition.wait()
+
+                if not self._chunks:
+                    return
+
+                chunk = self._chunks.popleft()
+                self._condition.notify_all()
+
+            for row in chunk:
+                yield row
+
+class CompositeAlert(ModularAlert):
+    """
+    Runs several alerts against a single payload. Each alert is executed (see ModularAlert.execute())
+    on its own thread with a copy of the payload whose configuration is replaced by the alert's
+    configuration. The results are read once and fed to the alerts that are batched.
+
+    Note that the same result dictionaries are passed to all of the alerts, so the alerts must not
+    modify them.
+    """
+
+    # The number of chunks of results that may be queued for each alert
+    QUEUE_SIZE = 4
+
+    def __init__(self, actions, logger_name='composite_alert', chunk_size=1000, **kwargs):
+        """
+        Set up the composite alert.
+
+        Arguments:
+        actions -- A list of tuples of an alert (a ModularAlert instance) and its configuration (e.g. from read_alert_action_params())
+        logger_name -- The logger name to append to the logger
+        chunk_size -- The number of results that are passed to the alerts at a time
+        """
+
+        super(CompositeAlert, self).__init__([], logger_name=logger_name, **kwargs)
+
+        self.actions = actions
+        self.chunk_size = chunk_size
+        self.results = []
+
+    @classmethod
+    def from_stanzas(cls, alert_classes, app_directory=None, **kwargs):
+        """
+        Make a composite alert from alert classes and the names of their stanzas in alert_actions.conf.
+
+        Arguments:
+        alert_classes -- A list of tuples of an alert class (called without arguments to create an instance) and the name of its stanza
+        app_directory -- The directory of the app (see read_alert_action_params())
+        """
+
+        actions = [(alert_class(), read_alert_action_params(stanza, app_directory)) for alert_class, stanza in alert_classes]
+
+        return cls(actions, **kwargs)
+
+    def shutdown(self):
+        for alert, _ in self.actions:
+            alert.shutdown()
+
+        super(CompositeAlert, self).shutdown()
+
+    def validate(self, arguments, fail_fast=True):
+        # The composite alert doesn't have parameters of its own; each alert validates its configuration
+        return dict(arguments)
+
+    def is_batched(self):
+        # The results are passed to each of the alerts instead
+        return False
+
+    def run(self, cleaned_params, payload):
+        """
+        Execute each of the alerts. Returns true if all of them succeeded (the value returned by each
+        alert is available in the "results" attribute).
+        """
+
+        from modular_alert_example_app.results import iter_chunks
+
+        self.results = [False] * len(self.actions)
+        queues = [ResultsQueue(self.QUEUE_SIZE) for _ in self.actions]
+        threads = []
+
+        def execute_action(index, alert, configuration, queue):
+            try:
+                action_payload = payload.copy()
+                action_payload['configuration'] = configuration
+
+                self.results[index] = alert.execute(payload=action_payload, results=queue)
+            finally:
+                queue.close()
+
+        for index, (alert, configuration) in enumerate(self.actions):
+            thread = threading.Thread(target=execute_action, args=(index, alert, configuration, queues[index]), name='%s-%s' % (self.logger_name, alert.logger_name))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # Read the results once and hand each chunk to every alert that consumes them (the results
+        # aren't read if none of them does and reading stops once all of them are done)
+        try:
+            consumers = [queue for queue in queues if queue.wait_until_needed()]
+
+            if consumers:
+                for chunk in iter_chunks(self.iter_results(payload), self.chunk_size):
+                    for queue in consumers:
+                        queue.put(chunk)
+
+                    if all(queue.closed for queue in consumers):
+                        break
+        finally:
+            for queue in queues:
+                queue.finish()
+
+            for thread in threads:
+                thread.join()
+
+        # Only an explicit False is a failure (execute() returns None for alerts whose run() returns nothing)
+        succeeded = [result is not False for result in self.results]
+
+        for (alert, _), success in zip(self.actions, succeeded):
+            if not success:
+                self.logger.warning("Alert action failed, action=%s", alert.logger_name)
+
+        return all(succeeded)
@@ -0,0 +1,349 @@
+"""
+This module contains the classes used for writing events out to Splunk.
+
+Events are written as key-value pairs (e.g. 'source="/var/log/app.log" count=4'). The values are
+escaped such that Splunk can extract them when KV_MODE = auto_escaped is used.
+
+Alternatively, events can be written as JSON lines (see JSONEventEncoder) which Splunk parses much
+more cheaply, carry multi-valued and quoted values as-is and include the index, sourcetype, source and
+host of the event.
+"""
+
+import sys
+import time
+
+from collections.abc import Mapping
+
+# The libraries that can be used to encode JSON, in order of preference (the standard library is used
+# when neither of the faster libraries is installed)
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+
+def escape_value(s, encapsulate_in_double_quotes=False):
+    """
+    Escape the quotes in the string and add double quotes around it if it contains spaces.
+
+    Arguments:
+    s -- A string to escape (None is returned as-is).
+    encapsulate_in_double_quotes -- If true, the value will have double-quotes added around it.
+    """
+
+    if s is None:
+        return None
+
+    if not isinstance(s, str):
+        s = str(s)
+
+    # Most values don't contain quotes so only copy the string when they do
+    if '"' in s:
+        s = s.replace('"', '\\"')
+
+    if "'" in s:
+        s = s.replace("'", "\\'")
+
+    if encapsulate_in_double_quotes or " " in s:
+        return '"' + s + '"'
+
+    return s
+
+class EventEncoder(object):
+    """
+    Encodes dictionaries as key-value events. The fragments of each event are appended to a list
+    (see encode_into()) so that many events can be encoded into a single buffer without building
+    intermediate strings.
+    """
+
+    # The maximum number of escaped field names that are cached
+    MAX_CACHED_KEYS = 1024
+
+    def __init__(self, encapsulate_value_in_double_quotes=False):
+        """
+        Set up the encoder.
+
+        Arguments:
+        encapsulate_value_in_double_quotes -- If true, the values will have double-quotes added around them.
+        """
+
+        self.encapsulate_value_in_double_quotes = encapsulate_value_in_double_quotes
+
+        # The escaped form of the field names (with the "=" appended)
+        self._keys = {}
+
+    def _escape_key(self, key):
+
+        escaped = self._keys.get(key)
+
+        if escaped is None:
+            escaped = '%s=' % escape_value(key)
+
+            if len(self._keys) >= self.MAX_CACHED_KEYS:
+                self._keys.clear()
+
+            self._keys[key] = escaped
+
+        return escaped
+
+    def encode_into(self, data_dict, parts):
+        """
+        Append the fragments of the event to the given list.
+
+        Arguments:
+        data_dict -- A dictionary containing the fields
+        parts -- The list to append the fragments to
+        """
+
+        append = parts.append
+        keys = self._keys
+        encapsulate = self.encapsulate_value_in_double_quotes
+        first = True
+
+        for k, v in data_dict.items():
+
+            # If the value is a list, then write out each matching value with the same name (as mv)
+            if isinstance(v, list):
+                values = v
+            else:
+                values = (v,)
+
+            k_escaped = keys.get(k) or self._escape_key(k)
+
+            for value in values:
+                if first:
+                    first = False
+                else:
+                    append(' ')
+
+                append(k_escaped)
+
+                if value is None:
+                    append('None')
+                else:
+                    append(escape_value(value, encapsulate))
+
+    def encode(self, data_dict):
+        """
+        Create a string representing the event.
+
+        Arguments:
+        data_dict -- A dictionary containing the fields
+        """
+
+        parts = []
+        self.encode_into(data_dict, parts)
+
+        return ''.join(parts)
+
+def _json_default(value):
+    """
+    Convert the values that the JSON libraries don't handle themselves (such as a ResultRow).
+    """
+
+    if isinstance(value, Mapping):
+        return dict(value)
+
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+
+    return str(value)
+
+def make_json_dumps(backend=None):
+    """
+    Get a function that encodes a value as a (compact, UTF-8) JSON string using the fastest library
+    that is installed (see JSON_BACKENDS). Returns a tuple of the name of the library and the function.
+
+    Arguments:
+    backend -- The name of the library to use (or None to use the fastest one that is installed)
+    """
+
+    for name in (JSON_BACKENDS if backend is None else (backend,)):
+
+        if name == 'orjson':
+            try:
+                import orjson
+            except ImportError:
+                continue
+
+            orjson_dumps = orjson.dumps
+            option = orjson.OPT_NON_STR_KEYS
+
+            def dumps(value):
+                return orjson_dumps(value, default=_json_default, option=option).decode('utf-8')
+
+            return name, dumps
+
+        elif name == 'ujson':
+            try:
+                import ujson
+
+                # Older versions don't support converting other types
+                ujson.dumps(None, default=_json_default)
+            except (ImportError, TypeError):
+                continue
+
+            ujson_dumps = ujson.dumps
+
+            def dumps(value):
+                return ujson_dumps(value, ensure_ascii=False, escape_forward_slashes=False, default=_json_default)
+
+            return name, dumps
+
+        elif name == 'json':
+            import json
+
+            return name, json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default).encode
+
+    raise ValueError("The JSON library '%s' is not available" % backend)
+
+class JSONEventEncoder(object):
+    """
+    Encodes dictionaries as JSON events in the format accepted by Splunk's HTTP Event Collector:
+    the fields are in the "event" object and the metadata of the event (its time, index, sourcetype,
+    source and host) are alongside it. The time is taken from the "_time" field if it has one.
+
+    This can be used by an EventWriter in place of an EventEncoder.
+    """
+
+    def __init__(self, index=None, sourcetype=None, source=None, host=None, backend=None):
+        """
+        Set up the encoder.
+
+        Arguments:
+        index -- The index to send the events to
+        sourcetype -- The sourcetype
+        source -- The source
+        host -- The host
+        backend -- The name of the JSON library to use (see make_json_dumps())
+        """
+
+        self.metadata = dict((name, value) for name, value in [('index', index), ('sourcetype', sourcetype), ('source', source), ('host', host)] if value is not None)
+        self.backend, self._dumps = make_json_dumps(backend)
+
+    def make_envelope(self, data_dict):
+        """
+        Get the dictionary that is encoded for the event (the metadata along with the event itself).
+
+        Arguments:
+        data_dict -- A dictionary containing the fields
+        """
+
+        envelope = dict(self.metadata)
+
+        event_time = data_dict.get('_time')
+
+        if event_time is not None:
+            try:
+                envelope['time'] = float(event_time)
+            except (TypeError, ValueError):
+                pass
+
+        envelope['event'] = data_dict
+
+        return envelope
+
+    def encode_into(self, data_dict, parts):
+        """
+        Append the event to the given list.
+
+        Arguments:
+        data_dict -- A dictionary containing the fields
+        parts -- The list to append the event to
+        """
+
+        parts.append(self._dumps(self.make_envelope(data_dict)))
+
+    def encode(self, data_dict):
+        """
+        Create a string representing the event (without a trailing newline).
+
+        Arguments:
+        data_dict -- A dictionary containing the fields
+        """
+
+        return self._dumps(self.make_envelope(data_dict))
+
+class EventWriter(object):
+    """
+    Writes events to a stream in bulk. The events are buffered and written (and the stream flushed)
+    once the buffer reaches flush_size characters or flush_interval seconds have passed since the
+    last flush. Each event is terminated by a newline.
+
+    Use the writer as a context manager (or call close()) to make sure the buffered events are written.
+    """
+
+    def __init__(self, out=sys.stdout, encoder=None, flush_size=65536, flush_interval=1.0):
+        """
+        Set up the writer.
+
+        Arguments:
+        out -- The stream to send the events to
+        encoder -- The EventEncoder (or JSONEventEncoder) to use (a default one will be created if this is None)
+        flush_size -- The number of buffered characters that causes the buffer to be written
+        flush_interval -- The number of seconds after which the buffer is written (checked when an event is written)
+        """
+
+        self.out = out
+        self.encoder = encoder if encoder is not None else EventEncoder()
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._parts = []
+        self._size = 0
+        self._last_flush = time.time()
+
+    def write_string(self, event_string):
+        """
+        Write an event that has already been encoded.
+
+        Arguments:
+        event_string -- The event
+        """
+
+        self._parts.append(event_string)
+        self._parts.append('\n')
+        self._size += len(event_string) + 1
+
+        self._maybe_flush()
+
+    def write(self, data_dict):
+        """
+        Encode and write the event.
+
+        Arguments:
+        data_dict -- A dictionary containing the fields
+        """
+
+        parts = self._parts
+        count = len(parts)
+
+        self.encoder.encode_into(data_dict, parts)
+        parts.append('\n')
+
+        for i in range(count, len(parts)):
+            self._size += len(parts[i])
+
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self._size >= self.flush_size or (time.time() - self._last_flush) >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered events to the stream.
+        """
+
+        if self._parts:
+            self.out.write(''.join(self._parts))
+            del self._parts[:]
+            self._size = 0
+
+        self.out.flush()
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,157 @@
+"""
+This module contains the row filters that select which search results an alert runs against.
+
+A filter is declared as a list of conditions on fields (e.g. IntegerField("importance") >= 2). The
+filter is evaluated on the raw values read from the results file, before the row is converted into a
+dictionary, so the rows that the alert doesn't care about are discarded as cheaply as possible.
+"""
+
+import operator
+
+from modular_alert_example_app.modular_alert import CONVERSION_ERRORS
+
+def _contains(value, values):
+    return value in values
+
+class RowFilter(object):
+    """
+    A filter that matches the rows for which all of the conditions are true. Each condition converts
+    the raw value of a field using a Field (see Field.to_python()) and compares it to a value; rows
+    whose value can't be converted (including the rows that don't have the field) don't match.
+
+        row_filter = RowFilter().add(IntegerField("importance"), '>=', 2).add(Field("source"), 'in', sources)
+    """
+
+    OPERATORS = {
+        '==' : operator.eq,
+        '!=' : operator.ne,
+        '<' : operator.lt,
+        '<=' : operator.le,
+        '>' : operator.gt,
+        '>=' : operator.ge,
+        'in' : _contains
+    }
+
+    # The number of raw values per condition whose result is remembered
+    MAX_CACHED_VALUES = 4096
+
+    def __init__(self, conditions=None):
+        """
+        Set up the filter.
+
+        Arguments:
+        conditions -- A list of (field, operator, value) tuples (see add())
+        """
+
+        self.conditions = []
+
+        for field, operator_name, value in conditions or []:
+            self.add(field, operator_name, value)
+
+    def add(self, field, operator_name, value):
+        """
+        Add a condition. Returns the filter so that calls can be chained.
+
+        Arguments:
+        field -- The Field that is used to convert the value of the field (its name is the name of the field)
+        operator_name -- One of the OPERATORS (e.g. '>=')
+        value -- The value to compare the converted value to
+        """
+
+        if operator_name not in self.OPERATORS:
+            raise ValueError("The operator '%s' is not supported" % operator_name)
+
+        self.conditions.append((field, operator_name, value))
+
+        return self
+
+    @property
+    def field_names(self):
+        """
+        Get the names of the fields that the conditions refer to.
+        """
+
+        names = []
+
+        for field, _, _ in self.conditions:
+            if field.name not in names:
+                names.append(field.name)
+
+        return names
+
+    def make_predicate(self, field, operator_name, value):
+        """
+        Make a function that determines whether a raw value satisfies the condition. The results are
+        remembered since many fields only have a few distinct values.
+        """
+
+        compare = self.OPERATORS[operator_name]
+        to_python = field.to_python
+        cache = {}
+        max_cached_values = self.MAX_CACHED_VALUES
+
+        def predicate(raw_value):
+            result = cache.get(raw_value)
+
+            if result is None:
+                try:
+                    result = bool(compare(to_python(raw_value), value))
+                except CONVERSION_ERRORS:
+                    result = False
+
+                if len(cache) < max_cached_values:
+                    cache[raw_value] = result
+
+            return result
+
+        return predicate
+
+    def get_predicates(self):
+        """
+        Get a list of the names of the fields along with the predicate for the condition on the field.
+        """
+
+        return [(field.name, self.make_predicate(field, operator_name, value)) for field, operator_name, value in self.conditions]
+
+    def bind(self, columns):
+        """
+        Make a function that determines whether a row (a list of values in the same order as the
+        given columns, such as a row from the CSV reader) matches the filter.
+
+        Arguments:
+        columns -- The names of the columns
+        """
+
+        positions = dict((name, position) for position, name in enumerate(columns))
+        checks = [(positions.get(name), predicate) for name, predicate in self.get_predicates()]
+
+        def matches(values):
+            for position, predicate in checks:
+                if position is None or position >= len(values):
+                    raw_value = None
+                else:
+                    raw_value = values[position]
+
+                if not predicate(raw_value):
+                    return False
+
+            return True
+
+        return matches
+
+    def matches(self, row):
+        """
+        Determine whether the row (a dictionary) matches the filter.
+
+        Arguments:
+        row -- A dictionary representing the search result
+        """
+
+        for field, operator_name, value in self.conditions:
+            try:
+                if not self.OPERATORS[operator_name](field.to_python(row.get(field.name)), value):
+                    return False
+            except CONVERSION_ERRORS:
+                return False
+
+        return True
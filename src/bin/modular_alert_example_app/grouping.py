@@ -0,0 +1,155 @@
+"""
+This module groups search results so that an alert can act once per group (e.g. once per host)
+instead of once per result.
+
+The results are grouped in a single pass using a dictionary keyed by the values of the fields that
+they are grouped by. Each group only keeps the aggregates of its results (the count, the first and
+last results and a capped set of the distinct values of some fields) rather than the results
+themselves, so the memory used depends on the number of groups, not the number of results.
+"""
+
+def get_group_value(row, name):
+    """
+    Get the value of a field that the results are grouped by. Missing values are grouped with
+    empty ones (as Splunk writes them to the results file) and multi-valued fields are grouped by
+    the combination of their values.
+
+    Arguments:
+    row -- A dictionary representing the search result
+    name -- The name of the field
+    """
+
+    value = row.get(name)
+
+    if value is None:
+        return ''
+
+    if isinstance(value, list):
+        return tuple(value)
+
+    return value
+
+class Group(object):
+    """
+    The aggregates of the results that share the same values of the fields that they are grouped
+    by. Use to_dict() to get the dictionary that is passed to the alert.
+    """
+
+    __slots__ = ['by', 'count', 'first', 'last', 'distinct', 'truncated']
+
+    def __init__(self, by, row, distinct_fields):
+        self.by = by
+        self.count = 0
+        self.first = row
+        self.last = row
+
+        # The values are kept in dictionaries (rather than sets) so that they stay in the order that they were seen
+        self.distinct = dict((name, {}) for name in distinct_fields)
+        self.truncated = set()
+
+    def add(self, row, max_distinct):
+        self.count += 1
+        self.last = row
+
+        for name, values in self.distinct.items():
+            value = row.get(name)
+
+            if value is None or value == '':
+                continue
+
+            for value in (value if isinstance(value, list) else [value]):
+                if value in values:
+                    continue
+
+                if len(values) >= max_distinct:
+                    self.truncated.add(name)
+                    break
+
+                values[value] = None
+
+    def to_dict(self):
+        """
+        Get a dictionary of the aggregates:
+
+         * by -- A dictionary of the fields that the results are grouped by and their values
+         * count -- The number of results in the group
+         * first -- The first result in the group
+         * last -- The last result in the group
+         * distinct -- A dictionary of the fields whose distinct values are collected and a list of the values
+         * truncated -- A list of the fields that had more distinct values than were collected
+        """
+
+        return {
+            'by' : dict(self.by),
+            'count' : self.count,
+            'first' : self.first,
+            'last' : self.last,
+            'distinct' : dict((name, list(values)) for name, values in self.distinct.items()),
+            'truncated' : sorted(self.truncated)
+        }
+
+class GroupAggregator(object):
+    """
+    Groups results by the values of some of their fields (see the module description). Add the
+    results with add() or extend() and then iterate through the aggregator to get the groups (as
+    dictionaries, see Group.to_dict()) in the order that they were first seen.
+    """
+
+    def __init__(self, group_by, distinct_fields=None, max_distinct=100):
+        """
+        Set up the aggregator.
+
+        Arguments:
+        group_by -- A list of the names of the fields to group the results by
+        distinct_fields -- A list of the names of the fields whose distinct values are collected for each group
+        max_distinct -- The maximum number of distinct values collected for each field of a group
+        """
+
+        self.group_by = [name.strip() for name in group_by if name.strip()]
+        self.distinct_fields = [name.strip() for name in (distinct_fields or []) if name.strip()]
+        self.max_distinct = max_distinct
+
+        if not self.group_by:
+            raise ValueError("At least one field to group the results by must be provided")
+
+        self.row_count = 0
+        self._groups = {}
+
+    def add(self, row):
+        """
+        Add a result to its group.
+
+        Arguments:
+        row -- A dictionary representing the search result
+        """
+
+        if len(self.group_by) == 1:
+            key = get_group_value(row, self.group_by[0])
+        else:
+            key = tuple(get_group_value(row, name) for name in self.group_by)
+
+        group = self._groups.get(key)
+
+        if group is None:
+            if len(self.group_by) == 1:
+                by = ((self.group_by[0], key),)
+            else:
+                by = tuple(zip(self.group_by, key))
+
+            group = self._groups[key] = Group(by, row, self.distinct_fields)
+
+        group.add(row, self.max_distinct)
+        self.row_count += 1
+
+    def extend(self, rows):
+        add = self.add
+
+        for row in rows:
+            add(row)
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __iter__(self):
+        for group in self._groups.values():
+            yield group.to_dict()
@@ -0,0 +1,81 @@
+"""
+This module provides asynchronous logging for modular alerts.
+
+Log records are put on a queue by the thread that logs them and are formatted and written by a
+background thread, so that formatting, disk I/O and log rotation don't slow down the alert itself.
+"""
+
+import atexit
+import threading
+
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+# The listeners that are running (by logger name) along with the handlers that they write to
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+class LazyQueueHandler(QueueHandler):
+    """
+    A queue handler that leaves the formatting of the message to the listener thread. Note that this
+    means that objects passed as arguments to the log message must not be changed after they are logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+def start_listener(logger_name, handler):
+    """
+    Start a listener that writes the records queued for the given logger to the handler. Returns the
+    handler that should be added to the logger in place of the given handler.
+
+    Arguments:
+    logger_name -- The name of the logger
+    handler -- The handler that writes the log messages
+    """
+
+    with _listeners_lock:
+        queue = SimpleQueue()
+        listener = QueueListener(queue, handler, respect_handler_level=True)
+        queue_handler = LazyQueueHandler(queue)
+
+        _listeners[logger_name] = (listener, queue_handler, handler)
+        listener.start()
+
+        return queue_handler
+
+def stop_listener(logger):
+    """
+    Write out the queued records for the logger and stop its listener. The handler that the listener
+    wrote to is added to the logger directly so that later messages are still written.
+
+    Arguments:
+    logger -- The logger
+    """
+
+    with _listeners_lock:
+        entry = _listeners.pop(logger.name, None)
+
+        if entry is None:
+            return
+
+        listener, queue_handler, handler = entry
+
+        # Swap the handlers before stopping the listener so that no records are left on the queue
+        handler.modular_alert_handler = True
+        logger.addHandler(handler)
+        logger.removeHandler(queue_handler)
+
+        listener.stop()
+
+def stop_all_listeners():
+    """
+    Stop all of the listeners (this is called when the interpreter exits).
+    """
+
+    import logging
+
+    for logger_name in list(_listeners.keys()):
+        stop_listener(logging.getLogger(logger_name))
+
+atexit.register(stop_all_listeners)
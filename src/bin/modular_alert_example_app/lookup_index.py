@@ -0,0 +1,362 @@
+"""
+This module contains an on-disk hash index of a CSV lookup file so that alerts can enrich their
+results against large lookups (e.g. tables of assets or identities) without loading them.
+
+Loading a lookup with millions of rows into a dictionary takes seconds and hundreds of megabytes,
+and Splunk runs a new process for each alert. Instead, the lookup is converted once into an index
+file: the rows (each encoded as JSON) followed by an open-addressed hash table of the key field. The
+index is memory-mapped, so a look-up only touches the pages that it needs and the pages are shared
+through the page cache by every process that uses the same index. The index records the size and
+modification time of the lookup file and is rebuilt (and atomically swapped in) when they change.
+
+The layout of the index file is:
+
+ * the header (see HEADER)
+ * the names of the columns (as a JSON list)
+ * the rows, each a 4-byte length followed by a JSON list of the values
+ * the hash table: for each bucket, the 8-byte hash of the key and the offset of its row (0 if empty)
+"""
+
+import array
+import csv
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from modular_alert_example_app.results import open_results_file
+
+# The magic number, the index of the key column, the length of the column names, the size and
+# modification time of the lookup file, the number of rows and buckets and the offset of the hash table
+HEADER = struct.Struct('<8sIIQqQQQ')
+MAGIC = b'MALKUP01'
+
+BUCKET = struct.Struct('<QQ')
+RECORD_LENGTH = struct.Struct('<I')
+
+# The maximum fraction of the buckets that are used (the rest keep the probe sequences short)
+MAX_LOAD_FACTOR = 0.7
+
+class LookupIndexException(Exception):
+    """
+    Raised when an index file is invalid or doesn't match its lookup file.
+    """
+    pass
+
+def hash_key(key):
+    """
+    Get the 64-bit hash of a key (Python's hash() can't be used since it differs between processes).
+    """
+
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def build_lookup_index(lookup_file, key_field, index_path):
+    """
+    Build the index of a lookup file. The index is written to a temporary file that then replaces
+    the index file so that processes using the existing index are unaffected. The first row with
+    a given key is the one that is returned by look-ups (like Splunk's lookups).
+
+    Arguments:
+    lookup_file -- The path to the CSV lookup file (which may be gzipped)
+    key_field -- The column to look the rows up by
+    index_path -- The path of the index file
+    """
+
+    source = os.stat(lookup_file)
+    directory = os.path.dirname(os.path.abspath(index_path))
+
+    fd, temp_path = tempfile.mkstemp(prefix='.lookup_index_', dir=directory)
+
+    try:
+        with os.fdopen(fd, 'w+b') as index_fp, open_results_file(lookup_file) as lookup_fp:
+            reader = csv.reader(lookup_fp)
+
+            try:
+                fields = next(reader)
+            except StopIteration:
+                fields = []
+
+            if key_field not in fields:
+                raise LookupIndexException("The lookup file %s doesn't have a column named '%s'" % (lookup_file, key_field))
+
+            key_index = fields.index(key_field)
+            fields_data = json.dumps(fields).encode('utf-8')
+
+            index_fp.write(b'\x00' * HEADER.size)
+            index_fp.write(fields_data)
+
+            # The hashes and the offsets of the rows (these take 16 bytes per row while the index is built)
+            hashes = array.array('Q')
+            offsets = array.array('Q')
+
+            offset = HEADER.size + len(fields_data)
+            dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+            for values in reader:
+                if len(values) <= key_index:
+                    continue
+
+                data = dumps(values).encode('utf-8')
+                index_fp.write(RECORD_LENGTH.pack(len(data)))
+                index_fp.write(data)
+
+                hashes.append(hash_key(values[key_index]))
+                offsets.append(offset)
+                offset += RECORD_LENGTH.size + len(data)
+
+            index_fp.flush()
+
+            def read_key(row_offset):
+                length, = RECORD_LENGTH.unpack(os.pread(index_fp.fileno(), RECORD_LENGTH.size, row_offset))
+                return json.loads(os.pread(index_fp.fileno(), length, row_offset + RECORD_LENGTH.size).decode('utf-8'))[key_index]
+
+            # Use a power of two of buckets so that the bucket of a hash is a mask of it
+            bucket_count = 1
+
+            while bucket_count * MAX_LOAD_FACTOR < len(hashes) + 1:
+                bucket_count *= 2
+
+            table = array.array('Q', bytes(BUCKET.size * bucket_count))
+            mask = bucket_count - 1
+            row_count = 0
+
+            for key_hash, row_offset in zip(hashes, offsets):
+                bucket = key_hash & mask
+
+                while True:
+                    existing_offset = table[bucket * 2 + 1]
+
+                    if existing_offset == 0:
+                        table[bucket * 2] = key_hash
+                        table[bucket * 2 + 1] = row_offset
+                        row_count += 1
+                        break
+
+                    # Only keep the first row with a key (the other rows stay in the file but can't be found)
+                    if table[bucket * 2] == key_hash and read_key(existing_offset) == read_key(row_offset):
+                        break
+
+                    bucket = (bucket + 1) & mask
+
+            hashes = offsets = None
+
+            # Align the table to 8 bytes
+            padding = -offset % 8
+            index_fp.write(b'\x00' * padding)
+            table_offset = offset + padding
+
+            table.tofile(index_fp)
+
+            index_fp.seek(0)
+            index_fp.write(HEADER.pack(MAGIC, key_index, len(fields_data), source.st_size, source.st_mtime_ns, row_count, bucket_count, table_offset))
+
+        os.replace(temp_path, index_path)
+
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+class LookupIndex(object):
+    """
+    A memory-mapped index of a lookup file (see the module description). Use open_lookup_index() to
+    get an index that is up to date with its lookup file.
+    """
+
+    def __init__(self, index_path):
+        """
+        Open an index file.
+
+        Arguments:
+        index_path -- The path of the index file
+        """
+
+        self.index_path = index_path
+
+        with open(index_path, 'rb') as index_fp:
+            size = os.fstat(index_fp.fileno()).st_size
+
+            if size < HEADER.size:
+                raise LookupIndexException("The lookup index %s is incomplete" % index_path)
+
+            self._map = mmap.mmap(index_fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.key_index, fields_length, self.source_size, self.source_mtime_ns, self.row_count, self.bucket_count, self.table_offset = HEADER.unpack_from(self._map, 0)
+
+        if magic != MAGIC or self.table_offset + self.bucket_count * BUCKET.size > size:
+            self.close()
+            raise LookupIndexException("The lookup index %s is invalid" % index_path)
+
+        self.fields = json.loads(self._map[HEADER.size:HEADER.size + fields_length].decode('utf-8'))
+        self.key_field = self.fields[self.key_index]
+
+    def is_current(self, lookup_file, key_field):
+        """
+        Determine whether the index is of the current version of the lookup file.
+
+        Arguments:
+        lookup_file -- The path to the lookup file
+        key_field -- The column that the rows are looked up by
+        """
+
+        try:
+            source = os.stat(lookup_file)
+        except OSError:
+            return False
+
+        return self.key_field == key_field and source.st_size == self.source_size and source.st_mtime_ns == self.source_mtime_ns
+
+    def get_values(self, key):
+        """
+        Get the values of the row with the key (as a list in the order of the "fields" attribute)
+        or None if there isn't a row with the key.
+
+        Arguments:
+        key -- The value of the key field
+        """
+
+        key_hash = hash_key(key)
+        mask = self.bucket_count - 1
+        bucket = key_hash & mask
+
+        unpack_bucket = BUCKET.unpack_from
+        table_offset = self.table_offset
+
+        while True:
+            bucket_hash, offset = unpack_bucket(self._map, table_offset + bucket * BUCKET.size)
+
+            if offset == 0:
+                return None
+
+            if bucket_hash == key_hash:
+                length, = RECORD_LENGTH.unpack_from(self._map, offset)
+                start = offset + RECORD_LENGTH.size
+                values = json.loads(self._map[start:start + length].decode('utf-8'))
+
+                if values[self.key_index] == key:
+                    return values
+
+            bucket = (bucket + 1) & mask
+
+    def get(self, key):
+        """
+        Get the row with the key as a dictionary (or None if there isn't a row with the key).
+
+        Arguments:
+        key -- The value of the key field
+        """
+
+        values = self.get_values(key)
+
+        return dict(zip(self.fields, values)) if values is not None else None
+
+    def enrich(self, rows, key_field, output_fields=None):
+        """
+        Add the fields of the lookup row matching each of the rows to a copy of the row. Each
+        distinct key is only looked up once. Returns a list of the rows; rows without a match
+        are returned as they are.
+
+        Arguments:
+        rows -- An iterable of dictionaries representing the search results
+        key_field -- The field of the rows whose value is looked up
+        output_fields -- A list of the columns of the lookup to add (defaults to all but the key column)
+        """
+
+        if output_fields is None:
+            output_fields = [field for field in self.fields if field != self.key_field]
+
+        columns = [(field, self.fields.index(field)) for field in output_fields]
+        matches = {}
+        enriched = []
+
+        for row in rows:
+            key = row.get(key_field)
+
+            if not key or not isinstance(key, str):
+                enriched.append(row)
+                continue
+
+            if key in matches:
+                match = matches[key]
+            else:
+                values = self.get_values(key)
+                match = matches[key] = dict((field, values[column]) for field, column in columns if column < len(values)) if values is not None else None
+
+            if match is None:
+                enriched.append(row)
+            else:
+                row = dict(row)
+                row.update(match)
+                enriched.append(row)
+
+        return enriched
+
+    def __len__(self):
+        return self.row_count
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+def get_index_name(lookup_file, key_field):
+    """
+    Get the file name of the index of a lookup file (made of the lookup's name, the key and a digest
+    of the lookup's path so that lookups with the same name in different apps don't collide).
+
+    Arguments:
+    lookup_file -- The path to the lookup file
+    key_field -- The column that the rows are looked up by
+    """
+
+    digest = hashlib.sha1(os.path.abspath(lookup_file).encode('utf-8')).hexdigest()[:12]
+    key_name = ''.join(character if character.isalnum() else '_' for character in key_field)
+
+    return '%s.%s.%s.idx' % (os.path.basename(lookup_file), key_name, digest)
+
+def open_lookup_index(lookup_file, key_field, index_path):
+    """
+    Open the index of a lookup file, building it first if it doesn't exist or if the lookup file
+    changed since it was built. A lock file makes concurrent processes wait for the process that
+    is building the index instead of building it too.
+
+    Arguments:
+    lookup_file -- The path to the lookup file
+    key_field -- The column that the rows are looked up by
+    index_path -- The path of the index file (see get_index_name())
+    """
+
+    def open_current():
+        try:
+            index = LookupIndex(index_path)
+        except (IOError, OSError, LookupIndexException):
+            return None
+
+        if index.is_current(lookup_file, key_field):
+            return index
+
+        index.close()
+        return None
+
+    index = open_current()
+
+    if index is not None:
+        return index
+
+    with open(index_path + '.lock', 'a') as lock_fp:
+        fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+
+        try:
+            # Another process may have built the index while this one waited for the lock
+            index = open_current()
+
+            if index is None:
+                build_lookup_index(lookup_file, key_field, index_path)
+                index = LookupIndex(index_path)
+
+        finally:
+            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_UN)
+
+    return index
@@ -1,27 +1,86 @@
 import logging
-from logging import handlers
 import traceback
 import sys
 import re
 import os
-import json
-import socket # Used for IP Address validation
+import time
+import math
+import threading
+from contextlib import contextmanager, nullcontext
 
-try:
-    from urlparse import urlparse
-except:
-    from urllib.parse import urlparse
+# The modules below are imported where they are used (rather than here) since the alert runs in a
+# new process each time and so the time taken to import modules is added to every alert. Use
+# "python -X importtime" (or tests/benchmark.py startup) to check the import time.
 
-try:
-    basestring
-except:
-    basestring = str
-
-from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+from modular_alert_example_app.events import EventEncoder, JSONEventEncoder, EventWriter, escape_value
 
 class FieldValidationException(Exception):
     pass
 
+class FieldValidationErrors(FieldValidationException):
+    """
+    Raised when validation was asked to collect all of the errors instead of stopping at the first one.
+    """
+    
+    def __init__(self, errors):
+        """
+        Arguments:
+        errors -- A list of the FieldValidationException instances that were raised
+        """
+        
+        super(FieldValidationErrors, self).__init__("; ".join(str(e) for e in errors))
+        self.errors = errors
+
+# The exceptions that indicate that a value is invalid when converting a column of values (see Field.to_python_many)
+CONVERSION_ERRORS = (FieldValidationException, ValueError, TypeError, AttributeError)
+
+# Marks the values that couldn't be converted
+_INVALID = object()
+
+def _get_numpy():
+    """
+    Get the NumPy module (or None if it isn't installed).
+    """
+    
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+def _to_python_many_numeric(field, values, convert, as_array, to_python):
+    """
+    Convert a column of values using the given conversion function (int or float). This is used by
+    IntegerField and FloatField to convert the entire column at once in the common case where all of
+    the values are valid; otherwise, each value is converted individually by to_python_many().
+    """
+    
+    # Use the generic conversion if the sub-class changed how the values are converted
+    if type(field).to_python is not to_python:
+        converted, errors = Field.to_python_many(field, values)
+    
+    else:
+        try:
+            converted = list(map(convert, values))
+            errors = bytearray(len(values))
+            
+            # Make sure that the values are within the bounds
+            if len(converted) > 0 and ((field.min_value is not None and min(converted) < field.min_value) or (field.max_value is not None and max(converted) > field.max_value)):
+                converted, errors = Field.to_python_many(field, values)
+            
+        except (ValueError, TypeError):
+            converted, errors = Field.to_python_many(field, values)
+    
+    numpy = _get_numpy() if as_array else None
+    
+    if numpy is None:
+        return converted, errors
+    
+    if convert is int:
+        return numpy.array([0 if value is None else value for value in converted], dtype=numpy.int64), errors
+    else:
+        return numpy.array([float('nan') if value is None else value for value in converted], dtype=numpy.float64), errors
+
 class Field(object):
     """
     This is the base class that should be used to for field validators. Sub-class this and override to_python if you need custom validation.
@@ -84,6 +143,69 @@ class Field(object):
         """
         
         return str(value)
+    
+    def to_python_many(self, values, as_array=False):
+        """
+        Convert a column of values (e.g. a field from many search results) to Python objects. Returns
+        a tuple of the converted values and an error mask (a bytearray with a non-zero entry for each
+        value that was invalid). Unlike to_python(), no exception is raised for invalid values; their
+        converted value is None instead.
+        
+        Arguments:
+        values -- A list of the values to convert
+        as_array -- If true and NumPy is available, numeric fields return the converted values as a NumPy array (with zero or NaN for the invalid values)
+        """
+        
+        converted = []
+        errors = bytearray(len(values))
+        append = converted.append
+        to_python = self.to_python
+        
+        for index, value in enumerate(values):
+            try:
+                append(to_python(value))
+            except CONVERSION_ERRORS:
+                append(None)
+                errors[index] = 1
+        
+        return converted, errors
+    
+    def _to_python_many_memoized(self, values):
+        """
+        Convert a column of values like to_python_many() but only convert each distinct value once.
+        This must only be used by fields whose converted values are immutable.
+        """
+        
+        converted = []
+        errors = bytearray(len(values))
+        append = converted.append
+        to_python = self.to_python
+        memo = {}
+        
+        for index, value in enumerate(values):
+            try:
+                result = memo[value]
+            except KeyError:
+                try:
+                    result = to_python(value)
+                except CONVERSION_ERRORS:
+                    result = _INVALID
+                
+                memo[value] = result
+            except TypeError:
+                # The value isn't hashable
+                try:
+                    result = to_python(value)
+                except CONVERSION_ERRORS:
+                    result = _INVALID
+            
+            if result is _INVALID:
+                append(None)
+                errors[index] = 1
+            else:
+                append(result)
+        
+        return converted, errors
 
 
 class BooleanField(Field):
@@ -101,6 +223,46 @@ class BooleanField(Field):
             return False
         
         raise FieldValidationException("The value of '%s' for the '%s' parameter is not a valid boolean" % (str(value), self.name))
+    
+    # The boolean value of the recognized strings (after stripping and converting to lower-case)
+    BOOLEAN_STRINGS = {
+        'true' : True,
+        '1' : True,
+        'false' : False,
+        '0' : False
+    }
+    
+    def to_python_many(self, values, as_array=False):
+        
+        # Use the generic conversion if the sub-class changed how the values are converted
+        if type(self).to_python is not BooleanField.to_python:
+            return Field.to_python_many(self, values)
+        
+        converted = []
+        errors = bytearray(len(values))
+        append = converted.append
+        strings = self.BOOLEAN_STRINGS
+        
+        for index, value in enumerate(values):
+            
+            # Strings are looked up directly; other values (e.g. booleans) are converted individually
+            if value.__class__ is str:
+                result = strings.get(value)
+                
+                if result is None:
+                    result = strings.get(value.strip().lower())
+            else:
+                try:
+                    result = self.to_python(value)
+                except CONVERSION_ERRORS:
+                    result = None
+            
+            if result is None:
+                errors[index] = 1
+            
+            append(result)
+        
+        return converted, errors
 
     def to_string(self, value):
 
@@ -135,6 +297,36 @@ class ListField(Field):
         return ""
     
     
+class ChoiceField(Field):
+    """
+    Represents a value that must be one of a fixed set of choices.
+    """
+    
+    def __init__(self, name, choices, none_allowed=False, empty_allowed=True):
+        """
+        Create the field.
+        
+        Arguments:
+        name -- Set the name of the field (e.g. "database_server")
+        choices -- A list of the allowed values
+        none_allowed -- Is a value of none allowed?
+        empty_allowed -- Is an empty string allowed?
+        """
+        
+        super(ChoiceField, self).__init__(name, none_allowed=none_allowed, empty_allowed=empty_allowed)
+        
+        self.choices = choices[:]
+    
+    def to_python(self, value):
+        
+        Field.to_python(self, value)
+        
+        if value is None or value in self.choices:
+            return value
+        
+        raise FieldValidationException("The value of '%s' for the '%s' parameter is not valid (must be one of: %s)" % (str(value), self.name, ", ".join(self.choices)))
+    
+    
 class RegexField(Field):
     
     def to_python(self, value):
@@ -159,18 +351,46 @@ class RegexField(Field):
 
 class IntegerField(Field):
     
+    def __init__(self, name, none_allowed=False, empty_allowed=True, min_value=None, max_value=None):
+        """
+        Create the field.
+        
+        Arguments:
+        name -- Set the name of the field (e.g. "database_server")
+        none_allowed -- Is a value of none allowed?
+        empty_allowed -- Is an empty string allowed?
+        min_value -- The lowest value allowed (or None if there is no lower bound)
+        max_value -- The highest value allowed (or None if there is no upper bound)
+        """
+        
+        super(IntegerField, self).__init__(name, none_allowed=none_allowed, empty_allowed=empty_allowed)
+        
+        self.min_value = min_value
+        self.max_value = max_value
+    
     def to_python(self, value):
         
         Field.to_python(self, value)
         
         if value is not None:
             try:
-                return int(value)
+                int_value = int(value)
             except ValueError as e:
                 raise FieldValidationException(str(e))
+            
+            if self.min_value is not None and int_value < self.min_value:
+                raise FieldValidationException("The value for the '%s' parameter must be at least %i" % (self.name, self.min_value))
+            
+            if self.max_value is not None and int_value > self.max_value:
+                raise FieldValidationException("The value for the '%s' parameter must not be greater than %i" % (self.name, self.max_value))
+            
+            return int_value
         else:
             return None
     
+    def to_python_many(self, values, as_array=False):
+        return _to_python_many_numeric(self, values, int, as_array, IntegerField.to_python)
+    
     def to_string(self, value):
 
         if value is not None:
@@ -184,18 +404,46 @@ class IntegerField(Field):
     
 class FloatField(Field):
     
+    def __init__(self, name, none_allowed=False, empty_allowed=True, min_value=None, max_value=None):
+        """
+        Create the field.
+        
+        Arguments:
+        name -- Set the name of the field (e.g. "database_server")
+        none_allowed -- Is a value of none allowed?
+        empty_allowed -- Is an empty string allowed?
+        min_value -- The lowest value allowed (or None if there is no lower bound)
+        max_value -- The highest value allowed (or None if there is no upper bound)
+        """
+        
+        super(FloatField, self).__init__(name, none_allowed=none_allowed, empty_allowed=empty_allowed)
+        
+        self.min_value = min_value
+        self.max_value = max_value
+    
     def to_python(self, value):
         
         Field.to_python(self, value)
         
         if value is not None:
             try:
-                return float(value)
+                float_value = float(value)
             except ValueError as e:
                 raise FieldValidationException(str(e))
+            
+            if self.min_value is not None and float_value < self.min_value:
+                raise FieldValidationException("The value for the '%s' parameter must be at least %s" % (self.name, self.min_value))
+            
+            if self.max_value is not None and float_value > self.max_value:
+                raise FieldValidationException("The value for the '%s' parameter must not be greater than %s" % (self.name, self.max_value))
+            
+            return float_value
         else:
             return None
     
+    def to_python_many(self, values, as_array=False):
+        return _to_python_many_numeric(self, values, float, as_array, FloatField.to_python)
+    
     def to_string(self, value):
 
         if value is not None:
@@ -244,6 +492,9 @@ class URLField(Field):
     
     @classmethod
     def parse_url(cls, value, name):
+        
+        from urllib.parse import urlparse
+        
         parsed_value = urlparse(value)
         
         if parsed_value.hostname is None or len(parsed_value.hostname) <= 0:
@@ -319,6 +570,11 @@ class DurationField(Field):
             return duration * DurationField.UNITS[units]
         else:
             return duration
+    
+    def to_python_many(self, values, as_array=False):
+        
+        # Durations tend to repeat so only parse each distinct value once
+        return self._to_python_many_memoized(values)
 
     def to_string(self, value):        
         return str(value)
@@ -338,6 +594,8 @@ class IPAddressField(Field):
     
     def to_python(self, value):
         
+        import socket
+        
         v = Field.to_python(self, value)
         
         try:
@@ -346,11 +604,310 @@ class IPAddressField(Field):
         except socket.error:
             # Not legal
             raise FieldValidationException('This IP is not a valid address, value="' + v + '"')
+    
+    def to_python_many(self, values, as_array=False):
+        
+        # The same addresses tend to appear in many results so only check each distinct value once
+        return self._to_python_many_memoized(values)
+        
+
+class ParameterSchema(object):
+    """
+    A set of parameters that has been compiled into an index by name so that arguments can be
+    validated without searching through the list of parameters.
+    """
+    
+    def __init__(self, parameters, allow_unknown=False):
+        """
+        Compile the schema.
+        
+        Arguments:
+        parameters -- A list of Field instances
+        allow_unknown -- If true, values without a matching parameter are passed through unchanged instead of being rejected
+        """
+        
+        self.parameters = parameters[:]
+        self.allow_unknown = allow_unknown
+        
+        # Index the converter for each parameter by name (a later parameter with the same name takes precedence)
+        self.converters = dict((parameter.name, parameter.to_python) for parameter in parameters)
+    
+    def __contains__(self, name):
+        return name in self.converters
+    
+    def _validate(self, arguments, errors=None):
+        """
+        Validate the arguments and return a dictionary of cleaned/converted parameters. The first
+        error is raised unless a list is provided for collecting the errors.
+        """
+        
+        converters = self.converters
+        cleaned_params = {}
+        
+        for name, value in arguments.items():
+            
+            converter = converters.get(name)
+            
+            try:
+                if converter is not None:
+                    cleaned_params[name] = converter(value)
+                elif self.allow_unknown:
+                    cleaned_params[name] = value
+                else:
+                    raise FieldValidationException("The argument '%s' is not valid" % (name))
+                
+            except FieldValidationException as e:
+                if errors is None:
+                    raise
+                
+                errors.append(e)
+        
+        return cleaned_params
+    
+    def validate(self, arguments, fail_fast=True):
+        """
+        Validate the arguments and return a dictionary of cleaned/converted parameters.
+        
+        Arguments:
+        arguments -- A dictionary of arguments
+        fail_fast -- If true, the first invalid argument raises a FieldValidationException; otherwise, a FieldValidationErrors containing every error is raised once all of the arguments have been checked
+        """
+        
+        if fail_fast:
+            return self._validate(arguments)
+        
+        errors = []
+        cleaned_params = self._validate(arguments, errors)
+        
+        if len(errors) > 0:
+            raise FieldValidationErrors(errors)
+        
+        return cleaned_params
+    
+    def validate_many(self, arguments_list, fail_fast=True):
+        """
+        Validate each of the dictionaries (e.g. configurations or search results) in a single pass,
+        yielding a tuple of the cleaned parameters and the list of errors for each one.
+        
+        Arguments:
+        arguments_list -- An iterable of dictionaries of arguments
+        fail_fast -- If true, the first invalid argument raises a FieldValidationException (and the list of errors will always be empty); otherwise, the cleaned parameters will contain only the valid arguments
+        """
+        
+        validate = self._validate
+        
+        for arguments in arguments_list:
+            if fail_fast:
+                yield validate(arguments), []
+            else:
+                errors = []
+                yield validate(arguments, errors), errors
+
+class PhaseTimer(object):
+    """
+    Records the wall-clock and CPU time spent in each phase of the execution of an alert. The time
+    spent in a phase that is entered more than once is accumulated.
+    
+    Note that the CPU time is for the entire process (including the time used by other threads).
+    """
+    
+    def __init__(self):
+        self.wall_times = {}
+        self.cpu_times = {}
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def add(self, name, wall_time, cpu_time):
+        """
+        Add the time spent in a phase.
+        
+        Arguments:
+        name -- The name of the phase (e.g. "run")
+        wall_time -- The wall-clock time in seconds
+        cpu_time -- The CPU time in seconds
+        """
+        
+        with self._lock:
+            self.wall_times[name] = self.wall_times.get(name, 0.0) + wall_time
+            self.cpu_times[name] = self.cpu_times.get(name, 0.0) + cpu_time
+    
+    @contextmanager
+    def phase(self, name):
+        """
+        Record the time spent within the "with" block as the given phase.
+        
+        Arguments:
+        name -- The name of the phase (e.g. "run")
+        """
+        
+        wall_start = time.time()
+        cpu_start = time.process_time()
+        
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - wall_start, time.process_time() - cpu_start)
+    
+    def to_dict(self):
+        """
+        Get the times as a dictionary with a "<phase>_wall_ms" and "<phase>_cpu_ms" entry for each phase.
+        """
+        
+        metrics = {}
+        
+        for name in self.wall_times:
+            metrics[name + '_wall_ms'] = round(self.wall_times[name] * 1000, 3)
+            metrics[name + '_cpu_ms'] = round(self.cpu_times[name] * 1000, 3)
         
+        return metrics
+
+# Serializes the setup of the handlers of the loggers (see ModularAlert.logger)
+_log_handlers_lock = threading.Lock()
+
+# The kinds of executors that can be used to run the alert against each of the results
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+
+# The ways that actions beyond the rate limit are handled: wait until they are allowed or drop them
+RATE_LIMIT_BLOCK = 'block'
+RATE_LIMIT_DROP = 'drop'
+
+# The formats that events can be output in: escaped key-value pairs or JSON lines (see ModularAlert.output_events())
+OUTPUT_FORMAT_KV = 'kv'
+OUTPUT_FORMAT_JSON = 'json'
+
+# The ways that the results can be read ahead of the alert: by a thread or by another process (see prefetch.py)
+PREFETCH_THREAD = 'thread'
+PREFETCH_PROCESS = 'process'
+
+# The key-value encoders shared by create_event_string() and make_event_encoder(), one for each value of encapsulate_value_in_double_quotes
+_event_encoders = {
+    False : EventEncoder(False),
+    True : EventEncoder(True)
+}
+
+# The reason logged for a result whose run() returned False (see ModularAlert.record_failure())
+RUN_RETURNED_FALSE = "run() returned False"
+
+# Protects the count of the actions that were dropped by the rate limiter (see ModularAlert.acquire_rate_limit())
+_rate_limited_lock = threading.Lock()
+
+def get_peak_rss():
+    """
+    Get the peak resident set size of the process in kilobytes (or None if it isn't available on this platform).
+    """
+    
+    try:
+        import resource
+    except ImportError:
+        return None
+    
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    # macOS reports the size in bytes instead of kilobytes
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    
+    return peak_rss
+
+# This is the alert instance used by the workers of the process executor (see ModularAlert.dispatch)
+_worker_alert = None
+
+def _init_worker(alert):
+    global _worker_alert
+    _worker_alert = alert
+
+def _run_in_worker(cleaned_params, payload):
+    return _worker_alert.run(cleaned_params, payload)
 
 class ModularAlert(object):
     
-    def __init__(self, parameters=None, logger_name='python_modular_alert', log_level=logging.INFO, log_to_file=False):
+    # These parameters control how the alert is executed and are handled by ModularAlert itself
+    # instead of being passed to run(). A sub-class can still declare a parameter with the same name
+    # in which case the sub-class's parameter takes precedence.
+    EXECUTION_PARAMETERS = [
+        IntegerField("batch_size", none_allowed=True, min_value=1),
+        ChoiceField("executor", [EXECUTOR_THREAD, EXECUTOR_PROCESS], none_allowed=True),
+        IntegerField("max_workers", none_allowed=True, min_value=1),
+        BooleanField("ordered"),
+        FloatField("max_failure_ratio", min_value=0.0, max_value=1.0),
+        BooleanField("log_metrics"),
+        BooleanField("profile"),
+        ListField("dedup_fields", none_allowed=True),
+        DurationField("dedup_ttl"),
+        IntegerField("dedup_max_entries", min_value=1),
+        BooleanField("spool_failures"),
+        BooleanField("results_index"),
+        FloatField("rate_limit", none_allowed=True, min_value=0.0),
+        IntegerField("rate_limit_burst", none_allowed=True, min_value=1),
+        ChoiceField("rate_limit_mode", [RATE_LIMIT_BLOCK, RATE_LIMIT_DROP]),
+        BooleanField("validation_cache"),
+        IntegerField("memory_budget", none_allowed=True, min_value=1),
+        BooleanField("trace_memory"),
+        ChoiceField("output_format", [OUTPUT_FORMAT_KV, OUTPUT_FORMAT_JSON]),
+        ChoiceField("prefetch", [PREFETCH_THREAD, PREFETCH_PROCESS], none_allowed=True),
+        ListField("group_by", none_allowed=True),
+        ListField("group_distinct", none_allowed=True),
+        IntegerField("group_max_distinct", min_value=1),
+        DurationField("rest_cache_ttl"),
+        Field("lookup_file", none_allowed=True)
+    ]
+    
+    # The values of the execution parameters that are used when they are not configured
+    execution_defaults = {
+        'batch_size' : None,
+        'executor' : None,
+        'max_workers' : None,
+        'ordered' : True,
+        'max_failure_ratio' : 0.0,
+        'log_metrics' : False,
+        'profile' : False,
+        'dedup_fields' : None,
+        'dedup_ttl' : 86400,
+        'dedup_max_entries' : 100000,
+        'spool_failures' : False,
+        'results_index' : False,
+        'rate_limit' : None,
+        'rate_limit_burst' : None,
+        'rate_limit_mode' : RATE_LIMIT_BLOCK,
+        'validation_cache' : False,
+        'memory_budget' : None,
+        'trace_memory' : False,
+        'output_format' : OUTPUT_FORMAT_KV,
+        'prefetch' : None,
+        'group_by' : None,
+        'group_distinct' : None,
+        'group_max_distinct' : 100,
+        'rest_cache_ttl' : 60,
+        'lookup_file' : None
+    }
+    
+    # The number of results that are processed at once when an executor is used but no batch size is set
+    DEFAULT_BATCH_SIZE = 1000
+    
+    # The number of times that a spooled execution is replayed before it is given up on (see replay())
+    MAX_REPLAY_ATTEMPTS = 5
+    
+    # Indicates whether validated configurations are remembered (see validate_configuration()); turn
+    # this off for alerts whose validate() depends on more than the configuration
+    memoize_validation = True
+    
+    # The number of seconds that the configurations validated by other processes are remembered for (see the "validation_cache" parameter)
+    VALIDATION_CACHE_TTL = 86400
+    
+    # The number of the lines that allocated the most memory that are logged when the "trace_memory" parameter is set
+    MEMORY_TRACE_LINES = 10
+    
+    def __init__(self, parameters=None, logger_name='python_modular_alert', log_level=logging.INFO, log_to_file=False, log_async=False):
         """
         Set up the modular alert.
             
@@ -359,6 +916,7 @@ class ModularAlert(object):
         logger_name -- The logger name to append to the logger
         log_level -- The log level of the logger
         log_to_file -- Indicates whether the log messages should be sent to a log file or just outputted to Splunk via standard output
+        log_async -- Indicates whether the log messages should be formatted and written by a background thread (make sure to call shutdown() so that the queued messages are written)
         """
          
         if parameters is None:
@@ -375,7 +933,56 @@ class ModularAlert(object):
         self.logger_name = logger_name
         self.log_level = log_level
         self.log_to_file = log_to_file
+        self.log_async = log_async
         self._logger = None
+        self._schema = None
+        self._validation_signature = None
+        
+        # These are populated when execute() is called
+        self.payload = None
+        self.execution_params = dict(self.execution_defaults)
+        self.result_count = 0
+        self.failure_count = 0
+        self.failed_rows = []
+        self.rate_limited_count = 0
+        self.group_count = 0
+        self._executor = None
+        self._replay_rows = None
+        self._seen_fingerprints = []
+        self._row_buffers = []
+        self._json_encoders = {}
+        self._shared_results = None
+        self.timer = PhaseTimer()
+        
+        # The directory where state (such as caches) is stored between invocations (defaults to a directory under $SPLUNK_HOME/var/lib/splunk/modalerts)
+        self.state_dir = None
+        self._result_cache = None
+        self._spool = None
+        self._rate_limiter = None
+        self._validation_store = None
+        self._rest_client = None
+        self._lookup_indexes = {}
+        
+        # The stream that output_event() and output_events() write to by default (None for standard output)
+        self.output_stream = None
+    
+    def __getstate__(self):
+        # Don't include the executor or open files when the alert is sent to the workers of a process executor
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_result_cache'] = None
+        state['_spool'] = None
+        state['_rate_limiter'] = None
+        state['_validation_store'] = None
+        state['_rest_client'] = None
+        state['_lookup_indexes'] = {}
+        state['_row_buffers'] = []
+        state['_json_encoders'] = {}
+        state['_shared_results'] = None
+        state['_seen_fingerprints'] = []
+        state['output_stream'] = None
+        
+        return state
     
     @classmethod
     def escape_spaces(cls, s, encapsulate_in_double_quotes=False):
@@ -387,20 +994,8 @@ class ModularAlert(object):
         encapsulate_in_double_quotes -- If true, the value will have double-spaces added around it.
         """
         
-        # Make sure the input is a string
-        if s is not None:
-            s = str(s)
-        
-        # Escape the spaces within the string (will need KV_MODE = auto_escaped for this to work)
-        if s is not None:
-            s = s.replace('"', '\\"')
-            s = s.replace("'", "\\'")
-        
-        if s is not None and (" " in s or encapsulate_in_double_quotes):
-            return '"' + s + '"'
-        
-        else:
-            return s
+        # Escape the quotes within the string (will need KV_MODE = auto_escaped for this to work)
+        return escape_value(s, encapsulate_in_double_quotes)
     
     @classmethod
     def create_event_string(cls, data_dict, encapsulate_value_in_double_quotes=False):
@@ -412,34 +1007,38 @@ class ModularAlert(object):
         encapsulate_value_in_double_quotes -- If true, the value will have double-spaces added around it.
         """
         
-        # Make the content of the event
-        data_str = ''
+        return _event_encoders[bool(encapsulate_value_in_double_quotes)].encode(data_dict)
         
-        for k, v in data_dict.items():
-            
-            # If the value is a list, then write out each matching value with the same name (as mv)
-            if isinstance(v, list) and not isinstance(v, basestring):
-                values = v
-            else:
-                values = [v]
-            
-            k_escaped = cls.escape_spaces(k)
-            
-            # Write out each value
-            for v in values:
-                v_escaped = cls.escape_spaces(v, encapsulate_in_double_quotes=encapsulate_value_in_double_quotes)
-                
-                
-                if len(data_str) > 0:
-                    data_str += ' '
-                
-                data_str += '%s=%s' % (k_escaped, v_escaped)
+    def make_event_encoder(self, index=None, sourcetype=None, source=None, host=None):
+        """
+        Get the encoder for the events that are output in the format set by the "output_format"
+        parameter: an EventEncoder for key-value events or a JSONEventEncoder for JSON lines (which
+        include the index, sourcetype, source and host).
+        
+        Arguments:
+        index -- The index to send the events to
+        sourcetype -- The sourcetype
+        source -- The source to use
+        host -- The host
+        """
         
-        return data_str
+        if self.execution_params['output_format'] != OUTPUT_FORMAT_JSON:
+            return _event_encoders[False]
         
-    def output_event(self, data_dict, stanza, index=None, sourcetype=None, source=None, host=None, out=sys.stdout ):
+        key = (index, sourcetype, source, host)
+        encoder = self._json_encoders.get(key)
+        
+        if encoder is None:
+            encoder = JSONEventEncoder(index, sourcetype, source, host)
+            self._json_encoders[key] = encoder
+        
+        return encoder
+    
+    def output_event(self, data_dict, stanza, index=None, sourcetype=None, source=None, host=None, out=None ):
         """
-        Output the given event so that Splunk can see it.
+        Output the given event so that Splunk can see it. If the "output_format" parameter is "json",
+        the event is written as a line of JSON including the index, sourcetype, source and host (see
+        make_event_encoder()); otherwise, those are ignored.
         
         Arguments:
         data_dict -- A dictionary containing the fields
@@ -447,15 +1046,52 @@ class ModularAlert(object):
         sourcetype -- The sourcetype
         source -- The source to use
         index -- The index to send the event to
-        out -- The stream to send the event to (defaults to standard output)
+        out -- The stream to send the event to (defaults to the "output_stream" attribute or standard output)
         host -- The host
         """
         
-        output = self.create_event_string(data_dict)
+        if out is None:
+            out = self.output_stream if self.output_stream is not None else sys.stdout
         
-        out.write(output)
-        out.flush()
-                    
+        with self.timed_phase('output'):
+            if self.execution_params['output_format'] == OUTPUT_FORMAT_JSON:
+                output = self.make_event_encoder(index, sourcetype, source, host).encode(data_dict) + '\n'
+            else:
+                output = self.create_event_string(data_dict)
+            
+            out.write(output)
+            out.flush()
+    
+    def output_events(self, data_dicts, stanza, index=None, sourcetype=None, source=None, host=None, out=None, flush_size=65536, flush_interval=1.0):
+        """
+        Output the given events so that Splunk can see them. Unlike output_event(), the events are
+        buffered and written in bulk (once flush_size characters are buffered or flush_interval
+        seconds have passed) and each event is terminated by a newline. The events are written in
+        the format set by the "output_format" parameter (see make_event_encoder()).
+        
+        Arguments:
+        data_dicts -- An iterable of dictionaries containing the fields
+        stanza -- The stanza used for the input
+        sourcetype -- The sourcetype
+        source -- The source to use
+        index -- The index to send the event to
+        out -- The stream to send the event to (defaults to the "output_stream" attribute or standard output)
+        host -- The host
+        flush_size -- The number of buffered characters that causes the events to be written
+        flush_interval -- The number of seconds after which the buffered events are written
+        """
+        
+        encoder = self.make_event_encoder(index, sourcetype, source, host)
+        
+        if out is None:
+            out = self.output_stream if self.output_stream is not None else sys.stdout
+        
+        # Time the output as a whole (timing each event would cost about as much as encoding it)
+        with self.timer.phase('output'):
+            with EventWriter(out, encoder=encoder, flush_size=flush_size, flush_interval=flush_interval) as writer:
+                for data_dict in data_dicts:
+                    writer.write(data_dict)
+    
     def addParameter(self, parameter):
         """
         Add the given parameter to the list of parameters.
@@ -468,82 +1104,1300 @@ class ModularAlert(object):
             self.parameters = []
             
         self.parameters.append(parameter)
-        
-    def validate(self, arguments):
+        self._schema = None
+    
+    @property
+    def schema(self):
+        """
+        Get the compiled schema for the parameters (see ParameterSchema). The schema is re-compiled
+        when the parameters change (whether through addParameter() or by changing or replacing the
+        "parameters" list).
+        """
+        
+        # The schema keeps a copy of the list so comparing the lists detects any change to the parameters
+        if self._schema is None or self._schema.parameters != self.parameters:
+            self._schema = ParameterSchema(self.parameters)
+        
+        return self._schema
+        
+    def validate(self, arguments, fail_fast=True):
+        """
+        Validate the arguments and return a dictionary of cleaned/converted parameters.
+        
+        Arguments:
+        arguments -- A dictionary of arguments
+        fail_fast -- If true, stop at the first invalid argument; otherwise, raise a FieldValidationErrors containing every error
+        """
+        
+        return self.schema.validate(arguments, fail_fast=fail_fast)
+    
+    def get_validation_signature(self):
+        """
+        Get a string describing the alert's class and parameters (see validate_configuration()).
+        """
+        
+        from modular_alert_example_app.validation_cache import get_signature
+        
+        schema = self.schema
+        
+        # The signature only changes when the schema is re-compiled
+        if self._validation_signature is None or self._validation_signature[0] is not schema:
+            signature = '%s.%s:%s:%s' % (type(self).__module__, type(self).__name__, get_signature(schema.parameters), get_signature(self.EXECUTION_PARAMETERS))
+            self._validation_signature = (schema, signature)
+        
+        return self._validation_signature[1]
+    
+    @property
+    def validation_store(self):
+        """
+        Get the persistent cache of the configurations validated by previous invocations of the alert (see validate_configuration()).
+        """
+        
+        from modular_alert_example_app.cache import PersistentCache
+        
+        if self._validation_store is None:
+            self._validation_store = PersistentCache(self.get_state_path('validation_cache.db'), ttl=self.VALIDATION_CACHE_TTL, max_entries=1000)
+        
+        return self._validation_store
+    
+    def validate_configuration(self, configuration):
+        """
+        Separate the execution parameters from the configuration and validate the remaining arguments
+        (see split_execution_params() and validate()). Returns a tuple of the cleaned parameters and
+        the execution parameters.
+        
+        Since the same configuration is usually validated every time that the alert fires, the
+        results are remembered by a hash of the configuration and the parameters (so changing either
+        one results in the configuration being validated again). The process remembers the most
+        recently used configurations; if the "validation_cache" parameter is set, the configurations
+        are also remembered across invocations in a cache under $SPLUNK_HOME/var/lib/splunk/modalerts
+        (the cleaned values that can't be stored, such as compiled regular expressions, are converted
+        again from the arguments). Each call returns copies of the remembered lists, dictionaries and
+        sets (see copy_params()), so an alert that modifies its cleaned parameters doesn't change
+        them for later executions.
+        
+        Arguments:
+        configuration -- A dictionary of the arguments
+        """
+        
+        if not self.memoize_validation:
+            arguments, execution_params = self.split_execution_params(configuration)
+            return self.validate(arguments), execution_params
+        
+        from modular_alert_example_app.validation_cache import validated_configurations, get_validation_key, encode_params, decode_params, copy_params
+        
+        key = get_validation_key(self.get_validation_signature(), configuration)
+        entry = validated_configurations.get(key)
+        
+        if entry is not None:
+            return copy_params(entry[0]), copy_params(entry[1])
+        
+        arguments, execution_params = self.split_execution_params(configuration)
+        cleaned_params = None
+        
+        if execution_params['validation_cache']:
+            data = self.validation_store.get(key)
+            
+            if data is not None:
+                cleaned_params = decode_params(data, arguments, self.schema.converters)
+        
+        if cleaned_params is None:
+            cleaned_params = self.validate(arguments)
+            
+            if execution_params['validation_cache']:
+                self.validation_store.set(key, encode_params(cleaned_params))
+        
+        validated_configurations.set(key, (cleaned_params, execution_params))
+        
+        return copy_params(cleaned_params), copy_params(execution_params)
+    
+    def split_execution_params(self, arguments):
+        """
+        Separate the execution parameters (see EXECUTION_PARAMETERS) from the arguments. Returns a
+        tuple containing a dictionary of the remaining arguments and a dictionary of the cleaned
+        execution parameters. Execution parameters with a blank value get their default value.
+        
+        Arguments:
+        arguments -- A dictionary of arguments
+        """
+        
+        declared = self.schema
+        execution_fields = dict((field.name, field) for field in self.EXECUTION_PARAMETERS)
+        
+        remaining = {}
+        execution_params = dict(self.execution_defaults)
+        
+        for name, value in arguments.items():
+            
+            field = execution_fields.get(name)
+            
+            if field is None or name in declared:
+                remaining[name] = value
+            elif value is not None and len(str(value).strip()) > 0:
+                execution_params[name] = field.to_python(value)
+        
+        return remaining, execution_params
+    
+    def is_batched(self):
+        """
+        Indicates whether execute() should run the alert against each of the results (via
+        run_batch()) instead of calling run() once with the payload.
+        """
+        
+        for name in ['batch_size', 'executor', 'dedup_fields', 'group_by']:
+            if self.execution_params[name] is not None:
+                return True
+        
+        return False
+    
+    def get_state_path(self, name):
+        """
+        Get the path of a file for storing state between invocations of the alert (creating the
+        directory if necessary).
+        
+        Arguments:
+        name -- The name of the file
+        """
+        
+        if self.state_dir is None:
+            from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+            self.state_dir = make_splunkhome_path(['var', 'lib', 'splunk', 'modalerts', self.logger_name])
+        
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        
+        return os.path.join(self.state_dir, name)
+    
+    @property
+    def result_cache(self):
+        """
+        Get the cache of the fingerprints of the results that were already processed (see filter_seen()).
+        """
+        
+        from modular_alert_example_app.cache import PersistentCache
+        
+        if self._result_cache is None:
+            self._result_cache = PersistentCache(self.get_state_path('result_cache.db'), ttl=self.execution_params['dedup_ttl'], max_entries=self.execution_params['dedup_max_entries'])
+        else:
+            self._result_cache.ttl = self.execution_params['dedup_ttl']
+            self._result_cache.max_entries = self.execution_params['dedup_max_entries']
+        
+        return self._result_cache
+    
+    @property
+    def spool(self):
+        """
+        Get the spool of the failed executions (see spool_failures()).
+        """
+        
+        from modular_alert_example_app.spool import Spool
+        
+        if self._spool is None:
+            self._spool = Spool(self.get_state_path('failures.spool'))
+        
+        return self._spool
+    
+    @property
+    def rate_limiter(self):
+        """
+        Get the rate limiter that is shared by the processes running this alert (see acquire_rate_limit()).
+        """
+        
+        from modular_alert_example_app.rate_limit import RateLimiter
+        
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter(self.get_state_path('rate_limits'))
+        
+        return self._rate_limiter
+    
+    @property
+    def rest_client(self):
+        """
+        Get a client of splunkd's REST API (see rest.py) that is authenticated with the session key
+        in the payload. The client keeps its connections alive and caches the responses to GET
+        requests for "rest_cache_ttl" seconds, so use it (and batch_get() for looking up entries for
+        many results) rather than opening a connection for each request:
+            
+            path = self.rest_client.get_namespace_path('storage/collections/data/assets')
+            assets = self.rest_client.batch_get([(path, {'query' : json.dumps({'ip' : row['src']})}) for row in rows])
+        
+        The client is kept between executions (e.g. by a worker) as long as the session key doesn't change.
+        """
+        
+        from modular_alert_example_app.rest import SplunkdClient
+        
+        payload = self.payload if self.payload is not None else {}
+        client = self._rest_client
+        
+        if client is not None and (client.server_uri != payload.get('server_uri') or client.session_key != payload.get('session_key')):
+            client.close()
+            client = self._rest_client = None
+        
+        if client is None:
+            client = self._rest_client = SplunkdClient.from_payload(payload, cache_ttl=self.execution_params['rest_cache_ttl'])
+        else:
+            client.cache.ttl = self.execution_params['rest_cache_ttl']
+        
+        return client
+    
+    def get_lookup_path(self, lookup_file):
+        """
+        Get the path of a lookup file; relative paths are in the lookups directory of this app.
+        
+        Arguments:
+        lookup_file -- The name or path of the lookup file (e.g. "assets.csv")
+        """
+        
+        if os.path.isabs(lookup_file):
+            return lookup_file
+        
+        app_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        
+        return os.path.join(app_directory, 'lookups', lookup_file)
+    
+    def get_lookup_index(self, lookup_file, key_field):
+        """
+        Get the memory-mapped index of a lookup file (see lookup_index.py). The index is built under
+        the state directory the first time that it is needed and rebuilt when the lookup file
+        changes; the processes running the alert share it through the page cache.
+        
+        Arguments:
+        lookup_file -- The name or path of the lookup file (see get_lookup_path())
+        key_field -- The column of the lookup that the rows are looked up by
+        """
+        
+        from modular_alert_example_app.lookup_index import open_lookup_index, get_index_name
+        
+        lookup_path = self.get_lookup_path(lookup_file)
+        index = self._lookup_indexes.get((lookup_path, key_field))
+        
+        if index is not None and not index.is_current(lookup_path, key_field):
+            index.close()
+            index = None
+        
+        if index is None:
+            index = open_lookup_index(lookup_path, key_field, self.get_state_path(get_index_name(lookup_path, key_field)))
+            self._lookup_indexes[(lookup_path, key_field)] = index
+        
+        return index
+    
+    def enrich(self, rows, key_field, lookup_file=None, lookup_field=None, output_fields=None):
+        """
+        Add the fields of the matching row of a lookup file to each of the rows. The look-ups use a
+        memory-mapped index of the lookup (see get_lookup_index()) rather than loading it, and
+        each distinct value is only looked up once per call, so pass the rows a chunk at a time:
+            
+            def run_batch(self, cleaned_params, rows):
+                for row in self.enrich(rows, 'src_ip', 'assets.csv', 'ip'):
+                    ...
+        
+        Returns a list of the rows; the rows that matched are copies with the lookup's fields added.
+        
+        Arguments:
+        rows -- An iterable of dictionaries representing the search results
+        key_field -- The field of the rows whose value is looked up
+        lookup_file -- The name or path of the lookup file (defaults to the "lookup_file" parameter)
+        lookup_field -- The column of the lookup to match the value against (defaults to key_field)
+        output_fields -- A list of the columns of the lookup to add (defaults to all of them but the key)
+        """
+        
+        lookup_file = lookup_file or self.execution_params['lookup_file']
+        
+        if not lookup_file:
+            raise ValueError("No lookup file was given (set the lookup_file parameter)")
+        
+        with self.timer.phase('enrich'):
+            index = self.get_lookup_index(lookup_file, lookup_field or key_field)
+            
+            return index.enrich(rows, key_field, output_fields)
+    
+    def get_rate_limit(self, destination=None):
+        """
+        Get the rate limit for the destination as a tuple of the number of actions allowed per second
+        and the number of actions that may be performed at once (or None if there is no limit). By
+        default, the "rate_limit" and "rate_limit_burst" parameters apply to every destination.
+        
+        Override this to use different limits for different destinations, for example:
+            
+            def get_rate_limit(self, destination=None):
+                if destination == 'ticketing.example.com':
+                    return 2.0, 5
+                
+                return super(MyAlert, self).get_rate_limit(destination)
+        
+        Arguments:
+        destination -- The destination (as passed to acquire_rate_limit())
+        """
+        
+        rate = self.execution_params['rate_limit']
+        
+        if rate is None:
+            return None
+        
+        return rate, self.execution_params['rate_limit_burst'] or max(1, int(math.ceil(rate)))
+    
+    def acquire_rate_limit(self, destination=None, tokens=1):
+        """
+        Wait until the rate limit allows an action to be performed (or determine whether it is allowed
+        if the "rate_limit_mode" parameter is "drop"). Returns true if the action may be performed;
+        otherwise, the action should be skipped (it is counted in "rate_limited_count").
+        
+        Call this from run() before each request to the downstream system. The limit is shared by
+        every process running this alert on the host and is kept separately for each destination.
+        
+        Arguments:
+        destination -- The system that the action is performed against (e.g. a host name), or None if the limit applies to the alert as a whole
+        tokens -- The number of actions that will be performed (e.g. the number of results in a bulk request)
+        """
+        
+        limit = self.get_rate_limit(destination)
+        
+        if limit is None:
+            return True
+        
+        rate, burst = limit
+        key = self.logger_name if destination is None else '%s/%s' % (self.logger_name, destination)
+        
+        with self.timed_phase('rate_limit'):
+            allowed = self.rate_limiter.acquire(key, rate, burst, tokens, block=self.execution_params['rate_limit_mode'] == RATE_LIMIT_BLOCK)
+        
+        if not allowed:
+            with _rate_limited_lock:
+                self.rate_limited_count += tokens
+        
+        return allowed
+    
+    def fingerprint(self, row):
+        """
+        Get a fingerprint that identifies the result, computed from the fields listed in the
+        "dedup_fields" parameter (or all of the fields if none are listed).
+        
+        Arguments:
+        row -- A dictionary representing the search result
+        """
+        
+        import hashlib
+        
+        fields = [field.strip() for field in self.execution_params['dedup_fields'] or [] if field.strip()]
+        
+        if len(fields) == 0:
+            fields = sorted(row.keys())
+        
+        fingerprint = hashlib.sha1()
+        
+        for field in fields:
+            fingerprint.update(field.encode('utf-8'))
+            fingerprint.update(b'\x00')
+            fingerprint.update(str(row.get(field, '')).encode('utf-8'))
+            fingerprint.update(b'\x00')
+        
+        return fingerprint.hexdigest()
+    
+    def filter_seen(self, rows, chunk_size=500):
+        """
+        Filter out the results that were already seen by a previous invocation of the alert (within
+        the "dedup_ttl" parameter). The results are identified by their fingerprint (see
+        fingerprint()) and the remaining results are recorded as seen. The results that fail are
+        forgotten again (see forget_seen()) so that the next invocation processes them. This is safe
+        to use with many alert processes at once.
+        
+        Arguments:
+        rows -- An iterable of dictionaries representing the search results
+        chunk_size -- The number of results to check against the cache at once
+        """
+        
+        from modular_alert_example_app.results import iter_chunks
+        
+        for chunk in iter_chunks(rows, chunk_size):
+            fingerprints = [self.fingerprint(row) for row in chunk]
+            new_fingerprints = self.result_cache.add_new(fingerprints)
+            self._seen_fingerprints.extend(new_fingerprints)
+            
+            for row, fingerprint in zip(chunk, fingerprints):
+                if fingerprint in new_fingerprints:
+                    
+                    # Don't return a duplicate within the same chunk more than once
+                    new_fingerprints.discard(fingerprint)
+                    yield row
+    
+    def is_new_result(self, row):
+        """
+        Determine if the result wasn't already seen by a previous invocation of the alert (the
+        result is then recorded as seen). See filter_seen().
+        
+        Arguments:
+        row -- A dictionary representing the search result
+        """
+        
+        return len(list(self.filter_seen([row]))) > 0
+    
+    def forget_seen(self, rows=None):
+        """
+        Remove results from the results that were recorded as seen (see filter_seen()) so that the
+        next invocation of the alert doesn't suppress them. This does nothing unless de-duplication
+        is enabled.
+        
+        Arguments:
+        rows -- The results to forget (or None to forget all of those recorded by this execution)
+        """
+        
+        if self.execution_params['dedup_fields'] is None:
+            return
+        
+        if rows is None:
+            fingerprints, self._seen_fingerprints = self._seen_fingerprints, []
+        else:
+            fingerprints = [self.fingerprint(row) for row in rows if isinstance(row, dict)]
+        
+        try:
+            if fingerprints:
+                self.result_cache.remove(fingerprints)
+        except Exception:
+            self.logger.error("Unable to forget the results that failed: %s", traceback.format_exc())
+    
+    def iter_results(self, payload, row_filter=None, use_index=False, prefetch=None):
+        """
+        Iterate through the search results that triggered the alert, yielding a dictionary for each row.
+        
+        The rows are read lazily from the gzipped CSV file referenced by the "results_file" entry of
+        the payload so that memory use stays flat regardless of how many results there are. If the
+        payload doesn't reference a results file, the single row in payload['result'] is returned.
+        
+        Arguments:
+        payload -- The data from Splunk.
+        row_filter -- A RowFilter; only the rows that match it are returned (see get_row_filter())
+        use_index -- If true, the rows are filtered using a sidecar index of the results file (see results_index.py)
+        prefetch -- If set, the rows are read ahead by a thread or a process (PREFETCH_THREAD or PREFETCH_PROCESS, see prefetch.py)
+        """
+        
+        from modular_alert_example_app.results import iter_results_file
+        
+        results_file = payload.get('results_file')
+        
+        if results_file and os.path.isfile(results_file):
+            
+            if row_filter is not None and use_index:
+                from modular_alert_example_app.results_index import iter_indexed_results
+                rows = iter_indexed_results(results_file, row_filter)
+            elif prefetch is not None:
+                from modular_alert_example_app.prefetch import iter_prefetched
+                rows = iter_prefetched(results_file, prefetch, row_filter)
+            else:
+                rows = iter_results_file(results_file, row_filter)
+            
+            for row in rows:
+                yield row
+        
+        elif payload.get('result') is not None:
+            if row_filter is None or row_filter.matches(payload['result']):
+                yield payload['result']
+    
+    def get_results(self):
+        """
+        Get the results that the alert should run against when it is batched (see iter_results()),
+        excluding those that don't match the row filter (see get_row_filter()) and those that were
+        already seen if de-duplication is enabled (see filter_seen()).
+        When a spooled execution is being replayed, the results that failed are returned instead.
+        """
+        
+        if self._replay_rows is not None:
+            return iter(self._replay_rows)
+        
+        # Use the results that were provided to execute() instead of reading them again
+        if self._shared_results is not None:
+            rows = self._shared_results
+            row_filter = self.get_row_filter()
+            
+            if row_filter is not None:
+                rows = (row for row in rows if row_filter.matches(row))
+        else:
+            rows = self.iter_results(self.payload, self.get_row_filter(), self.execution_params['results_index'], self.execution_params['prefetch'])
+        
+        if self.execution_params['dedup_fields'] is not None:
+            rows = self.filter_seen(rows)
+        
+        return rows
+    
+    def make_row_buffer(self, sort_key=None):
+        """
+        Make a RowBuffer for holding results in memory until the "memory_budget" parameter (in
+        megabytes) is exceeded, after which they are spilled to temporary files. Use this instead of
+        a list in alerts that need all of the results at once (e.g. to sort or group them). The
+        buffer is closed (removing the temporary files) when the execution of the alert ends.
+        
+            buffer = self.make_row_buffer(sort_key=lambda row: row['host'])
+            buffer.extend(self.get_results())
+            
+            for row in buffer:
+                ...
+        
+        Arguments:
+        sort_key -- A function that gets the key to sort the rows by (or None to keep the rows in the order they were added)
+        """
+        
+        from modular_alert_example_app.row_buffer import RowBuffer
+        
+        memory_budget = self.execution_params['memory_budget']
+        row_buffer = RowBuffer(memory_budget * 1048576 if memory_budget is not None else None, sort_key)
+        
+        self._row_buffers.append(row_buffer)
+        
+        return row_buffer
+    
+    def close_row_buffers(self):
+        """
+        Close the buffers made by make_row_buffer().
+        """
+        
+        for row_buffer in self._row_buffers:
+            row_buffer.close()
+        
+        self._row_buffers = []
+    
+    def get_row_filter(self):
+        """
+        Get the RowFilter that selects the results that the alert runs against (or None to run
+        against all of them). The filter is evaluated on the raw values while the results file is
+        read, which is much cheaper than skipping the results in run(). Set the "results_index"
+        parameter to also keep an index of the results file for alerts that scan the same file repeatedly.
+        
+        Override this to filter the results, for example:
+            
+            def get_row_filter(self):
+                return RowFilter().add(IntegerField("importance"), '>=', 2)
+        """
+        
+        return None
+    
+    def get_result_set(self):
+        """
+        Load the results (see get_results()) into a ResultSet. This is much more compact than a list
+        of dictionaries so use it for alerts that need to hold many results in memory at once.
+        """
+        
+        from modular_alert_example_app.results import ResultSet
+        
+        results_file = self.payload.get('results_file') if self.payload is not None else None
+        
+        # Read the values straight into the set when the results don't need to be filtered
+        if results_file and os.path.isfile(results_file) and self.execution_params['dedup_fields'] is None and self.get_row_filter() is None:
+            return ResultSet.from_results_file(results_file)
+        
+        return ResultSet.from_dicts(self.get_results())
+    
+    def get_groups(self, rows):
+        """
+        Group the rows by the fields in the "group_by" parameter, collecting the distinct values of
+        the fields in the "group_distinct" parameter. Returns a GroupAggregator; iterate through it
+        to get a dictionary for each group (see Group.to_dict() in grouping.py). Only the aggregates
+        of each group are kept so memory use depends on the number of groups, not the number of rows.
+        
+        Arguments:
+        rows -- An iterable of dictionaries representing the search results.
+        """
+        
+        from modular_alert_example_app.grouping import GroupAggregator
+        
+        groups = GroupAggregator(self.execution_params['group_by'], self.execution_params['group_distinct'], self.execution_params['group_max_distinct'])
+        
+        with self.timer.phase('group'):
+            groups.extend(rows)
+        
+        return groups
+    
+    def make_group_payload(self, base_payload, group):
+        """
+        Make the payload that run() is called with for a group: the "group" entry is the group and
+        the "result" entry is the group's first result (so that alerts that only look at the result
+        work unchanged).
+        
+        Arguments:
+        base_payload -- The payload to copy (see make_row_payload())
+        group -- A dictionary describing the group (see get_groups())
+        """
+        
+        group_payload = base_payload.copy()
+        group_payload['result'] = group['first']
+        group_payload['group'] = group
+        
+        return group_payload
+    
+    def process_groups(self, cleaned_params, rows):
+        """
+        Run the alert once for each group of the rows (see get_groups()) instead of once for each row.
+        A group that fails counts all of its rows as failed. Returns true if the fraction of results
+        that failed doesn't exceed the "max_failure_ratio" parameter.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- An iterable of dictionaries representing the search results.
+        """
+        
+        self.failure_count = 0
+        self.failed_rows = []
+        
+        groups = self.get_groups(rows)
+        
+        self.result_count = groups.row_count
+        self.group_count = len(groups)
+        
+        base_payload = self.make_row_payload()
+        
+        for group in groups:
+            try:
+                result = self.run(cleaned_params, self.make_group_payload(base_payload, group))
+            except Exception:
+                self.record_failure("(%i results in group %r)" % (group['count'], group['by']), count=group['count'], rows=[group['first']])
+                continue
+            
+            if result is False:
+                self.record_failure("(%i results in group %r)" % (group['count'], group['by']), count=group['count'], rows=[group['first']], reason=RUN_RETURNED_FALSE)
+        
+        return self.is_successful()
+    
+    def run(self, cleaned_params, payload):
+        """
+        Run the input using the arguments provided.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        payload -- The data from Splunk.
+        out_stream -- The stream to write the output to (defaults to standard output)
+        """
+        
+        raise Exception("Run function was not implemented")
+        
+    def run_batch(self, cleaned_params, rows):
+        """
+        Run the alert against a chunk of the search results. This is called by execute() once per
+        chunk of "batch_size" rows when the alert is batched. Override this to process many results
+        at once (e.g. to send a single bulk request to a downstream system).
+        
+        By default, run() is called for each row with a payload whose "result" entry is the row (via
+        the executor if one is configured). A list of the values returned by run() is returned; a row
+        for which run() raises an exception or returns False is counted as failed.
+        Note that the same payload dictionary is re-used for each row in the chunk when no executor
+        is used.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- A list of dictionaries representing the search results.
+        """
+        
+        if self._executor is not None:
+            return self.dispatch(cleaned_params, rows)
+        
+        row_payload = self.make_row_payload()
+        run = self.run
+        results = []
+        
+        for row in rows:
+            row_payload['result'] = row
+            
+            try:
+                result = run(cleaned_params, row_payload)
+            except Exception:
+                self.record_failure(row)
+                continue
+            
+            if result is False:
+                self.record_failure(row, reason=RUN_RETURNED_FALSE)
+            
+            results.append(result)
+        
+        return results
+    
+    def dispatch(self, cleaned_params, rows):
+        """
+        Run the alert against each of the rows using the executor. A row that fails is logged and
+        counted but doesn't prevent the other rows from being processed. A list of the values
+        returned by run() is returned, either in the order of the rows or in the order in which they
+        completed (depending on the "ordered" parameter).
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- A list of dictionaries representing the search results.
+        """
+        
+        base_payload = self.make_row_payload()
+        
+        if self.execution_params['executor'] == EXECUTOR_PROCESS:
+            run = _run_in_worker
+        else:
+            run = self.run
+        
+        futures = {}
+        
+        for row in rows:
+            row_payload = base_payload.copy()
+            row_payload['result'] = row
+            
+            futures[self._executor.submit(run, cleaned_params, row_payload)] = row
+        
+        if self.execution_params['ordered']:
+            completed = futures.keys()
+        else:
+            from concurrent.futures import as_completed
+            completed = as_completed(futures)
+        
+        results = []
+        
+        for future in completed:
+            try:
+                result = future.result()
+            except Exception:
+                self.record_failure(futures[future])
+                continue
+            
+            if result is False:
+                self.record_failure(futures[future], reason=RUN_RETURNED_FALSE)
+            
+            results.append(result)
+        
+        return results
+    
+    def make_row_payload(self):
+        """
+        Make a copy of the payload that can be used to call run() for an individual result.
+        """
+        
+        if self.payload is not None:
+            return self.payload.copy()
+        else:
+            return {}
+    
+    def record_failure(self, row, count=1, rows=None, reason=None):
+        """
+        Log the exception that is currently being handled (or the given reason) and count the failed
+        results. The failed results are kept so that they can be spooled if the "spool_failures"
+        parameter is set, and are no longer recorded as seen if de-duplication is enabled (see
+        forget_seen()).
+        
+        Arguments:
+        row -- The result that failed (or a description of the results that failed)
+        count -- The number of results that failed
+        rows -- The results that failed (if row is a description of them)
+        reason -- A description of why the results failed (defaults to the traceback of the exception being handled)
+        """
+        
+        self.failure_count += count
+        self.logger.error("Execution failed for result=%r: %s", row, reason if reason is not None else traceback.format_exc())
+        
+        failed_rows = rows if rows is not None else [row]
+        
+        if self.execution_params['spool_failures']:
+            self.failed_rows.extend(failed_rows)
+        
+        self.forget_seen(failed_rows)
+    
+    def make_executor(self):
+        """
+        Make the executor that is used to run the alert against each of the results (or None if no
+        executor is configured).
+        """
+        
+        executor = self.execution_params['executor']
+        max_workers = self.execution_params['max_workers']
+        
+        if executor == EXECUTOR_THREAD:
+            from concurrent.futures import ThreadPoolExecutor
+            return ThreadPoolExecutor(max_workers=max_workers)
+        
+        elif executor == EXECUTOR_PROCESS:
+            from concurrent.futures import ProcessPoolExecutor
+            from modular_alert_example_app.prefetch import get_process_context
+            
+            # Don't fork since the alert may hold locks, threads and open connections
+            return ProcessPoolExecutor(max_workers=max_workers, mp_context=get_process_context(), initializer=_init_worker, initargs=(self,))
+        
+        return None
+    
+    def is_successful(self):
+        """
+        Determine if the fraction of the results that failed is at most the "max_failure_ratio"
+        parameter (so the default of 0 requires every result to succeed).
+        """
+        
+        if self.failure_count > 0:
+            self.logger.warning("Execution failed for %i of %i results", self.failure_count, self.result_count)
+        
+        return self.failure_count <= self.execution_params['max_failure_ratio'] * self.result_count
+    
+    def process_results(self, cleaned_params, rows):
+        """
+        Run the alert against the given rows by calling run_batch() for each chunk of rows and
+        passing what it returned to on_batch_results(). Returns true if the fraction of results that
+        failed doesn't exceed the "max_failure_ratio" parameter.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- An iterable of dictionaries representing the search results.
+        """
+        
+        from modular_alert_example_app.results import iter_chunks
+        
+        self.result_count = 0
+        self.failure_count = 0
+        self.failed_rows = []
+        self._executor = self.make_executor()
+        
+        try:
+            for chunk in iter_chunks(rows, self.execution_params['batch_size'] or self.DEFAULT_BATCH_SIZE):
+                self.result_count += len(chunk)
+                
+                try:
+                    results = self.run_batch(cleaned_params, chunk)
+                except Exception:
+                    self.record_failure("(%i results in batch)" % len(chunk), count=len(chunk), rows=chunk)
+                    continue
+                
+                self.on_batch_results(cleaned_params, chunk, results)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        
+        return self.is_successful()
+    
+    def on_batch_results(self, cleaned_params, rows, results):
+        """
+        This function is called with the value returned by run_batch() for each chunk of rows (by
+        default, a list of the values returned by run() in the order given by the "ordered"
+        parameter). Override this to act on the results of a chunk (e.g. to write a summary). An
+        exception raised here fails the execution.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- A list of dictionaries representing the search results in the chunk.
+        results -- The value returned by run_batch().
+        """
+        
+        pass
+    
+    def shutdown(self):
+        """
+        This function is called when the modular alert should shut down. Sub-classes that override
+        this should call this function too so that the files used by the alert are closed.
         """
-        Validate the arguments and return a dictionary of cleaned/converted parameters.
+        
+        if self._result_cache is not None:
+            self._result_cache.close()
+            self._result_cache = None
+        
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        
+        if self._rate_limiter is not None:
+            self._rate_limiter.close()
+            self._rate_limiter = None
+        
+        if self._validation_store is not None:
+            self._validation_store.close()
+            self._validation_store = None
+        
+        if self._rest_client is not None:
+            self._rest_client.close()
+            self._rest_client = None
+        
+        for index in self._lookup_indexes.values():
+            index.close()
+        
+        self._lookup_indexes = {}
+        
+        # Write out the queued log messages
+        if self.log_async and self._logger is not None:
+            from modular_alert_example_app.log_queue import stop_listener
+            stop_listener(self._logger)
+      
+    def prepare(self, in_stream, payload=None):
+        """
+        Read the payload from the stream and validate the configuration. Returns the cleaned parameters.
         
         Arguments:
-        arguments -- A dictionary of arguments
+        in_stream -- The stream to get the input from
+        payload -- The payload (if it was already parsed, in which case the stream isn't read)
         """
         
-        cleaned_params = {}
+        from modular_alert_example_app.payload import read_payload
         
-        # Convert and check the parameters
-        for name, value in arguments.items():
-            
-            arg_recognized = False
-            
-            # Go through the parameters and look for a match
-            for parameter in self.parameters:
-                
-                # If we found a match then convert it and check it
-                if parameter.name == name:
-                    cleaned_params[name] = parameter.to_python(value)
-                    
-                    # Note that we recognized the argument
-                    arg_recognized = True
-                
-            # Throw an exception if the argument could not be found
-            if not arg_recognized:
-                raise FieldValidationException("The argument '%s' is not valid" % (name))
+        # Parse the input incrementally (the results are only parsed when they are accessed)
+        if payload is None:
+            with self.timer.phase('parse'):
+                payload = read_payload(in_stream, timer=self.timer)
+        
+        self.payload = payload
+        
+        # Validate arguments
+        with self.timer.phase('validate'):
+            cleaned_params, self.execution_params = self.validate_configuration(payload['configuration'])
             
-        return cleaned_params
+            return cleaned_params
     
-    def run(self, cleaned_params, payload):
+    def run_alert(self, cleaned_params):
         """
-        Run the input using the arguments provided.
+        Run the alert against the payload, or against each of the results if the alert is batched.
         
         Arguments:
         cleaned_params -- The arguments following validation and conversion to Python objects.
-        payload -- The data from Splunk.
-        out_stream -- The stream to write the output to (defaults to standard output)
         """
         
-        raise Exception("Run function was not implemented")
+        # Run the alert once for each group of results if grouping is enabled
+        if self.execution_params['group_by'] is not None:
+            return self.process_groups(cleaned_params, self.get_results())
         
-    def shutdown(self):
-        """
-        This function is called when the modular alert should shut down.
-        """
+        # Run the alert against each of the results if batching is enabled
+        if self.is_batched():
+            return self.process_results(cleaned_params, self.get_results())
         
-        pass
-      
-    def execute(self, in_stream=sys.stdin):
+        # Run the alert
+        return self.run(cleaned_params, self.payload)
+    
+    def execute(self, in_stream=sys.stdin, payload=None, results=None):
         """
         Get the arguments that were provided from the command-line and execute the script.
         
         Arguments:
         in_stream -- The stream to get the input from (defaults to standard input)
+        payload -- The payload (if it was already parsed, in which case the stream isn't read)
+        results -- An iterable of the results to use instead of reading them from the payload (see CompositeAlert)
         """
         
+        self.timer = PhaseTimer()
+        self.execution_params = dict(self.execution_defaults)
+        self.failed_rows = []
+        self.rate_limited_count = 0
+        self.group_count = 0
+        self._seen_fingerprints = []
+        self._shared_results = results
+        profiler = None
+        memory_trace = False
+        cleaned_params = None
+        failed = False
+        result = False
+        
         try:
             self.logger.debug("Execute called")
             
-            # Parse input
-            payload = json.loads(in_stream.read())
-            
-            # Validate arguments
-            cleaned_params = self.validate(payload['configuration'])
-            
-            # Run the alert
-            return self.run(cleaned_params, payload)
+            with self.timer.phase('execute'):
+                
+                cleaned_params = self.prepare(in_stream, payload)
+                
+                if self.execution_params['profile']:
+                    profiler = self.start_profiler()
+                
+                if self.execution_params['trace_memory']:
+                    memory_trace = self.start_memory_trace()
+                
+                with self.timer.phase('run'):
+                    result = self.run_alert(cleaned_params)
+                
+                # An alert that isn't batched handles all of the results it checked with is_new_result() at once
+                if result is False and not self.is_batched():
+                    self.forget_seen()
+                
+                if self.rate_limited_count > 0:
+                    self.logger.warning("Dropped %i actions that exceeded the rate limit", self.rate_limited_count)
             
         except Exception as e:
             
             self.logger.error("Execution failed: %s", ( traceback.format_exc() ))
             
+            # Don't suppress the results the next time since none of them may have been processed
+            self.forget_seen()
+            
+            # Payloads that couldn't be parsed or validated aren't spooled since replaying them would fail too
+            failed = cleaned_params is not None
+        
+        finally:
+            if profiler is not None:
+                self.stop_profiler(profiler)
+            
+            if self.execution_params['memory_budget'] is not None or self.execution_params['trace_memory']:
+                self.log_memory_usage(memory_trace)
+            
+            self.close_row_buffers()
+            
+            if self.execution_params['spool_failures']:
+                self.spool_failures(failed)
+            
+            if self.execution_params['log_metrics']:
+                self.log_metrics(result)
+            
+            self._shared_results = None
+        
+        return result
+    
+    def spool_failures(self, failed=False):
+        """
+        Append the work that failed to the spool so that it can be replayed later (see replay()). The
+        results that failed are spooled (in chunks of up to "batch_size" results). If the execution
+        failed entirely, all of the results are spooled when the alert is batched (since the results
+        file may have been removed by the time the entry is replayed); otherwise, the payload is
+        spooled so that the whole execution is replayed.
+        
+        Arguments:
+        failed -- Indicates whether the execution failed entirely
+        """
+        
+        from modular_alert_example_app.results import iter_chunks
+        
+        if not failed and not self.failed_rows:
+            return
+        
+        try:
+            entry = {
+                'time' : time.time(),
+                'attempts' : 0,
+                'payload' : self.payload.to_dict() if hasattr(self.payload, 'to_dict') else dict(self.payload)
+            }
+            
+            failed_rows = self.failed_rows
+            
+            if failed:
+                results_file = self.payload.get('results_file')
+                
+                if self.is_batched() and results_file and os.path.isfile(results_file):
+                    failed_rows = self.iter_results(self.payload, self.get_row_filter())
+                else:
+                    failed_rows = None
+            
+            if failed_rows is None:
+                self.spool.append(dict(entry, rows=None))
+            else:
+                for chunk in iter_chunks(failed_rows, self.execution_params['batch_size'] or self.DEFAULT_BATCH_SIZE):
+                    self.spool.append(dict(entry, rows=[dict(row) for row in chunk]))
+            
+            # Sync the entries of this execution to disk together
+            self.spool.sync()
+        
+        except Exception:
+            self.logger.error("Unable to spool the failed execution: %s", traceback.format_exc())
+        
+        self.failed_rows = []
+    
+    def replay(self, entry):
+        """
+        Run the alert again for an entry from the spool (see spool_failures()). Returns None if it
+        succeeded or an entry to append to the spool if it should be retried (containing only the
+        results that failed again). An entry without results fails if the results file of its payload
+        no longer exists. Entries that have been tried MAX_REPLAY_ATTEMPTS times are dropped.
+        
+        Arguments:
+        entry -- The entry from the spool
+        """
+        
+        from modular_alert_example_app.payload import Payload
+        
+        self.timer = PhaseTimer()
+        self.failed_rows = []
+        self._seen_fingerprints = []
+        self.payload = Payload(entry['payload'])
+        self._replay_rows = entry.get('rows')
+        
+        failed = False
+        
+        try:
+            cleaned_params, self.execution_params = self.validate_configuration(self.payload['configuration'])
+            
+            # Keep the results that fail again so that they can be retried
+            self.execution_params['spool_failures'] = True
+            
+            # Run the alert against the results that failed (even if the alert isn't normally batched)
+            if self._replay_rows is not None and not self.is_batched():
+                self.execution_params['batch_size'] = self.DEFAULT_BATCH_SIZE
+            
+            # Don't fall back to the "result" entry of the payload if the results file was removed (so the entry is kept)
+            results_file = self.payload.get('results_file')
+            
+            if self._replay_rows is None and self.is_batched() and results_file and not os.path.isfile(results_file):
+                raise IOError("The results file no longer exists, results_file=%s" % results_file)
+            
+            result = self.run_alert(cleaned_params)
+            
+            # Like execute(), only an exception (or an explicit False from an alert that isn't batched)
+            # means that the execution failed; the results that failed in a batch are in failed_rows
+            failed = result is False and not self.is_batched()
+        
+        except Exception:
+            self.logger.error("Replay failed: %s", traceback.format_exc())
+            self.forget_seen()
+            failed = True
+        
+        finally:
+            self._replay_rows = None
+        
+        if failed:
+            retry_entry = dict(entry)
+        elif self.failed_rows:
+            retry_entry = dict(entry, rows=[dict(row) for row in self.failed_rows])
+        else:
+            return None
+        
+        self.failed_rows = []
+        retry_entry['attempts'] = entry.get('attempts', 0) + 1
+        
+        if retry_entry['attempts'] >= self.MAX_REPLAY_ATTEMPTS:
+            self.logger.error("Giving up on the spooled execution after %i attempts, time=%s", retry_entry['attempts'], entry.get('time'))
+            return None
+        
+        return retry_entry
+    
+    def start_profiler(self):
+        """
+        Start profiling the execution of the alert using cProfile.
+        """
+        
+        import cProfile
+        
+        profiler = cProfile.Profile()
+        profiler.enable()
+        
+        return profiler
+    
+    def stop_profiler(self, profiler):
+        """
+        Stop the profiler and write the statistics to $SPLUNK_HOME/var/run/splunk/profiles (they can
+        be viewed using the pstats module).
+        
+        Arguments:
+        profiler -- The profiler returned by start_profiler()
+        """
+        
+        from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+        
+        profiler.disable()
+        
+        profile_dir = make_splunkhome_path(['var', 'run', 'splunk', 'profiles'])
+        
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        
+        profile_file = os.path.join(profile_dir, '%s_%i_%i.prof' % (self.logger_name, int(time.time()), os.getpid()))
+        profiler.dump_stats(profile_file)
+        
+        self.logger.info("Profile written to %s", profile_file)
+    
+    def start_memory_trace(self):
+        """
+        Start tracing the memory allocated by Python (see log_memory_usage()). Returns true if the
+        trace was started (it may have already been started by something else).
+        """
+        
+        import tracemalloc
+        
+        if tracemalloc.is_tracing():
             return False
+        
+        tracemalloc.start()
+        
+        return True
+    
+    def log_memory_usage(self, memory_trace=False):
+        """
+        Log the peak memory used by the process along with the results spilled to disk by the row
+        buffers (see make_row_buffer()). If memory is being traced (see the "trace_memory" parameter),
+        the peak memory allocated while the alert ran and the lines that allocated the most memory
+        are logged too and the trace is stopped.
+        
+        Note that the peak resident set size is for the lifetime of the process (which may have
+        executed other alerts if it is a worker).
+        
+        Arguments:
+        memory_trace -- Indicates whether the trace was started by start_memory_trace()
+        """
+        
+        usage = {
+            'peak_rss_kb' : get_peak_rss(),
+            'buffered_results' : sum(len(row_buffer) for row_buffer in self._row_buffers),
+            'spilled_results' : sum(row_buffer.spilled_count for row_buffer in self._row_buffers),
+            'spill_files' : sum(row_buffer.run_count for row_buffer in self._row_buffers),
+            'buffer_peak_kb' : sum(row_buffer.peak_memory for row_buffer in self._row_buffers) // 1024
+        }
+        
+        if not memory_trace:
+            self.logger.info("Memory usage: %s", self.create_event_string(usage))
+            return
+        
+        import tracemalloc
+        
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        usage['traced_kb'] = current // 1024
+        usage['traced_peak_kb'] = peak // 1024
+        
+        self.logger.info("Memory usage: %s", self.create_event_string(usage))
+        
+        for statistic in snapshot.statistics('lineno')[:self.MEMORY_TRACE_LINES]:
+            frame = statistic.traceback[0]
+            self.logger.info("Memory allocated: %s", self.create_event_string({'file' : frame.filename, 'line' : frame.lineno, 'size_kb' : statistic.size // 1024, 'count' : statistic.count}))
+    
+    def timed_phase(self, name):
+        """
+        Get a context manager that records the time spent within it as the given phase (see
+        PhaseTimer) if the "log_metrics" parameter is set. Use this for phases that are entered for
+        each result or event so that they cost nothing when the metrics aren't logged.
+        
+        Arguments:
+        name -- The name of the phase (e.g. "output")
+        """
+        
+        if self.execution_params['log_metrics']:
+            return self.timer.phase(name)
+        
+        return nullcontext()
+    
+    def get_metrics(self, result):
+        """
+        Get a dictionary describing the execution of the alert, including the time spent in each
+        phase (see PhaseTimer). The "run" phase includes the "output" phase (the time spent writing
+        events), the "rate_limit" phase (the time spent waiting for the rate limit) and the "group"
+        phase (the time spent grouping the results), "parse"
+        includes the "read" phase (the time spent reading the input) and "execute" includes all of
+        the others.
+        
+        Arguments:
+        result -- The value returned by the alert
+        """
+        
+        # Like run_batch(), only an explicit False is a failure (execute() returns False if an exception was raised)
+        metrics = {
+            'action' : self.logger_name,
+            'success' : 0 if result is False else 1,
+        }
+        
+        if self.is_batched():
+            metrics['results'] = self.result_count
+            metrics['failures'] = self.failure_count
+        
+        if self.execution_params['group_by'] is not None:
+            metrics['groups'] = self.group_count
+        
+        if self.execution_params['rate_limit'] is not None:
+            metrics['rate_limited'] = self.rate_limited_count
+        
+        peak_rss = get_peak_rss()
+        
+        if peak_rss is not None:
+            metrics['peak_rss_kb'] = peak_rss
+        
+        metrics.update(self.timer.to_dict())
+        
+        return metrics
+    
+    def log_metrics(self, result):
+        """
+        Log the metrics describing the execution of the alert as a key-value event.
+        
+        Arguments:
+        result -- The value returned by the alert
+        """
+        
+        self.logger.info("Execution metrics: %s", self.create_event_string(self.get_metrics(result)))
             
     @property
     def logger(self):
@@ -556,21 +2410,243 @@ class ModularAlert(object):
         logger.propagate = False # Prevent the log messages from being duplicated in the python.log file
         logger.setLevel(self.log_level)
         
+        # The logger is shared by every alert with the same logger name, so only add a handler to it once
+        with _log_handlers_lock:
+            if not any(getattr(handler, 'modular_alert_handler', False) for handler in logger.handlers):
+                handler = self.make_log_handler()
+                
+                # Write the log messages from a background thread if requested
+                if self.log_async:
+                    from modular_alert_example_app.log_queue import start_listener
+                    handler = start_listener(self.logger_name, handler)
+                
+                handler.modular_alert_handler = True
+                logger.addHandler(handler)
+        
+        self._logger = logger
+        return self._logger
+    
+    def make_log_handler(self):
+        """
+        Make the handler that writes the log messages.
+        """
+        
         # Setup a file logger if requested
         if self.log_to_file:
+            from logging import handlers
+            from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
+            
             file_handler = handlers.RotatingFileHandler(make_splunkhome_path(['var', 'log', 'splunk', self.logger_name + '.log']), maxBytes=25000000, backupCount=5)
             formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
             file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+            return file_handler
         else:
             stderr_handler = logging.StreamHandler(sys.stderr)
             formatter = logging.Formatter(' %(levelname)s %(message)s')
             stderr_handler.setFormatter(formatter)
-            logger.addHandler(stderr_handler)
-        
-        self._logger = logger
-        return self._logger
+            return stderr_handler
     
     @logger.setter
     def logger(self, logger):
-        self._logger = logger
\ No newline at end of file
+        self._logger = logger
+
+class AsyncModularAlert(ModularAlert):
+    """
+    A modular alert whose run() function is a coroutine. execute() manages the event loop so that
+    many results can be processed concurrently without needing a thread for each one.
+    
+    When batched, the number of results that are processed at once is limited by the
+    "max_concurrency" parameter and each result can be given a time limit via "row_timeout".
+    """
+    
+    EXECUTION_PARAMETERS = ModularAlert.EXECUTION_PARAMETERS + [
+        IntegerField("max_concurrency", none_allowed=True, min_value=1),
+        FloatField("row_timeout", none_allowed=True, min_value=0.0)
+    ]
+    
+    execution_defaults = dict(ModularAlert.execution_defaults, max_concurrency=None, row_timeout=None)
+    
+    # The number of results that are processed at once when batched and max_concurrency isn't set
+    DEFAULT_MAX_CONCURRENCY = 100
+    
+    def __init__(self, *args, **kwargs):
+        super(AsyncModularAlert, self).__init__(*args, **kwargs)
+        
+        self._semaphore = None
+    
+    def __getstate__(self):
+        # The semaphore belongs to the event loop of this process
+        state = super(AsyncModularAlert, self).__getstate__()
+        state['_semaphore'] = None
+        
+        return state
+    
+    def is_batched(self):
+        return super(AsyncModularAlert, self).is_batched() or self.execution_params['max_concurrency'] is not None
+    
+    def run_alert(self, cleaned_params):
+        import asyncio
+        
+        return asyncio.run(self.run_alert_async(cleaned_params))
+    
+    async def run_alert_async(self, cleaned_params):
+        """
+        Run the alert against the payload, or against each of the results if the alert is batched.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        """
+        
+        if self.execution_params['group_by'] is not None:
+            return await self.process_groups(cleaned_params, self.get_results())
+        
+        if self.is_batched():
+            return await self.process_results(cleaned_params, self.get_results())
+        
+        return await self.run(cleaned_params, self.payload)
+    
+    async def run(self, cleaned_params, payload):
+        """
+        Run the alert using the arguments provided.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        payload -- The data from Splunk.
+        """
+        
+        raise Exception("Run function was not implemented")
+    
+    async def acquire_rate_limit(self, destination=None, tokens=1):
+        """
+        Like ModularAlert.acquire_rate_limit() but the wait for the rate limit happens on a thread so
+        that the event loop isn't blocked (use "await self.acquire_rate_limit()" in run()).
+        
+        Arguments:
+        destination -- The system that the action is performed against (see ModularAlert.acquire_rate_limit())
+        tokens -- The number of actions that will be performed
+        """
+        
+        import asyncio
+        
+        acquire = super(AsyncModularAlert, self).acquire_rate_limit
+        
+        return await asyncio.get_running_loop().run_in_executor(None, acquire, destination, tokens)
+    
+    async def run_row(self, cleaned_params, row_payload):
+        """
+        Run the alert for a single result, waiting for a slot within the concurrency limit. Returns
+        the value returned by run() or None if it raised an exception (a result for which run()
+        raises an exception or returns False is counted as failed).
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        row_payload -- The payload whose "result" entry is the result.
+        """
+        
+        import asyncio
+        
+        async with self._semaphore:
+            try:
+                result = await asyncio.wait_for(self.run(cleaned_params, row_payload), self.execution_params['row_timeout'])
+            except Exception:
+                self.record_failure(row_payload['result'])
+                return None
+            
+            if result is False:
+                self.record_failure(row_payload['result'], reason=RUN_RETURNED_FALSE)
+            
+            return result
+    
+    async def run_batch(self, cleaned_params, rows):
+        """
+        Run the alert against a chunk of the search results. By default, run() is called
+        concurrently for each row with a payload whose "result" entry is the row. A list of the
+        values returned by run() is returned (in the order of the rows).
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- A list of dictionaries representing the search results.
+        """
+        
+        import asyncio
+        
+        base_payload = self.make_row_payload()
+        coroutines = []
+        
+        for row in rows:
+            row_payload = base_payload.copy()
+            row_payload['result'] = row
+            
+            coroutines.append(self.run_row(cleaned_params, row_payload))
+        
+        return await asyncio.gather(*coroutines)
+    
+    async def process_groups(self, cleaned_params, rows):
+        """
+        Like ModularAlert.process_groups() but run() is awaited for each group (within the
+        concurrency limit).
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- An iterable of dictionaries representing the search results.
+        """
+        
+        import asyncio
+        
+        self.failure_count = 0
+        self.failed_rows = []
+        self._semaphore = asyncio.Semaphore(self.execution_params['max_concurrency'] or self.DEFAULT_MAX_CONCURRENCY)
+        
+        groups = self.get_groups(rows)
+        
+        self.result_count = groups.row_count
+        self.group_count = len(groups)
+        
+        base_payload = self.make_row_payload()
+        
+        async def run_group(group):
+            async with self._semaphore:
+                try:
+                    result = await asyncio.wait_for(self.run(cleaned_params, self.make_group_payload(base_payload, group)), self.execution_params['row_timeout'])
+                except Exception:
+                    self.record_failure("(%i results in group %r)" % (group['count'], group['by']), count=group['count'], rows=[group['first']])
+                    return
+                
+                if result is False:
+                    self.record_failure("(%i results in group %r)" % (group['count'], group['by']), count=group['count'], rows=[group['first']], reason=RUN_RETURNED_FALSE)
+        
+        await asyncio.gather(*[run_group(group) for group in groups])
+        
+        return self.is_successful()
+    
+    async def process_results(self, cleaned_params, rows):
+        """
+        Run the alert against the given rows by calling run_batch() for each chunk of rows and
+        passing what it returned to on_batch_results(). Returns true if the fraction of results that
+        failed doesn't exceed the "max_failure_ratio" parameter.
+        
+        Arguments:
+        cleaned_params -- The arguments following validation and conversion to Python objects.
+        rows -- An iterable of dictionaries representing the search results.
+        """
+        
+        import asyncio
+        from modular_alert_example_app.results import iter_chunks
+        
+        self.result_count = 0
+        self.failure_count = 0
+        self.failed_rows = []
+        self._semaphore = asyncio.Semaphore(self.execution_params['max_concurrency'] or self.DEFAULT_MAX_CONCURRENCY)
+        
+        for chunk in iter_chunks(rows, self.execution_params['batch_size'] or self.DEFAULT_BATCH_SIZE):
+            self.result_count += len(chunk)
+            
+            try:
+                results = await self.run_batch(cleaned_params, chunk)
+            except Exception:
+                self.record_failure("(%i results in batch)" % len(chunk), count=len(chunk), rows=chunk)
+                continue
+            
+            self.on_batch_results(cleaned_params, chunk, results)
+        
+        return self.is_successful()
@@ -0,0 +1,316 @@
+"""
+This module reads the payload that Splunk sends to a modular alert on standard input.
+
+The payload is read incrementally (a chunk at a time) rather than reading the entire input into a
+string and parsing it all at once. Large values (such as the "result" entry) are kept as JSON text
+and are only parsed when they are accessed, so the raw input and the entire parsed payload never
+need to be held in memory at the same time.
+"""
+
+import json
+import re
+
+from collections.abc import MutableMapping
+
+# The entries of the payload that are parsed lazily regardless of their size
+DEFAULT_LAZY_KEYS = ('result',)
+
+# Values whose JSON text is larger than this (in characters) are parsed lazily
+DEFAULT_LAZY_THRESHOLD = 65536
+
+# The number of characters read from the stream at a time
+DEFAULT_CHUNK_SIZE = 65536
+
+WHITESPACE = ' \t\n\r'
+STRING_SPECIAL_RE = re.compile(r'["\\]')
+# Matches an entire string, a bracket or the start of a string that continues into the next chunk
+STRUCTURAL_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}"]', re.DOTALL)
+SCALAR_END_RE = re.compile(r'[,\]}\s]')
+
+class Payload(MutableMapping):
+    """
+    A dictionary-like payload whose values can be stored as JSON text that is parsed on first access.
+    """
+
+    def __init__(self, values=None, raw_values=None):
+        """
+        Arguments:
+        values -- A dictionary of the parsed values
+        raw_values -- A dictionary of the JSON text of the values that haven't been parsed yet
+        """
+
+        self._values = dict(values or {})
+        self._raw_values = dict(raw_values or {})
+
+    def __getitem__(self, key):
+
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        # This raises a KeyError if the key doesn't exist at all
+        raw_value = self._raw_values[key]
+
+        value = json.loads(raw_value)
+        self._values[key] = value
+        del self._raw_values[key]
+
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self._raw_values.pop(key, None)
+
+    def __delitem__(self, key):
+        if key in self._values:
+            del self._values[key]
+        else:
+            del self._raw_values[key]
+
+    def __contains__(self, key):
+        return key in self._values or key in self._raw_values
+
+    def __iter__(self):
+        for key in self._values:
+            yield key
+
+        for key in list(self._raw_values.keys()):
+            if key not in self._values:
+                yield key
+
+    def __len__(self):
+        return len(self._values) + len(self._raw_values)
+
+    def __repr__(self):
+        return 'Payload(%r, lazy=%r)' % (self._values, list(self._raw_values.keys()))
+
+    def is_loaded(self, key):
+        """
+        Indicates whether the value for the key has been parsed.
+        """
+
+        return key in self._values
+
+    def copy(self):
+        """
+        Make a shallow copy of the payload (the values that haven't been parsed yet remain unparsed).
+        """
+
+        return Payload(self._values, self._raw_values)
+
+    def to_dict(self):
+        """
+        Get the payload as a dictionary (parsing all of the values).
+        """
+
+        return dict((key, self[key]) for key in self)
+
+class PayloadReader(object):
+    """
+    Reads a JSON object from a stream one chunk at a time.
+    """
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE, timer=None):
+        """
+        Arguments:
+        stream -- The stream to read from
+        chunk_size -- The number of characters to read at a time
+        timer -- A PhaseTimer that records the time spent reading from the stream as the "read" phase (optional)
+        """
+
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.timer = timer
+
+        self.buffer = ''
+        self.pos = 0
+
+    def _read_chunk(self):
+        """
+        Read the next chunk into the buffer (discarding the current buffer). Returns false if the end
+        of the stream was reached.
+        """
+
+        if self.timer is not None:
+            with self.timer.phase('read'):
+                data = self.stream.read(self.chunk_size)
+        else:
+            data = self.stream.read(self.chunk_size)
+
+        self.buffer = data
+        self.pos = 0
+
+        return len(data) > 0
+
+    def _peek(self):
+        """
+        Skip the whitespace and return the next character (or None at the end of the stream).
+        """
+
+        while True:
+            buffer = self.buffer
+
+            while self.pos < len(buffer) and buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(buffer):
+                return buffer[self.pos]
+
+            if not self._read_chunk():
+                return None
+
+    def _expect(self, characters):
+        """
+        Consume the next character, making sure that it is one of the given characters.
+        """
+
+        c = self._peek()
+
+        if c is None or c not in characters:
+            raise ValueError("Invalid payload: expected one of '%s' but got %r" % (characters, c))
+
+        self.pos += 1
+
+        return c
+
+    def read_value_text(self):
+        """
+        Read the JSON text of the next value without parsing it.
+        """
+
+        first = self._peek()
+
+        if first is None:
+            raise ValueError("Invalid payload: unexpected end of input")
+
+        pieces = []
+        start = self.pos
+
+        # Scalars (numbers, true, false and null) end at the next delimiter
+        if first not in '{["':
+            while True:
+                match = SCALAR_END_RE.search(self.buffer, self.pos)
+
+                if match is not None:
+                    pieces.append(self.buffer[start:match.start()])
+                    self.pos = match.start()
+                    return ''.join(pieces)
+
+                pieces.append(self.buffer[start:])
+
+                if not self._read_chunk():
+                    return ''.join(pieces)
+
+                start = 0
+
+        # Strings, objects and arrays end when the closing character is found
+        depth = 0
+        in_string = False
+        i = self.pos
+
+        while True:
+            buffer = self.buffer
+
+            if in_string:
+                match = STRING_SPECIAL_RE.search(buffer, i)
+            else:
+                match = STRUCTURAL_RE.search(buffer, i)
+
+            if match is None:
+                # Continue with the next chunk
+                pieces.append(buffer[start:])
+                i -= len(buffer)
+
+                if not self._read_chunk():
+                    raise ValueError("Invalid payload: unexpected end of input")
+
+                start = 0
+                i = max(i, 0)
+                continue
+
+            c = match.group()
+            i = match.end()
+
+            if in_string:
+                if c == '\\':
+                    # Skip the escaped character (which may be in the next chunk)
+                    i += 1
+
+                    if i > len(buffer):
+                        pieces.append(buffer[start:])
+
+                        if not self._read_chunk():
+                            raise ValueError("Invalid payload: unexpected end of input")
+
+                        start = 0
+                        i = 1
+
+                    continue
+
+                in_string = False
+
+            elif c[0] == '"':
+                # Strings that end within this chunk are matched in their entirety
+                in_string = len(c) == 1
+
+                if in_string:
+                    continue
+
+            elif c in '{[':
+                depth += 1
+                continue
+
+            else:
+                depth -= 1
+
+            if depth == 0 and not in_string:
+                pieces.append(buffer[start:i])
+                self.pos = i
+                return ''.join(pieces)
+
+    def read_object(self, lazy_keys=DEFAULT_LAZY_KEYS, lazy_threshold=DEFAULT_LAZY_THRESHOLD):
+        """
+        Read a JSON object and return it as a Payload.
+
+        Arguments:
+        lazy_keys -- The keys whose values are always parsed lazily
+        lazy_threshold -- The size of the JSON text (in characters) above which values are parsed lazily
+        """
+
+        values = {}
+        raw_values = {}
+
+        self._expect('{')
+
+        if self._peek() == '}':
+            self.pos += 1
+            return Payload()
+
+        while True:
+            key = json.loads(self.read_value_text())
+            self._expect(':')
+
+            text = self.read_value_text()
+
+            if key in lazy_keys or len(text) > lazy_threshold:
+                raw_values[key] = text
+            else:
+                values[key] = json.loads(text)
+
+            if self._expect(',}') == '}':
+                return Payload(values, raw_values)
+
+def read_payload(stream, lazy_keys=DEFAULT_LAZY_KEYS, lazy_threshold=DEFAULT_LAZY_THRESHOLD, chunk_size=DEFAULT_CHUNK_SIZE, timer=None):
+    """
+    Read the payload from the stream. See PayloadReader.read_object().
+
+    Arguments:
+    stream -- The stream to read from
+    lazy_keys -- The keys whose values are always parsed lazily
+    lazy_threshold -- The size of the JSON text (in characters) above which values are parsed lazily
+    chunk_size -- The number of characters to read at a time
+    timer -- A PhaseTimer that records the time spent reading from the stream as the "read" phase (optional)
+    """
+
+    return PayloadReader(stream, chunk_size, timer).read_object(lazy_keys, lazy_threshold)
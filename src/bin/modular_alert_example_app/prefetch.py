@@ -0,0 +1,215 @@
+"""
+This module reads the results file ahead of the alert so that reading the results and running the
+alert against them overlap.
+
+Reading the results (decompressing the file and parsing the CSV) and running the alert otherwise
+happen one after the other on the same thread. Here a producer reads the results into chunks while
+the alert consumes the previous chunks; the producer waits once "queue_size" chunks are waiting to
+be consumed so that memory use stays bounded. The producer is either:
+
+ * a thread, which helps alerts whose run() waits on I/O (e.g. sending requests), since the thread
+   parses the results while run() waits, or
+ * a process, which also takes the CSV parsing off of the alert's process so that CPU-bound alerts
+   gain too (the values are pickled to the alert's process, which only builds the dictionaries).
+"""
+
+import multiprocessing
+import pickle
+import queue
+import threading
+
+from modular_alert_example_app.modular_alert import PREFETCH_THREAD, PREFETCH_PROCESS
+from modular_alert_example_app.results import open_results_file, make_row_builder, iter_results_file, iter_chunks
+
+# The number of seconds between checks of whether the consumer has stopped while the queue is full
+PUT_TIMEOUT = 0.1
+
+# Marks the end of the results in the queue
+_END = object()
+
+def iter_thread_prefetched(results_file, row_filter=None, chunk_size=1000, queue_size=2):
+    """
+    Iterate through the rows in the results file (like iter_results_file()) while a thread reads
+    the rows that follow.
+
+    Arguments:
+    results_file -- The path to the results file
+    row_filter -- A RowFilter; only the rows that match it are returned
+    chunk_size -- The number of rows that the thread passes at a time
+    queue_size -- The maximum number of chunks waiting to be consumed
+    """
+
+    chunks = queue.Queue(queue_size)
+    stopped = threading.Event()
+
+    def put(item):
+        # Give up if the consumer stopped while waiting for room in the queue
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for chunk in iter_chunks(iter_results_file(results_file, row_filter), chunk_size):
+                if not put(chunk):
+                    return
+
+            put(_END)
+
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, name='results-prefetch')
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            chunk = chunks.get()
+
+            if chunk is _END:
+                return
+
+            if isinstance(chunk, BaseException):
+                raise chunk
+
+            for row in chunk:
+                yield row
+
+    finally:
+        stopped.set()
+        thread.join()
+
+def _produce_values(results_file, connection, row_filter, chunk_size):
+    """
+    Read the results file in the producer process, sending the header and then chunks of the rows
+    (as lists of values) over the connection. An empty message marks the end of the rows.
+    """
+
+    import csv
+
+    try:
+        with open_results_file(results_file) as results_fp:
+            reader = csv.reader(results_fp)
+
+            try:
+                header = next(reader)
+            except StopIteration:
+                header = None
+
+            connection.send_bytes(pickle.dumps(header, pickle.HIGHEST_PROTOCOL))
+
+            if header is not None:
+                if row_filter is not None:
+                    matches = row_filter.bind(header)
+                    reader = (values for values in reader if matches(values))
+
+                for chunk in iter_chunks(reader, chunk_size):
+                    connection.send_bytes(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL))
+
+        connection.send_bytes(b'')
+
+    except (BrokenPipeError, EOFError):
+        # The consumer stopped reading
+        pass
+
+    except BaseException as e:
+        try:
+            connection.send_bytes(pickle.dumps(e, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            pass
+
+    finally:
+        connection.close()
+
+def get_process_context():
+    """
+    Get the multiprocessing context used to start the producer: the fork server if the platform
+    supports it (which avoids starting a new interpreter for each producer) or spawn otherwise.
+    """
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+def iter_process_prefetched(results_file, row_filter=None, chunk_size=1000):
+    """
+    Iterate through the rows in the results file (like iter_results_file()) while another process
+    reads and parses the rows that follow. The chunks are sent over a pipe, so the producer waits
+    while a chunk is waiting to be received (along with the chunk in the pipe's buffer and the one
+    being consumed, this keeps about three chunks in memory).
+
+    Arguments:
+    results_file -- The path to the results file
+    row_filter -- A RowFilter; only the rows that match it are returned
+    chunk_size -- The number of rows that the process sends at a time
+    """
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+
+    # Don't fork the alert's process (whose threads may hold locks, e.g. of the loggers); the
+    # producer only gets the sending end of the pipe, so sending fails once the consumer closes it
+    context = get_process_context()
+    process = context.Process(target=_produce_values, args=(results_file, sender, row_filter, chunk_size), name='results-prefetch')
+    process.daemon = True
+    process.start()
+
+    # The producer holds the only copy of the sending end so that its exit ends the pipe
+    sender.close()
+
+    try:
+        header = pickle.loads(receiver.recv_bytes())
+
+        if isinstance(header, BaseException):
+            raise header
+
+        if header is None:
+            return
+
+        make_row = make_row_builder(header)
+
+        while True:
+            data = receiver.recv_bytes()
+
+            if not data:
+                return
+
+            chunk = pickle.loads(data)
+
+            if isinstance(chunk, BaseException):
+                raise chunk
+
+            for values in chunk:
+                yield make_row(values)
+
+    finally:
+        receiver.close()
+        process.join(5)
+
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+def iter_prefetched(results_file, mode=PREFETCH_THREAD, row_filter=None, chunk_size=1000, queue_size=2):
+    """
+    Iterate through the rows in the results file (like iter_results_file()) while a thread or a
+    process reads the rows that follow (see the module description).
+
+    Arguments:
+    results_file -- The path to the results file
+    mode -- PREFETCH_THREAD or PREFETCH_PROCESS
+    row_filter -- A RowFilter; only the rows that match it are returned
+    chunk_size -- The number of rows that the producer passes at a time
+    queue_size -- The maximum number of chunks waiting to be consumed (when a thread is used)
+    """
+
+    if mode == PREFETCH_PROCESS:
+        return iter_process_prefetched(results_file, row_filter, chunk_size)
+    else:
+        return iter_thread_prefetched(results_file, row_filter, chunk_size, queue_size)
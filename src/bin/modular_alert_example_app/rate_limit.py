@@ -0,0 +1,189 @@
+"""
+This module contains a rate limiter that is shared by all of the alert processes on the host.
+
+Splunk runs a new process for each alert, so an alert storm can result in many processes sending
+requests to the same downstream system at once. The limiter keeps a token bucket for each key (e.g.
+an action and the destination it sends to) in a small memory-mapped file so that every process that
+uses the same file draws from the same buckets. The file is locked while a bucket is updated, which
+only takes a few microseconds, and processes that have to wait for tokens sleep without holding the lock.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+# The header of the file: a magic number identifying the format and the number of slots
+HEADER = struct.Struct('<8sI4x')
+MAGIC = b'MARATE01'
+
+# Each slot holds a bucket: a digest of its key, the number of tokens and the time that they were counted
+SLOT = struct.Struct('<16sdd')
+EMPTY_KEY = b'\x00' * 16
+
+class RateLimiterFullException(Exception):
+    """
+    Raised when a bucket can't be added because every slot in the file is in use.
+    """
+    pass
+
+class RateLimiter(object):
+    """
+    A set of token buckets stored in a file that can be shared by concurrent alert processes (and
+    the threads within them). Each bucket holds up to "burst" tokens and gains "rate" tokens per
+    second; taking a token is allowed when the bucket has one (see acquire()).
+    """
+
+    # The number of seconds after which an unused bucket may be replaced by a bucket for another key
+    IDLE_TIMEOUT = 3600
+
+    def __init__(self, path, slot_count=1024):
+        """
+        Open the file of buckets (creating it if necessary).
+
+        Arguments:
+        path -- The path of the file
+        slot_count -- The number of buckets that the file can hold (only used when the file is created)
+        """
+
+        self.path = path
+
+        directory = os.path.dirname(path)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+
+            # Initialize the file unless another process already did (the file is only ever grown)
+            if len(header) < HEADER.size or HEADER.unpack(header)[0] != MAGIC:
+                os.ftruncate(self._fd, HEADER.size + slot_count * SLOT.size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, slot_count), 0)
+            else:
+                slot_count = HEADER.unpack(header)[1]
+
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        self.slot_count = slot_count
+        self._map = mmap.mmap(self._fd, HEADER.size + slot_count * SLOT.size)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+    @staticmethod
+    def get_key_digest(key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+        # The empty key marks an unused slot
+        return digest if digest != EMPTY_KEY else b'\x01' + digest[1:]
+
+    def _find_slot(self, digest, now):
+        """
+        Get the offset of the slot for the key, claiming a slot (with a full bucket) if the key doesn't
+        have one yet. Must be called while the file is locked.
+
+        The slots are an open-addressed hash table. Slots are never emptied, so the search for a key
+        stops at the first empty slot; a slot that hasn't been used for IDLE_TIMEOUT seconds is
+        re-used for a new key in place (its bucket would have refilled by then anyway).
+        """
+
+        start = int.from_bytes(digest[:8], 'little') % self.slot_count
+        idle_offset = None
+
+        for i in range(self.slot_count):
+            offset = HEADER.size + ((start + i) % self.slot_count) * SLOT.size
+            slot_digest, _, updated = SLOT.unpack_from(self._map, offset)
+
+            if slot_digest == digest:
+                return offset, False
+
+            if slot_digest == EMPTY_KEY:
+                break
+
+            if idle_offset is None and now - updated > self.IDLE_TIMEOUT:
+                idle_offset = offset
+        else:
+            offset = None
+
+        if idle_offset is not None:
+            offset = idle_offset
+
+        if offset is None:
+            raise RateLimiterFullException("All %i slots in the rate limiter at %s are in use" % (self.slot_count, self.path))
+
+        return offset, True
+
+    def acquire(self, key, rate, burst, tokens=1, block=True, timeout=None):
+        """
+        Take tokens from the bucket for the key. Returns true if the tokens were taken or false if
+        they weren't (the caller should then drop the action that it was going to perform).
+
+        If the bucket doesn't have enough tokens and "block" is true, the tokens are reserved (the
+        bucket goes into debt so that processes waiting for tokens are served in the order that they
+        asked) and the call sleeps until the tokens would have been available. Otherwise, false is
+        returned straight away.
+
+        Arguments:
+        key -- The name of the bucket (e.g. the action and the destination)
+        rate -- The number of tokens that are added to the bucket per second
+        burst -- The maximum number of tokens that the bucket holds
+        tokens -- The number of tokens to take
+        block -- Indicates whether to wait for the tokens
+        timeout -- The maximum number of seconds to wait (false is returned if the wait would be longer)
+        """
+
+        digest = self.get_key_digest(key)
+        wait = 0.0
+
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+            try:
+                now = time.time()
+                offset, new = self._find_slot(digest, now)
+
+                if new:
+                    available = float(burst)
+                else:
+                    _, available, updated = SLOT.unpack_from(self._map, offset)
+                    available = min(float(burst), available + max(0.0, now - updated) * rate)
+
+                if available >= tokens:
+                    available -= tokens
+
+                elif block and rate > 0:
+                    wait = (tokens - available) / rate
+
+                    if timeout is not None and wait > timeout:
+                        return False
+
+                    available -= tokens
+
+                else:
+                    if new:
+                        SLOT.pack_into(self._map, offset, digest, available, now)
+
+                    return False
+
+                SLOT.pack_into(self._map, offset, digest, available, now)
+
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return True
@@ -0,0 +1,522 @@
+"""
+This module contains a client for splunkd's REST API that alerts can use to read KV store
+collections, lookups and configuration settings.
+
+Splunk passes each alert the URI of splunkd and a session key in the payload. Opening a connection
+for each request costs a TCP and TLS handshake (which often takes longer than the request itself),
+so the client keeps its connections alive in a pool and re-uses them. Alerts also tend to look up
+the same entries for many results, so the responses to GET requests are cached for a short time
+and batch_get() fetches many entries over several pooled connections at once, requesting each
+distinct URL only once.
+"""
+
+import collections
+import http.client
+import json
+import ssl
+import threading
+import time
+
+from urllib.parse import urlsplit, urlencode, quote
+
+# The errors raised when the server closed a kept-alive connection before the request was made on it
+STALE_CONNECTION_ERRORS = (http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+# The methods whose requests can be safely made again if no response was received
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE')
+
+# The hosts for which the certificate isn't verified by default (splunkd uses a self-signed certificate unless configured otherwise)
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+class SplunkdException(Exception):
+    """
+    Raised when splunkd responds to a request with an error.
+    """
+
+    def __init__(self, method, path, status, reason, messages=None):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.reason = reason
+        self.messages = messages or []
+
+        description = "; ".join(self.messages) or reason
+
+        super(SplunkdException, self).__init__("%s %s failed with status=%i: %s" % (method, path, status, description))
+
+class Response(collections.namedtuple('Response', ['status', 'reason', 'headers', 'body'])):
+    """
+    A response from splunkd (the body is the bytes of the response).
+    """
+
+    __slots__ = ()
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8')) if self.body else None
+
+def get_error_messages(body):
+    """
+    Get the messages from the body of an error response (splunkd describes errors in a "messages" list).
+    """
+
+    try:
+        return [message.get('text', '') for message in json.loads(body.decode('utf-8')).get('messages', [])]
+    except (ValueError, AttributeError, UnicodeDecodeError):
+        return []
+
+class ConnectionPool(object):
+    """
+    A pool of kept-alive connections to a host. Each connection is used by one request at a time;
+    connections beyond "max_size" are closed once their request completes.
+    """
+
+    def __init__(self, scheme, host, port, timeout=30, ssl_context=None, max_size=4):
+        """
+        Arguments:
+        scheme -- "https" or "http"
+        host -- The host name
+        port -- The port
+        timeout -- The number of seconds to wait for a connection or a response
+        ssl_context -- The SSL context of HTTPS connections
+        max_size -- The maximum number of idle connections to keep
+        """
+
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.max_size = max_size
+
+        self.created_count = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Get an idle connection or a new one. Returns a tuple of the connection and a boolean
+        indicating whether it was used before (in which case the server may have closed it).
+        """
+
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+
+            self.created_count += 1
+
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.ssl_context), False
+        else:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def put(self, connection):
+        """
+        Return a connection whose response was read completely to the pool.
+        """
+
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+
+        for connection in idle:
+            connection.close()
+
+class ResponseCache(object):
+    """
+    A cache of the responses to GET requests that expire after "ttl" seconds. The least recently
+    used responses are forgotten beyond "max_entries".
+    """
+
+    def __init__(self, ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key, response):
+        if self.ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path):
+        """
+        Forget the responses for the path and the paths below it (e.g. after it was modified).
+
+        Arguments:
+        path -- The path (without the query string)
+        """
+
+        with self._lock:
+            for key in [key for key in self._entries if key.split('?', 1)[0].startswith(path)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class SplunkdClient(object):
+    """
+    A client of splunkd's REST API (see the module description). The client can be used by several
+    threads at once; each request takes a connection from the pool.
+    """
+
+    def __init__(self, server_uri, session_key, app=None, owner='nobody', timeout=30, pool_size=4, cache_ttl=60, cache_max_entries=1024, verify=None):
+        """
+        Set up the client (no connection is made until a request is).
+
+        Arguments:
+        server_uri -- The URI of splunkd (e.g. "https://127.0.0.1:8089")
+        session_key -- The session key to authenticate with
+        app -- The app whose namespace is used by the convenience methods (e.g. get_kvstore_entries())
+        owner -- The owner whose namespace is used by the convenience methods
+        timeout -- The number of seconds to wait for a connection or a response
+        pool_size -- The number of connections to keep alive (and to use at once in batch_get())
+        cache_ttl -- The number of seconds to cache the responses to GET requests for (0 to not cache them)
+        cache_max_entries -- The maximum number of responses to cache
+        verify -- Indicates whether to verify the server's certificate (defaults to verifying it unless the server is on the loopback interface)
+        """
+
+        parts = urlsplit(server_uri)
+
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError("The server URI '%s' is not a valid http or https URI" % server_uri)
+
+        self.server_uri = server_uri
+        self.session_key = session_key
+        self.app = app
+        self.owner = owner
+        self.pool_size = pool_size
+
+        if verify is None:
+            verify = parts.hostname not in LOOPBACK_HOSTS
+
+        ssl_context = None
+
+        if parts.scheme == 'https':
+            ssl_context = ssl.create_default_context()
+
+            if not verify:
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+
+        self.pool = ConnectionPool(parts.scheme, parts.hostname, port, timeout, ssl_context, pool_size)
+        self.cache = ResponseCache(cache_ttl, cache_max_entries)
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+
+    @classmethod
+    def from_payload(cls, payload, **kwargs):
+        """
+        Make a client from the "server_uri" and "session_key" entries of the payload (the "app"
+        entry is used as the namespace of the convenience methods).
+
+        Arguments:
+        payload -- The payload from Splunk
+        """
+
+        server_uri = payload.get('server_uri')
+        session_key = payload.get('session_key')
+
+        if not server_uri or not session_key:
+            raise ValueError("The payload doesn't include the server_uri and session_key needed to connect to splunkd")
+
+        kwargs.setdefault('app', payload.get('app'))
+
+        return cls(server_uri, session_key, **kwargs)
+
+    @staticmethod
+    def make_url(path, params=None):
+        """
+        Make the URL of a request. The responses are requested as JSON unless the parameters include
+        "output_mode".
+
+        Arguments:
+        path -- The path (e.g. "/services/server/info")
+        params -- A dictionary (or a list of tuples) of the query parameters
+        """
+
+        params = list(params.items()) if isinstance(params, dict) else list(params or [])
+
+        if not any(name == 'output_mode' for name, _ in params):
+            params.append(('output_mode', 'json'))
+
+        return path + '?' + urlencode(params)
+
+    def get_namespace_path(self, endpoint, app=None, owner=None):
+        """
+        Get the path of an endpoint within the namespace of the app and owner (e.g.
+        "/servicesNS/nobody/search/storage/collections/data/assets").
+
+        Arguments:
+        endpoint -- The endpoint (e.g. "storage/collections/data/assets")
+        app -- The app (defaults to the client's app, or "-" for all apps)
+        owner -- The owner (defaults to the client's owner)
+        """
+
+        app = app or self.app or '-'
+        owner = owner or self.owner
+
+        return '/servicesNS/%s/%s/%s' % (quote(owner, safe=''), quote(app, safe=''), endpoint.lstrip('/'))
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Make a request on a pooled connection and return the Response (whatever its status). A
+        request that fails because the server closed an idle connection is retried on a new
+        connection if it couldn't be sent or if its method is idempotent (the server may have
+        acted on a request that was sent, e.g. a POST that created a KV store entry).
+
+        Arguments:
+        method -- The HTTP method (e.g. "GET")
+        url -- The path and query string (see make_url())
+        body -- The body of the request (bytes or a string)
+        headers -- A dictionary of additional headers
+        """
+
+        request_headers = {'Authorization' : 'Splunk %s' % self.session_key}
+
+        if headers:
+            request_headers.update(headers)
+
+        while True:
+            connection, reused = self.pool.get()
+            sent = False
+
+            try:
+                connection.request(method, url, body, request_headers)
+                sent = True
+
+                response = connection.getresponse()
+                data = response.read()
+
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+
+                if reused and (not sent or method.upper() in IDEMPOTENT_METHODS):
+                    continue
+
+                raise
+
+            except Exception:
+                connection.close()
+                raise
+
+            with self._count_lock:
+                self.request_count += 1
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.put(connection)
+
+            return Response(response.status, response.reason, dict(response.getheaders()), data)
+
+    def check_response(self, method, url, response):
+        if response.status >= 400:
+            raise SplunkdException(method, url.split('?', 1)[0], response.status, response.reason, get_error_messages(response.body))
+
+        return response.json()
+
+    def get(self, path, params=None, cache=True):
+        """
+        Make a GET request and return the JSON response. Raises a SplunkdException if splunkd
+        responds with an error.
+
+        Arguments:
+        path -- The path (e.g. "/services/server/info")
+        params -- A dictionary of the query parameters
+        cache -- Indicates whether the response may come from (and is stored in) the cache
+        """
+
+        url = self.make_url(path, params)
+        response = self.cache.get(url) if cache else None
+
+        if response is None:
+            response = self.request('GET', url)
+
+            if cache and response.status < 400:
+                self.cache.set(url, response)
+
+        return self.check_response('GET', url, response)
+
+    def post(self, path, data=None, params=None, json_body=None):
+        """
+        Make a POST request and return the JSON response. The cached responses for the path are
+        forgotten.
+
+        Arguments:
+        path -- The path (e.g. "/servicesNS/nobody/search/storage/collections/data/assets")
+        data -- A dictionary of the form parameters
+        params -- A dictionary of the query parameters
+        json_body -- A value to send as JSON instead of the form parameters (e.g. for the KV store)
+        """
+
+        url = self.make_url(path, params)
+
+        if json_body is not None:
+            body, headers = json.dumps(json_body), {'Content-Type' : 'application/json'}
+        else:
+            body, headers = urlencode(data or {}), {'Content-Type' : 'application/x-www-form-urlencoded'}
+
+        self.cache.invalidate(path)
+
+        return self.check_response('POST', url, self.request('POST', url, body, headers))
+
+    def delete(self, path, params=None):
+        """
+        Make a DELETE request and return the JSON response. The cached responses for the path are
+        forgotten.
+        """
+
+        url = self.make_url(path, params)
+
+        self.cache.invalidate(path)
+
+        return self.check_response('DELETE', url, self.request('DELETE', url))
+
+    def batch_get(self, requests, cache=True, return_exceptions=False):
+        """
+        Make many GET requests at once (e.g. to look up an entry for each of the results). Each
+        distinct request is only made once and the requests are spread over up to "pool_size"
+        connections. Returns a list of the JSON responses in the order of the requests.
+
+        Arguments:
+        requests -- A list of paths or tuples of a path and a dictionary of the query parameters
+        cache -- Indicates whether the responses may come from (and are stored in) the cache
+        return_exceptions -- If true, the exception is returned in place of the response of a request that failed instead of being raised
+        """
+
+        urls = [self.make_url(*request) if isinstance(request, tuple) else self.make_url(request) for request in requests]
+
+        responses = {}
+        pending = []
+
+        for url in urls:
+            if url in responses:
+                continue
+
+            response = self.cache.get(url) if cache else None
+            responses[url] = response
+
+            if response is None:
+                pending.append(url)
+
+        def fetch(url):
+            try:
+                response = self.request('GET', url)
+            except Exception as e:
+                return e
+
+            if cache and response.status < 400:
+                self.cache.set(url, response)
+
+            return response
+
+        if len(pending) == 1 or self.pool_size == 1:
+            fetched = [fetch(url) for url in pending]
+
+        elif pending:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=min(self.pool_size, len(pending))) as executor:
+                fetched = list(executor.map(fetch, pending))
+
+        else:
+            fetched = []
+
+        responses.update(zip(pending, fetched))
+
+        results = []
+
+        for url in urls:
+            response = responses[url]
+
+            try:
+                if isinstance(response, Exception):
+                    raise response
+
+                results.append(self.check_response('GET', url, response))
+
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+
+                results.append(e)
+
+        return results
+
+    def get_kvstore_entries(self, collection, query=None, app=None, owner=None, **params):
+        """
+        Get the entries of a KV store collection (optionally only those that match a query).
+
+        Arguments:
+        collection -- The name of the collection
+        query -- A dictionary of the query (e.g. {"ip" : "10.0.0.1"})
+        app -- The app that the collection belongs to (defaults to the client's app)
+        owner -- The owner of the collection (defaults to the client's owner)
+        params -- Other query parameters (e.g. limit, fields or sort)
+        """
+
+        if query is not None:
+            params['query'] = json.dumps(query, sort_keys=True, separators=(',', ':'))
+
+        return self.get(self.get_namespace_path('storage/collections/data/%s' % quote(collection, safe=''), app, owner), params)
+
+    def get_conf_stanza(self, conf, stanza, app=None, owner=None):
+        """
+        Get the settings in a stanza of a configuration file as a dictionary.
+
+        Arguments:
+        conf -- The name of the configuration file (without ".conf")
+        stanza -- The name of the stanza
+        app -- The app (defaults to the client's app)
+        owner -- The owner (defaults to the client's owner)
+        """
+
+        response = self.get(self.get_namespace_path('configs/conf-%s/%s' % (quote(conf, safe=''), quote(stanza, safe='')), app, owner))
+
+        return response['entry'][0]['content']
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+
+        self.pool.close()
@@ -0,0 +1,399 @@
+"""
+This module contains helpers for reading the search results that Splunk provides to a modular alert.
+
+Splunk writes the full set of results that triggered the alert to a gzipped CSV file and passes the
+path to it in the "results_file" entry of the payload. The functions below read this file lazily so
+that only a single row needs to be held in memory at a time.
+"""
+
+import csv
+import gzip
+import itertools
+import sys
+
+from collections.abc import Mapping
+
+# Splunk uses this prefix for the columns that encode multi-valued fields
+MV_FIELD_PREFIX = '__mv_'
+
+# Allow large field values (the default limit of 128 KB is easily exceeded by multi-valued fields)
+csv.field_size_limit(min(sys.maxsize, 2147483647))
+
+def open_results_file(results_file):
+    """
+    Open the results file for reading as text. Files that do not end in ".gz" are assumed to be uncompressed.
+
+    Arguments:
+    results_file -- The path to the results file
+    """
+
+    if results_file.endswith('.gz'):
+        return gzip.open(results_file, 'rt', newline='')
+    else:
+        return open(results_file, 'r', newline='')
+
+def iter_results_file_values(results_file):
+    """
+    Get the names of the columns in the results file along with an iterator of the rows (as lists
+    of values in the same order). The columns that Splunk uses to encode multi-valued fields are
+    excluded. Note that the file stays open until the rows have been consumed.
+
+    Arguments:
+    results_file -- The path to the results file
+    """
+
+    results_fp = open_results_file(results_file)
+    reader = csv.reader(results_fp)
+
+    try:
+        header = next(reader)
+    except StopIteration:
+        results_fp.close()
+        return [], iter(())
+
+    included = [index for index, name in enumerate(header) if not name.startswith(MV_FIELD_PREFIX)]
+    columns = [header[index] for index in included]
+
+    def iter_values():
+        with results_fp:
+            # Use the fast path if every column is to be included
+            if len(included) == len(header):
+                for values in reader:
+                    yield values
+            else:
+                for values in reader:
+                    yield [values[index] if index < len(values) else MISSING for index in included]
+
+    return columns, iter_values()
+
+def make_row_builder(header):
+    """
+    Make a function that converts a row from the CSV reader into a dictionary. The columns that Splunk
+    uses to encode multi-valued fields (those starting with "__mv_") are excluded.
+
+    Arguments:
+    header -- The names of the columns
+    """
+
+    # Determine which columns should be included
+    included = [(index, name) for index, name in enumerate(header) if not name.startswith(MV_FIELD_PREFIX)]
+
+    # Use the fast path if every column is to be included
+    if len(included) == len(header):
+        return lambda values: dict(zip(header, values))
+    else:
+        return lambda values: {name: values[index] for index, name in included if index < len(values)}
+
+def iter_results_file(results_file, row_filter=None):
+    """
+    Iterate through the rows in the results file, yielding a dictionary for each row. The columns
+    that Splunk uses to encode multi-valued fields (those starting with "__mv_") are excluded.
+
+    Arguments:
+    results_file -- The path to the results file
+    row_filter -- A RowFilter; only the rows that match it are returned (the filter is evaluated before the dictionary for the row is made)
+    """
+
+    with open_results_file(results_file) as results_fp:
+        reader = csv.reader(results_fp)
+
+        # Get the header
+        try:
+            header = next(reader)
+        except StopIteration:
+            return
+
+        make_row = make_row_builder(header)
+
+        if row_filter is None:
+            for values in reader:
+                yield make_row(values)
+        else:
+            matches = row_filter.bind(header)
+
+            for values in reader:
+                if matches(values):
+                    yield make_row(values)
+
+def iter_chunks(rows, chunk_size):
+    """
+    Split the rows into lists of up to chunk_size rows.
+
+    Arguments:
+    rows -- An iterable of rows
+    chunk_size -- The maximum number of rows in each chunk
+    """
+
+    rows = iter(rows)
+
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+# The number of distinct values in a column beyond which share_values() stops sharing its values
+MAX_SHARED_VALUES = 1024
+
+def share_values(rows, column_count):
+    """
+    Replace the repeated values in each column with a single shared instance. Many fields in search
+    results have only a few distinct values (e.g. host or sourcetype) but the CSV reader creates a
+    new string for every one. Columns with many distinct values (e.g. _raw) are left alone.
+
+    Arguments:
+    rows -- An iterable of rows (lists of values)
+    column_count -- The number of columns
+    """
+
+    caches = [{} for _ in range(column_count)]
+    shared = [index for index in range(column_count)]
+
+    for values in rows:
+        for index in shared:
+            if index < len(values):
+                value = values[index]
+                cache = caches[index]
+                values[index] = cache.setdefault(value, value)
+
+                if len(cache) > MAX_SHARED_VALUES:
+                    shared = [i for i in shared if i != index]
+                    caches[index] = None
+
+        yield values
+
+class _Missing(object):
+    """
+    The value stored in a ResultSet for a field that a row doesn't have.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        return 'MISSING'
+
+MISSING = _Missing()
+
+class ResultRow(Mapping):
+    """
+    A read-only, dictionary-like view of a row in a ResultSet. The field names are shared with the
+    other rows in the set so each row only holds its values. A row may have fewer values than there
+    are fields (if fields were added to the set after the row); the remaining fields are missing.
+    """
+
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        """
+        Arguments:
+        index -- A dictionary of the field names to their position in the values
+        values -- A tuple of the values (MISSING for the fields that the row doesn't have)
+        """
+
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+
+        if value is MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+
+        if position is None or position >= len(self._values):
+            return default
+
+        value = self._values[position]
+
+        if value is MISSING:
+            return default
+
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __iter__(self):
+        for name, value in zip(self._index, self._values):
+            if value is not MISSING:
+                yield name
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not MISSING)
+
+    def __repr__(self):
+        return 'ResultRow(%r)' % self.to_dict()
+
+    def __getstate__(self):
+        return (self._index, self._values)
+
+    def __setstate__(self, state):
+        self._index, self._values = state
+
+    def to_dict(self):
+        """
+        Get the row as a (new) dictionary.
+        """
+
+        return dict((name, value) for name, value in zip(self._index, self._values) if value is not MISSING)
+
+class ResultSet(object):
+    """
+    A compact set of results. The field names are stored once and each row is stored as a tuple of
+    values, which takes a fraction of the memory of a dictionary per row. Iterating over the set
+    yields ResultRow views, which can be used like the dictionaries that iter_results() returns
+    (e.g. row.get('source')) but can't be modified.
+    """
+
+    __slots__ = ('_index', '_rows')
+
+    def __init__(self, columns, rows=None):
+        """
+        Arguments:
+        columns -- The names of the fields
+        rows -- An iterable of rows, each of which is a sequence of values in the same order as the columns (optional)
+        """
+
+        self._index = dict((name, position) for position, name in enumerate(columns))
+        self._rows = []
+
+        if len(self._index) != len(columns):
+            raise ValueError("The column names must be unique")
+
+        if rows is not None:
+            self.extend(rows)
+
+    @classmethod
+    def from_dicts(cls, rows):
+        """
+        Make a result set from dictionaries. Columns are added for each field as it is first seen.
+
+        Arguments:
+        rows -- An iterable of dictionaries
+        """
+
+        result_set = cls([])
+
+        for row in rows:
+            result_set.append_dict(row)
+
+        return result_set
+
+    @classmethod
+    def from_results_file(cls, results_file):
+        """
+        Load the rows in the results file (see iter_results_file_values()).
+
+        Arguments:
+        results_file -- The path to the results file
+        """
+
+        columns, rows = iter_results_file_values(results_file)
+
+        return cls(columns, share_values(rows, len(columns)))
+
+    @property
+    def columns(self):
+        return list(self._index)
+
+    def append(self, values):
+        """
+        Add a row. The fields after the last value are missing if the row has fewer values than
+        there are columns.
+
+        Arguments:
+        values -- A sequence of values in the same order as the columns
+        """
+
+        values = tuple(values)
+
+        if len(values) > len(self._index):
+            raise ValueError("The row has %i values but there are only %i columns" % (len(values), len(self._index)))
+
+        self._rows.append(values)
+
+    def extend(self, rows):
+        """
+        Add the rows.
+
+        Arguments:
+        rows -- An iterable of sequences of values in the same order as the columns
+        """
+
+        for values in rows:
+            self.append(values)
+
+    def append_dict(self, row):
+        """
+        Add a row from a dictionary (adding columns for the fields that haven't been seen before).
+
+        Arguments:
+        row -- A dictionary (or ResultRow)
+        """
+
+        index = self._index
+
+        for name in row:
+            if name not in index:
+                index[name] = len(index)
+
+        values = [MISSING] * len(index)
+
+        for name, value in row.items():
+            values[index[name]] = value
+
+        self._rows.append(tuple(values))
+
+    def column(self, name, field=None, as_array=False):
+        """
+        Get the values of a field from every row (with None for the rows that don't have the field).
+        If a field is provided, the values are converted with the field's to_python_many() and its
+        result (the converted values and the error mask) is returned instead.
+
+        Arguments:
+        name -- The name of the field
+        field -- The Field to convert the values with (optional)
+        as_array -- If true, numeric fields return the converted values as a NumPy array (see Field.to_python_many())
+        """
+
+        position = self._index[name]
+        values = [None if position >= len(row) or row[position] is MISSING else row[position] for row in self._rows]
+
+        if field is not None:
+            return field.to_python_many(values, as_array=as_array)
+
+        return values
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, position):
+        return ResultRow(self._index, self._rows[position])
+
+    def __iter__(self):
+        index = self._index
+
+        for values in self._rows:
+            yield ResultRow(index, values)
+
+    def __getstate__(self):
+        return (self._index, self._rows)
+
+    def __setstate__(self, state):
+        self._index, self._rows = state
+
+    def to_dicts(self):
+        """
+        Get the rows as a list of dictionaries.
+        """
+
+        return [row.to_dict() for row in self]
@@ -0,0 +1,368 @@
+"""
+This module contains a sidecar index of a results file that speeds up repeated filtered scans of it.
+
+The index stores, for each row, the number of lines that the row takes up in the (uncompressed) CSV
+along with the values of the columns that filters refer to (dictionary-encoded, so each distinct
+value is only stored once). A RowFilter can then be evaluated against the distinct values in the
+index instead of the rows. The rows that don't match are skipped by reading past their lines, so
+only the matching rows are parsed, and the file isn't read past the last matching row.
+
+The index is written next to the results file when the file is first scanned and is rebuilt if the
+results file changes or the filter refers to columns that aren't in the index.
+"""
+
+import array
+import csv
+import gzip
+import itertools
+import json
+import os
+
+from modular_alert_example_app.results import make_row_builder
+
+INDEX_VERSION = 1
+
+# The typecode of the arrays of line counts and value codes (columns with up to 256 distinct values use bytes)
+ARRAY_TYPECODE = 'I'
+SMALL_ARRAY_TYPECODE = 'B'
+
+# The number of bytes read from the results file at a time when it is scanned using the index
+READ_SIZE = 1048576
+
+def open_results_file_binary(results_file):
+    """
+    Open the results file for reading as bytes. The index counts the lines of the file as bytes
+    (separated by a newline character only) so that the lines can be skipped without decoding them.
+
+    Arguments:
+    results_file -- The path to the results file
+    """
+
+    if results_file.endswith('.gz'):
+        return gzip.open(results_file, 'rb')
+    else:
+        return open(results_file, 'rb')
+
+def decode_lines(lines):
+    """
+    Decode the lines of the results file so that they can be parsed by the CSV reader.
+    """
+
+    for line in lines:
+        yield line.decode('utf-8')
+
+def iter_lines(results_fp, line_numbers):
+    """
+    Get the lines of the file with the given line numbers. The file is read in large blocks that are
+    split into lines so the lines in between aren't handled individually.
+
+    Arguments:
+    results_fp -- The file (opened in binary mode)
+    line_numbers -- An iterable of the line numbers (in ascending order)
+    """
+
+    lines = []
+    first_line = 0
+    partial = b''
+    eof = False
+
+    for line_number in line_numbers:
+        while line_number >= first_line + len(lines) and not eof:
+            data = results_fp.read(READ_SIZE)
+
+            if data:
+                parts = (partial + data).split(b'\n')
+                partial = parts.pop()
+            else:
+                parts = [partial] if partial else []
+                eof = True
+
+            # Drop the lines before the line that is needed
+            skip = min(line_number - first_line, len(lines))
+            first_line += skip
+            lines = lines[skip:] + parts
+
+        if line_number >= first_line + len(lines):
+            return
+
+        yield lines[line_number - first_line] + b'\n'
+
+def get_index_path(results_file):
+    """
+    Get the path of the index of the results file.
+
+    Arguments:
+    results_file -- The path to the results file
+    """
+
+    return results_file + '.idx'
+
+class ResultsIndex(object):
+    """
+    An index of a results file (see the module description).
+    """
+
+    def __init__(self, header, header_lines, line_counts, columns, source_size=None, source_mtime=None):
+        """
+        Arguments:
+        header -- The names of the columns in the results file
+        header_lines -- The number of lines that the header takes up
+        line_counts -- An array of the number of lines that each row takes up
+        columns -- A dictionary of the names of the indexed columns to a tuple of the distinct values and an array of the codes of each row's value (its index in the distinct values)
+        source_size -- The size of the results file that the index was built from
+        source_mtime -- The modification time of the results file that the index was built from
+        """
+
+        self.header = header
+        self.header_lines = header_lines
+        self.line_counts = line_counts
+        self.columns = columns
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+
+    @staticmethod
+    def get_source_stat(results_file):
+        stat = os.stat(results_file)
+        return stat.st_size, stat.st_mtime
+
+    def is_current(self, results_file, column_names):
+        """
+        Determine whether the index was built from the results file as it is now and includes the columns.
+
+        Arguments:
+        results_file -- The path to the results file
+        column_names -- The names of the columns that must be indexed
+        """
+
+        if (self.source_size, self.source_mtime) != self.get_source_stat(results_file):
+            return False
+
+        for name in column_names:
+            if name in self.header and name not in self.columns:
+                return False
+
+        return True
+
+    def save(self, path):
+        """
+        Write the index to the path (atomically, by renaming a new file over it). The index is stored
+        as a line of JSON describing it followed by the arrays.
+
+        Arguments:
+        path -- The path to write the index to
+        """
+
+        column_names = list(self.columns.keys())
+
+        metadata = {
+            'version' : INDEX_VERSION,
+            'itemsize' : self.line_counts.itemsize,
+            'source_size' : self.source_size,
+            'source_mtime' : self.source_mtime,
+            'header' : self.header,
+            'header_lines' : self.header_lines,
+            'rows' : len(self.line_counts),
+            'columns' : column_names,
+            'typecodes' : [self.columns[name][1].typecode for name in column_names],
+            'values' : [self.columns[name][0] for name in column_names]
+        }
+
+        temp_path = path + '.tmp'
+
+        with open(temp_path, 'wb') as index_fp:
+            index_fp.write(json.dumps(metadata).encode('utf-8'))
+            index_fp.write(b'\n')
+
+            self.line_counts.tofile(index_fp)
+
+            for name in column_names:
+                self.columns[name][1].tofile(index_fp)
+
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read the index from the path. Returns None if the index doesn't exist or can't be read.
+
+        Arguments:
+        path -- The path of the index
+        """
+
+        try:
+            with open(path, 'rb') as index_fp:
+                metadata = json.loads(index_fp.readline().decode('utf-8'))
+
+                if metadata.get('version') != INDEX_VERSION or metadata['itemsize'] != array.array(ARRAY_TYPECODE).itemsize:
+                    return None
+
+                line_counts = array.array(ARRAY_TYPECODE)
+                line_counts.fromfile(index_fp, metadata['rows'])
+
+                columns = {}
+
+                for name, typecode, values in zip(metadata['columns'], metadata['typecodes'], metadata['values']):
+                    codes = array.array(typecode)
+                    codes.fromfile(index_fp, metadata['rows'])
+                    columns[name] = (values, codes)
+
+        except (IOError, OSError, ValueError, KeyError, EOFError):
+            return None
+
+        return cls(metadata['header'], metadata['header_lines'], line_counts, columns, metadata['source_size'], metadata['source_mtime'])
+
+    def get_matching_rows(self, row_filter):
+        """
+        Get a bytes object with a non-zero entry for each row that matches the filter.
+
+        Arguments:
+        row_filter -- The RowFilter
+        """
+
+        row_count = len(self.line_counts)
+        mask = b'\x01' * row_count
+
+        for name, predicate in row_filter.get_predicates():
+
+            # Rows don't have the fields that aren't in the results file
+            if name not in self.columns:
+                if not predicate(None):
+                    return bytes(row_count)
+
+                continue
+
+            values, codes = self.columns[name]
+
+            # Evaluate the condition once for each distinct value
+            value_matches = bytes(1 if predicate(value) else 0 for value in values)
+
+            if codes.typecode == SMALL_ARRAY_TYPECODE:
+                column_mask = codes.tobytes().translate(value_matches.ljust(256, b'\x00'))
+            else:
+                column_mask = bytes(value_matches[code] for code in codes)
+
+            mask = (int.from_bytes(mask, 'big') & int.from_bytes(column_mask, 'big')).to_bytes(row_count, 'big')
+
+        return mask
+
+    def iter_results(self, results_file, row_filter):
+        """
+        Iterate through the rows in the results file that match the filter, yielding a dictionary
+        for each row (like iter_results_file()).
+
+        Arguments:
+        results_file -- The path to the results file
+        row_filter -- The RowFilter
+        """
+
+        mask = self.get_matching_rows(row_filter)
+        line_counts = self.line_counts
+        make_row = make_row_builder(self.header)
+
+        # Get the line number that each matching row starts at
+        start_lines = itertools.accumulate(itertools.chain((self.header_lines,), line_counts))
+        matching_rows = [(start_line, line_count) for start_line, line_count, matches in zip(start_lines, line_counts, mask) if matches]
+
+        line_numbers = (start_line + i for start_line, line_count in matching_rows for i in range(line_count))
+
+        with open_results_file_binary(results_file) as results_fp:
+            lines = iter_lines(results_fp, line_numbers)
+
+            for start_line, line_count in matching_rows:
+                row_lines = [line.decode('utf-8') for line in itertools.islice(lines, line_count)]
+                yield make_row(next(csv.reader(row_lines)))
+
+def build_index(results_file, column_names, row_filter=None):
+    """
+    Scan the results file to build its index, yielding the rows that match the filter (like
+    iter_results_file()) along the way. The index is returned once the scan is complete (via
+    StopIteration.value, so use "index = yield from build_index(...)" or see iter_indexed_results()).
+
+    Arguments:
+    results_file -- The path to the results file
+    column_names -- The names of the columns to index
+    row_filter -- The RowFilter (optional)
+    """
+
+    source_size, source_mtime = ResultsIndex.get_source_stat(results_file)
+
+    with open_results_file_binary(results_file) as results_fp:
+        reader = csv.reader(decode_lines(results_fp))
+
+        try:
+            header = next(reader)
+        except StopIteration:
+            header = []
+
+        header_lines = reader.line_num
+        line_counts = array.array(ARRAY_TYPECODE)
+
+        # The distinct values of each indexed column (mapped to their code) and the codes of the rows
+        indexed = [(position, name, {}, array.array(ARRAY_TYPECODE)) for position, name in enumerate(header) if name in column_names]
+
+        make_row = make_row_builder(header)
+        matches = row_filter.bind(header) if row_filter is not None else None
+        last_line = header_lines
+
+        for values in reader:
+            line_counts.append(reader.line_num - last_line)
+            last_line = reader.line_num
+
+            for position, name, distinct_values, codes in indexed:
+                value = values[position] if position < len(values) else None
+                code = distinct_values.get(value)
+
+                if code is None:
+                    code = len(distinct_values)
+                    distinct_values[value] = code
+
+                codes.append(code)
+
+            if matches is None or matches(values):
+                yield make_row(values)
+
+    columns = {}
+
+    for _, name, distinct_values, codes in indexed:
+        if len(distinct_values) <= 256:
+            codes = array.array(SMALL_ARRAY_TYPECODE, codes)
+
+        columns[name] = (list(distinct_values.keys()), codes)
+
+    return ResultsIndex(header, header_lines, line_counts, columns, source_size, source_mtime)
+
+def iter_indexed_results(results_file, row_filter, index_path=None):
+    """
+    Iterate through the rows in the results file that match the filter using the index of the
+    file. If the index doesn't exist or is out of date, it is built while the rows are read (and
+    saved once the entire file has been read).
+
+    Arguments:
+    results_file -- The path to the results file
+    row_filter -- The RowFilter
+    index_path -- The path of the index (defaults to the path of the results file with ".idx" appended)
+    """
+
+    if index_path is None:
+        index_path = get_index_path(results_file)
+
+    column_names = row_filter.field_names
+    index = ResultsIndex.load(index_path)
+
+    if index is not None and index.is_current(results_file, column_names):
+        for row in index.iter_results(results_file, row_filter):
+            yield row
+
+        return
+
+    # Keep the columns that were indexed for other filters
+    if index is not None:
+        column_names = list(set(column_names) | set(index.columns.keys()))
+
+    index = yield from build_index(results_file, column_names, row_filter)
+
+    # The index is only an optimization so don't fail if it can't be written
+    try:
+        index.save(index_path)
+    except (IOError, OSError):
+        pass
@@ -0,0 +1,265 @@
+"""
+This module contains a buffer of search results that spills to temporary files once it exceeds a
+memory budget.
+
+Alerts that need to hold all of the results at once (e.g. to group or sort them before acting on
+them) would otherwise use memory in proportion to the number of results. A RowBuffer keeps the rows
+in memory until their estimated size exceeds the budget and then writes them out as a "run" to a
+temporary file. Iterating through the buffer reads the runs back one chunk at a time; if the buffer
+is sorted, each run is sorted before it is written and the runs are merged (an external merge sort).
+When there are more runs than can be merged at once, batches of them are first merged into longer
+runs so that the number of open runs (and the chunks of them held in memory) stays bounded.
+"""
+
+import heapq
+import itertools
+import pickle
+import sys
+import tempfile
+
+# The number of rows that are pickled together when the buffer is spilled
+SPILL_CHUNK_SIZE = 1000
+
+# The size of every this many rows is measured to estimate the memory that the rows use
+SAMPLE_INTERVAL = 64
+
+# The maximum number of runs that are merged at once
+MAX_MERGE_RUNS = 64
+
+def estimate_row_size(row):
+    """
+    Estimate the number of bytes used by a row and its values. The keys aren't counted since they
+    are shared by the rows read from the same results file.
+
+    Arguments:
+    row -- A dictionary (or another mapping, such as a ResultRow) representing the search result
+    """
+
+    getsizeof = sys.getsizeof
+
+    return getsizeof(row) + sum(getsizeof(value) for value in row.values())
+
+def iter_run(run_fp):
+    """
+    Iterate through the rows that were spilled to a file. The position within the file is tracked
+    separately so that the same run can be iterated more than once.
+
+    Arguments:
+    run_fp -- The temporary file that the run was written to
+    """
+
+    offset = 0
+
+    while True:
+        run_fp.seek(offset)
+
+        try:
+            chunk = pickle.load(run_fp)
+        except EOFError:
+            return
+
+        offset = run_fp.tell()
+
+        for row in chunk:
+            yield row
+
+class RowBuffer(object):
+    """
+    A collection of rows that holds no more than "memory_budget" bytes of rows in memory (see the
+    module description). Rows are added with append() or extend() and read back by iterating through
+    the buffer, either in the order that they were added or, if a sort key is given, in sorted order.
+    """
+
+    def __init__(self, memory_budget=None, sort_key=None, temp_dir=None, max_merge_runs=MAX_MERGE_RUNS):
+        """
+        Set up the buffer.
+
+        Arguments:
+        memory_budget -- The number of bytes of rows to hold in memory (or None to never spill)
+        sort_key -- A function that gets the key to sort the rows by (or None to keep the rows in the order they were added)
+        temp_dir -- The directory for the temporary files (defaults to the system's temporary directory)
+        max_merge_runs -- The maximum number of runs that are merged at once
+        """
+
+        self.memory_budget = memory_budget
+        self.sort_key = sort_key
+        self.temp_dir = temp_dir
+        self.max_merge_runs = max(2, max_merge_runs)
+
+        self.row_count = 0
+        self.spilled_count = 0
+
+        self._rows = []
+        self._runs = []
+        self._row_size = 0.0
+        self._samples = 0
+        self._peak_memory = 0
+
+    def append(self, row):
+        """
+        Add a row, first spilling the rows held in memory if the row would exceed the budget.
+
+        Arguments:
+        row -- A dictionary representing the search result
+        """
+
+        self.row_count += 1
+
+        if self.memory_budget is not None:
+
+            # Keep a running average of the size of the rows
+            if self._samples == 0 or self.row_count % SAMPLE_INTERVAL == 0:
+                self._row_size += (estimate_row_size(row) - self._row_size) / (self._samples + 1)
+                self._samples += 1
+
+            if (len(self._rows) + 1) * self._row_size > self.memory_budget:
+                self.spill()
+
+        self._rows.append(row)
+
+    def extend(self, rows):
+        append = self.append
+
+        for row in rows:
+            append(row)
+
+    @property
+    def memory_used(self):
+        """
+        Get the estimated number of bytes used by the rows held in memory.
+        """
+
+        return int(len(self._rows) * self._row_size)
+
+    @property
+    def peak_memory(self):
+        """
+        Get the largest estimated number of bytes used by the rows held in memory at once.
+        """
+
+        return max(self._peak_memory, self.memory_used)
+
+    def spill(self):
+        """
+        Write the rows held in memory to a temporary file.
+        """
+
+        if not self._rows:
+            return
+
+        self._peak_memory = self.peak_memory
+
+        rows = self._rows
+        self._rows = []
+
+        if self.sort_key is not None:
+            rows.sort(key=self.sort_key)
+
+        self._runs.append(self._write_run(rows))
+        self.spilled_count += len(rows)
+
+    def _write_run(self, rows):
+        """
+        Write the rows to a new temporary file and return the file.
+
+        Arguments:
+        rows -- An iterable of the rows
+        """
+
+        run_fp = tempfile.TemporaryFile(prefix='modalert_spill_', dir=self.temp_dir)
+
+        try:
+            # Each chunk is pickled separately so that the pickler doesn't keep references to every row
+            rows = iter(rows)
+
+            while True:
+                chunk = list(itertools.islice(rows, SPILL_CHUNK_SIZE))
+
+                if not chunk:
+                    break
+
+                pickle.dump(chunk, run_fp, pickle.HIGHEST_PROTOCOL)
+
+            run_fp.flush()
+        except Exception:
+            run_fp.close()
+            raise
+
+        return run_fp
+
+    def _reduce_runs(self):
+        """
+        Merge batches of the runs into longer runs until there are few enough runs to merge them
+        (and the rows held in memory) at once. Consecutive runs are merged so that rows with the
+        same key stay in the order they were added.
+        """
+
+        while len(self._runs) > self.max_merge_runs - 1:
+            runs = []
+            merged = []
+
+            try:
+                for start in range(0, len(self._runs), self.max_merge_runs):
+                    batch = self._runs[start:start + self.max_merge_runs]
+
+                    if len(batch) == 1:
+                        runs.append(batch[0])
+                        continue
+
+                    runs.append(self._write_run(heapq.merge(*(iter_run(run_fp) for run_fp in batch), key=self.sort_key)))
+                    merged.extend(batch)
+
+            except Exception:
+                for run_fp in runs:
+                    if run_fp not in self._runs:
+                        run_fp.close()
+                raise
+
+            for run_fp in merged:
+                run_fp.close()
+
+            self._runs = runs
+
+    @property
+    def run_count(self):
+        """
+        Get the number of temporary files that the rows were spilled to.
+        """
+
+        return len(self._runs)
+
+    def __len__(self):
+        return self.row_count
+
+    def __iter__(self):
+        if self.sort_key is None:
+            runs = [iter_run(run_fp) for run_fp in self._runs]
+            return itertools.chain(itertools.chain.from_iterable(runs), list(self._rows))
+
+        self._rows.sort(key=self.sort_key)
+
+        if not self._runs:
+            return iter(list(self._rows))
+
+        self._reduce_runs()
+        runs = [iter_run(run_fp) for run_fp in self._runs]
+
+        # Only a chunk of each run is held in memory while the runs are merged
+        return heapq.merge(*(runs + [list(self._rows)]), key=self.sort_key)
+
+    def close(self):
+        """
+        Remove the temporary files and the rows held in memory.
+        """
+
+        for run_fp in self._runs:
+            run_fp.close()
+
+        self._runs = []
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,335 @@
+"""
+This module contains a durable spool of the alert executions that failed so that they can be
+replayed later (rather than re-running the search that triggered them).
+
+The spool is an append-only file with one JSON entry per line. Entries are only ever appended
+(sequential writes that are fsynced in batches); replaying the spool records the entries that were
+replayed in an append-only checkpoint file instead of rewriting the spool. The spool is truncated
+once every entry in it has been replayed.
+"""
+
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+
+# The records in the checkpoint: the offset of an entry that was replayed and the offset of the next entry
+CHECKPOINT_RECORD = struct.Struct('<QQ')
+
+class SpoolLockedException(Exception):
+    """
+    Raised when the spool is already being replayed by another process.
+    """
+    pass
+
+class Spool(object):
+    """
+    An append-only spool of JSON entries that can be shared by concurrent alert processes.
+    """
+
+    def __init__(self, path, fsync_interval=1.0, fsync_count=100):
+        """
+        Open the spool (creating it if necessary).
+
+        Arguments:
+        path -- The path of the spool file
+        fsync_interval -- The number of seconds after which appended entries are synced to disk
+        fsync_count -- The number of appended entries after which they are synced to disk
+        """
+
+        self.path = path
+        self.checkpoint_path = path + '.checkpoint'
+        self.fsync_interval = fsync_interval
+        self.fsync_count = fsync_count
+
+        directory = os.path.dirname(path)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def append(self, entry):
+        """
+        Append an entry to the spool. The entry is written immediately but is only synced to disk
+        once enough entries have been appended or enough time has passed (see sync()). The entry is
+        given a unique "entry_id" (unless it already has one) that identifies it when it is replayed.
+
+        Arguments:
+        entry -- A JSON-serializable dictionary
+        """
+
+        if not entry.get('entry_id'):
+            entry = dict(entry, entry_id=uuid.uuid4().hex)
+
+        data = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+
+        with self._lock:
+            # Hold the file lock so that the lines written by concurrent processes aren't interleaved
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+            try:
+                view = memoryview(data)
+
+                while view:
+                    view = view[os.write(self._fd, view):]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+            self._unsynced += 1
+
+            if self._unsynced >= self.fsync_count or (time.time() - self._last_sync) >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._fd)
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def sync(self):
+        """
+        Sync the appended entries to disk.
+        """
+
+        with self._lock:
+            if self._unsynced > 0:
+                self._sync()
+
+    def close(self):
+        if self._fd is not None:
+            self.sync()
+            os.close(self._fd)
+            self._fd = None
+
+    def iter_entries(self, start_offset=0, end_offset=None):
+        """
+        Iterate through the entries in the spool, yielding the offset of each entry, the offset of
+        the next entry and the entry. The file is read sequentially so that only one entry is held in
+        memory at a time. A partially written entry at the end of the file is skipped.
+
+        Arguments:
+        start_offset -- The offset to start reading at
+        end_offset -- The offset to stop reading at (defaults to the end of the file)
+        """
+
+        with open(self.path, 'rb') as spool_fp:
+            spool_fp.seek(start_offset)
+            offset = start_offset
+
+            for line in spool_fp:
+                next_offset = offset + len(line)
+
+                if (end_offset is not None and next_offset > end_offset) or not line.endswith(b'\n'):
+                    return
+
+                yield offset, next_offset, json.loads(line.decode('utf-8'))
+
+                offset = next_offset
+
+    def read_checkpoint(self):
+        """
+        Get the offset up to which every entry has been replayed along with a dictionary of the
+        entries after that offset that were also replayed (mapping their offset to the offset of
+        the next entry). The checkpoint is read sequentially so only the entries that were replayed
+        out of order are held in memory.
+        """
+
+        offset = 0
+        done = {}
+
+        try:
+            checkpoint_fp = open(self.checkpoint_path, 'rb')
+        except (IOError, OSError):
+            return offset, done
+
+        with checkpoint_fp:
+            while True:
+                record = checkpoint_fp.read(CHECKPOINT_RECORD.size)
+
+                # A partially written record at the end is ignored
+                if len(record) < CHECKPOINT_RECORD.size:
+                    break
+
+                entry_offset, next_offset = CHECKPOINT_RECORD.unpack(record)
+                done[entry_offset] = next_offset
+                offset = self._advance(offset, done)
+
+        return offset, done
+
+    def replay(self, handler, concurrency=4):
+        """
+        Replay the entries in the spool that haven't been replayed yet. Returns the number of
+        entries that were replayed.
+
+        The handler is called (concurrently, on up to "concurrency" threads) with each entry. It
+        returns None if the entry was handled or an entry to append to the spool if it should be
+        retried later (the appended entries aren't replayed until the next call).
+
+        Each entry is recorded in the checkpoint (an append-only file of the offsets of the entries
+        that were replayed) as soon as its handler returns, so an entry is only replayed again if
+        the process stops between the handler returning and the record being written. The
+        checkpoint is synced to disk along with the entries appended to the spool.
+
+        Delivery is therefore at-least-once: each entry carries the "entry_id" that it was appended
+        with (see append()) so that handlers whose actions aren't idempotent can skip the entries that
+        they already handled.
+
+        A SpoolLockedException is raised if another process is replaying the spool.
+
+        Arguments:
+        handler -- A function that takes an entry
+        concurrency -- The maximum number of entries that are replayed at once
+        """
+
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        lock_fd = os.open(self.path + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                raise SpoolLockedException("The spool at %s is already being replayed" % self.path)
+
+            # Make sure the entries appended by this process are visible before reading them
+            self.sync()
+
+            offset, done = self.read_checkpoint()
+            end_offset = os.path.getsize(self.path)
+
+            checkpoint_fd = os.open(self.checkpoint_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+            # Start over if the spool was emptied without the checkpoint being cleared
+            if offset > end_offset:
+                offset, done = 0, {}
+                os.ftruncate(checkpoint_fd, 0)
+
+            replayed = 0
+            futures = {}
+
+            def complete(completed):
+                nonlocal offset
+                records = []
+
+                for future in completed:
+                    entry_offset, next_offset, entry = futures.pop(future)
+
+                    # Retry the entry as-is if the handler failed unexpectedly
+                    try:
+                        retry_entry = future.result()
+                    except Exception:
+                        retry_entry = entry
+
+                    # A retry is a new entry (so it gets a new ID)
+                    if retry_entry is not None:
+                        self.append(dict(retry_entry, entry_id=None))
+
+                    done[entry_offset] = next_offset
+                    records.append(CHECKPOINT_RECORD.pack(entry_offset, next_offset))
+
+                os.write(checkpoint_fd, b''.join(records))
+
+                # Forget the entries that are behind the first one still being replayed so that only the
+                # entries that completed out of order are held in memory
+                offset = self._advance(offset, done)
+
+                return len(records)
+
+            try:
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    for entry_offset, next_offset, entry in self.iter_entries(offset, end_offset):
+
+                        # Skip the entries that were replayed before the process stopped
+                        if entry_offset < offset or entry_offset in done:
+                            continue
+
+                        # Wait for an entry to complete so that no more than "concurrency" entries are held at once
+                        while len(futures) >= concurrency:
+                            replayed += complete(wait(futures, return_when=FIRST_COMPLETED)[0])
+
+                        futures[executor.submit(handler, entry)] = (entry_offset, next_offset, entry)
+
+                    while futures:
+                        replayed += complete(wait(futures, return_when=FIRST_COMPLETED)[0])
+
+                self.sync()
+                os.fsync(checkpoint_fd)
+
+            finally:
+                os.close(checkpoint_fd)
+
+            self._truncate_if_replayed(offset)
+
+            return replayed
+
+        finally:
+            os.close(lock_fd)
+
+    @staticmethod
+    def _advance(offset, done):
+        """
+        Move the offset past the entries that have been replayed.
+        """
+
+        while offset in done:
+            offset = done.pop(offset)
+
+        return offset
+
+    def _truncate_if_replayed(self, offset):
+        """
+        Empty the spool and the checkpoint if every entry in the spool has been replayed (and no
+        entries were appended since).
+        """
+
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+            try:
+                if os.path.getsize(self.path) == offset:
+                    os.ftruncate(self._fd, 0)
+                    os.fsync(self._fd)
+                    os.remove(self.checkpoint_path)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+def replay_spool(alert_class, concurrency=4):
+    """
+    Replay the failed executions that the alert spooled (see ModularAlert.spool_failures()). Returns
+    the number of entries that were replayed.
+
+    Arguments:
+    alert_class -- The class of the alert (called without arguments to create instances)
+    concurrency -- The maximum number of entries that are replayed at once
+    """
+
+    alerts = [alert_class()]
+    idle_alerts = list(alerts)
+    alerts_lock = threading.Lock()
+
+    def handler(entry):
+        # Each alert instance is only used by one entry at a time (like the AlertWorker)
+        with alerts_lock:
+            if idle_alerts:
+                alert = idle_alerts.pop()
+            else:
+                alert = alert_class()
+                alerts.append(alert)
+
+        try:
+            return alert.replay(entry)
+        finally:
+            with alerts_lock:
+                idle_alerts.append(alert)
+
+    try:
+        return alerts[0].spool.replay(handler, concurrency)
+    finally:
+        for alert in alerts:
+            alert.shutdown()
@@ -0,0 +1,164 @@
+"""
+This module contains a cache of the alert configurations that were already validated.
+
+A saved search passes the same configuration to its alert action every time that it fires, so the
+cleaned parameters are remembered by a hash of the configuration along with a signature of the
+parameters that it is validated against (see get_validation_key()). Changing either the
+configuration or the parameters therefore results in the configuration being validated again.
+"""
+
+import collections
+import copy
+import hashlib
+import json
+import threading
+
+def get_signature(fields):
+    """
+    Get a string describing the fields (their types, names and settings such as the minimum value)
+    so that the cached configurations are invalidated when the parameters of an alert change.
+
+    Arguments:
+    fields -- A list of Field instances
+    """
+
+    return repr([(type(field).__module__, type(field).__name__, sorted(vars(field).items())) for field in fields])
+
+def get_validation_key(signature, configuration):
+    """
+    Get the key of a configuration in the cache.
+
+    Arguments:
+    signature -- A string describing the alert and its parameters (see get_signature())
+    configuration -- A dictionary of the arguments
+    """
+
+    digest = hashlib.sha256(signature.encode('utf-8'))
+    digest.update(b'\x00')
+    digest.update(json.dumps(configuration, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8'))
+
+    return digest.hexdigest()
+
+def copy_params(params):
+    """
+    Copy a dictionary of cleaned (or execution) parameters along with the values that can be
+    modified (lists, dictionaries and sets) so that changing the copy doesn't change the cached
+    values. The other values (strings, numbers, compiled regular expressions, etc.) are shared since
+    copying them all would cost more than validating many configurations.
+
+    Arguments:
+    params -- A dictionary of the parameters
+    """
+
+    return dict((name, copy.deepcopy(value) if isinstance(value, (list, dict, set)) else value) for name, value in params.items())
+
+def is_json_value(value):
+    """
+    Determine whether the value is unchanged by a round-trip through JSON.
+    """
+
+    if value is None or type(value) in (str, int, float, bool):
+        return True
+
+    return type(value) is list and all(is_json_value(item) for item in value)
+
+def encode_params(cleaned_params):
+    """
+    Convert cleaned parameters into a string for a persistent cache. The values that can't be
+    stored as JSON (e.g. compiled regular expressions) are only listed so that decode_params() can
+    re-convert them.
+
+    Arguments:
+    cleaned_params -- A dictionary of the cleaned parameters
+    """
+
+    values = {}
+    rebuild = []
+
+    for name, value in cleaned_params.items():
+        if is_json_value(value):
+            values[name] = value
+        else:
+            rebuild.append(name)
+
+    return json.dumps({'values' : values, 'rebuild' : rebuild}, separators=(',', ':'))
+
+def decode_params(data, arguments, converters):
+    """
+    Get the cleaned parameters from a string made by encode_params(). Returns None if a value needs
+    to be re-converted but the parameter doesn't have a converter.
+
+    Arguments:
+    data -- The string made by encode_params()
+    arguments -- A dictionary of the arguments that the parameters were cleaned from
+    converters -- A dictionary of the names of the parameters to the function that converts the argument (see ParameterSchema)
+    """
+
+    entry = json.loads(data)
+    cleaned_params = entry['values']
+
+    for name in entry['rebuild']:
+        if name not in converters or name not in arguments:
+            return None
+
+        cleaned_params[name] = converters[name](arguments[name])
+
+    return cleaned_params
+
+class ValidationCache(object):
+    """
+    An in-process cache of the least recently used configurations. Each entry is a tuple of the
+    cleaned parameters and the execution parameters (see ModularAlert.validate_configuration()).
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        Arguments:
+        max_entries -- The maximum number of configurations to remember
+        """
+
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the entry for the key (or None if the key isn't in the cache).
+
+        Arguments:
+        key -- The key (see get_validation_key())
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def set(self, key, entry):
+        """
+        Set the entry for the key, forgetting the least recently used entries beyond the maximum.
+
+        Arguments:
+        key -- The key (see get_validation_key())
+        entry -- The entry
+        """
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+# The configurations validated by this process (shared by all of the alerts since the key includes the alert's class)
+validated_configurations = ValidationCache()
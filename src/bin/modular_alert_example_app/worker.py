@@ -0,0 +1,436 @@
+"""
+This module allows a modular alert to be executed by a long-running worker process.
+
+Splunk starts a new process each time an alert fires, which means that the interpreter is started
+and the alert is set up again for every alert. A worker (see AlertWorker) keeps alert instances warm
+and listens on a Unix socket; the process started by Splunk can then forward the payload to the
+worker (see execute_alert()) instead of executing the alert itself. If the worker isn't running, the
+alert is executed in-process as usual.
+
+The events and log messages written by the alert while it executes a forwarded payload are sent back
+to the process that forwarded it, which writes them to its standard output and standard error (where
+Splunk expects them) just as if the alert had been executed in that process.
+"""
+
+import io
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+# The responses sent by the worker to indicate whether the alert executed successfully
+RESPONSE_SUCCESS = b'1'
+RESPONSE_FAILURE = b'0'
+
+# The kinds of output that the worker relays while the alert is executing; each is followed by the
+# length of the data (as a 4-byte big-endian integer) and the data itself (encoded as UTF-8)
+OUTPUT_STDOUT = b'O'
+OUTPUT_STDERR = b'E'
+OUTPUT_HEADER = struct.Struct('>I')
+
+# The number of bytes of the payload that are forwarded at a time
+CHUNK_SIZE = 65536
+
+# The number of seconds to wait for the worker by default; this matches the default "maxtime" of
+# alert actions (5m) so pass a different timeout if maxtime is changed in alert_actions.conf
+WORKER_TIMEOUT = 300
+
+# The number of payloads that a worker executes at once by default (the connections beyond this wait
+# to be accepted)
+MAX_CONCURRENCY = 8
+
+class WorkerUnavailableException(Exception):
+    """
+    Raised when the worker could not be contacted.
+    """
+    pass
+
+class WorkerAlreadyRunningException(Exception):
+    """
+    Raised when starting a worker on a socket that another worker is listening on.
+    """
+    pass
+
+def get_socket_path(name):
+    """
+    Get the path of the socket that the worker for the given alert listens on, or None if
+    SPLUNK_HOME isn't set. The socket is only placed under $SPLUNK_HOME/var/run/splunk since a shared
+    directory such as /tmp would let other users put their own socket in its place.
+
+    Arguments:
+    name -- The name of the alert (e.g. "make_a_log_message")
+    """
+
+    splunk_home = os.environ.get('SPLUNK_HOME')
+
+    if splunk_home:
+        return os.path.join(splunk_home, 'var', 'run', 'splunk', name + '.sock')
+    else:
+        return None
+
+def connect_to_worker(socket_path, timeout=WORKER_TIMEOUT):
+    """
+    Connect to the worker. A WorkerUnavailableException is raised if the worker could not be
+    connected to.
+
+    Arguments:
+    socket_path -- The path of the socket that the worker listens on
+    timeout -- The number of seconds to wait for the worker (or None to wait indefinitely)
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    try:
+        sock.connect(socket_path)
+    except socket.error as e:
+        sock.close()
+        raise WorkerUnavailableException("Unable to connect to the worker at %s: %s" % (socket_path, str(e)))
+
+    return sock
+
+def _send_stream(sock, in_stream):
+    try:
+        while True:
+            data = in_stream.read(CHUNK_SIZE)
+
+            if not data:
+                break
+
+            sock.sendall(data.encode('utf-8') if isinstance(data, str) else data)
+
+        sock.shutdown(socket.SHUT_WR)
+
+    # The worker stopped reading (send_payload() reports that it closed the connection without a response)
+    except (OSError, ValueError):
+        pass
+
+def send_payload(sock, in_stream, out_stream=None, err_stream=None):
+    """
+    Send the payload to the worker a chunk at a time and wait for the alert to be executed, writing
+    the events and log messages that the worker relays while the alert executes. Returns true if the
+    alert executed successfully. The socket is closed afterwards.
+
+    Arguments:
+    sock -- The socket connected to the worker (see connect_to_worker())
+    in_stream -- The stream to get the payload from
+    out_stream -- The stream to write the events to (defaults to standard output)
+    err_stream -- The stream to write the log messages to (defaults to standard error)
+    """
+
+    streams = {
+        OUTPUT_STDOUT : out_stream if out_stream is not None else sys.stdout,
+        OUTPUT_STDERR : err_stream if err_stream is not None else sys.stderr
+    }
+
+    # Send the payload on another thread so that the worker is never left blocked on relaying output
+    # while this process is blocked on sending the rest of the payload
+    sender = threading.Thread(target=_send_stream, args=(sock, in_stream))
+    sender.daemon = True
+    sender.start()
+
+    response = sock.makefile('rb')
+
+    try:
+        while True:
+            kind = response.read(1)
+
+            if kind in (RESPONSE_SUCCESS, RESPONSE_FAILURE):
+                return kind == RESPONSE_SUCCESS
+
+            header = response.read(OUTPUT_HEADER.size)
+
+            if kind not in streams or len(header) < OUTPUT_HEADER.size:
+                raise Exception("The worker closed the connection without a response")
+
+            stream = streams[kind]
+            stream.write(response.read(OUTPUT_HEADER.unpack(header)[0]).decode('utf-8'))
+            stream.flush()
+
+    finally:
+        response.close()
+
+        # Stop the sender if it is still blocked on sending the payload
+        if sender.is_alive():
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        sender.join()
+        sock.close()
+
+def forward_payload(socket_path, payload, timeout=WORKER_TIMEOUT, out_stream=None, err_stream=None):
+    """
+    Send the payload to the worker and wait for the alert to be executed. Returns true if the alert
+    executed successfully.
+
+    A WorkerUnavailableException is raised if the worker could not be connected to (in which case
+    the payload wasn't processed).
+
+    Arguments:
+    socket_path -- The path of the socket that the worker listens on
+    payload -- The payload from Splunk (as a string or a stream)
+    timeout -- The number of seconds to wait for the worker (or None to wait indefinitely)
+    out_stream -- The stream to write the events to (defaults to standard output)
+    err_stream -- The stream to write the log messages to (defaults to standard error)
+    """
+
+    sock = connect_to_worker(socket_path, timeout)
+
+    return send_payload(sock, io.StringIO(payload) if isinstance(payload, str) else payload, out_stream, err_stream)
+
+def execute_alert(alert_class, socket_path, in_stream=sys.stdin, timeout=WORKER_TIMEOUT, out_stream=None, err_stream=None):
+    """
+    Execute the alert using the worker if it is running or in this process otherwise. Returns true
+    if the alert executed successfully. Either way, the payload is streamed (to the worker or to
+    the alert's parser) rather than being read into memory first.
+
+    Arguments:
+    alert_class -- The class of the alert (called without arguments to create an instance if necessary)
+    socket_path -- The path of the socket that the worker listens on (or None to execute the alert in this process)
+    in_stream -- The stream to get the payload from (defaults to standard input)
+    timeout -- The number of seconds to wait for the worker (or None to wait indefinitely)
+    out_stream -- The stream to write the events relayed by the worker to (defaults to standard output)
+    err_stream -- The stream to write the log messages relayed by the worker to (defaults to standard error)
+    """
+
+    # Connect before reading any of the payload so that it can still be executed here if the worker isn't running
+    try:
+        sock = connect_to_worker(socket_path, timeout) if socket_path is not None else None
+    except WorkerUnavailableException:
+        sock = None
+
+    if sock is not None:
+        return send_payload(sock, in_stream, out_stream, err_stream)
+
+    alert = alert_class()
+
+    try:
+        return alert.execute(in_stream) is not False
+    finally:
+        alert.shutdown()
+
+def remove_stale_socket(socket_path):
+    """
+    Remove the socket left behind by a worker that wasn't shut down cleanly. A
+    WorkerAlreadyRunningException is raised if a worker is still listening on the socket.
+
+    Arguments:
+    socket_path -- The path of the socket that the worker listens on
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(socket_path)
+    except FileNotFoundError:
+        pass
+    except ConnectionRefusedError:
+        os.remove(socket_path)
+    else:
+        raise WorkerAlreadyRunningException("A worker is already listening on %s" % socket_path)
+    finally:
+        sock.close()
+
+class RelayStream(object):
+    """
+    A text stream whose writes are sent to the process that forwarded the payload (see
+    send_payload()). The streams of a connection share a lock since the alert may write from many
+    threads at once (e.g. when using an executor).
+    """
+
+    def __init__(self, wfile, kind, lock):
+        """
+        Arguments:
+        wfile -- The file to write to (the socket connected to the process that forwarded the payload)
+        kind -- The kind of output (OUTPUT_STDOUT or OUTPUT_STDERR)
+        lock -- The lock that serializes the writes to the socket
+        """
+
+        self.wfile = wfile
+        self.kind = kind
+        self.lock = lock
+
+    def write(self, data):
+        if not data:
+            return
+
+        data = data.encode('utf-8')
+
+        with self.lock:
+            self.wfile.write(self.kind + OUTPUT_HEADER.pack(len(data)) + data)
+
+    def flush(self):
+        pass
+
+class AlertRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Executes the alert for a payload that was forwarded to the worker.
+    """
+
+    # Don't let a sender that stops sending tie up a thread forever
+    timeout = WORKER_TIMEOUT
+
+    def handle(self):
+        # Ignore connections that are closed without a payload (e.g. a worker checking whether this one is running)
+        if not self.rfile.peek(1):
+            return
+
+        # Parse the payload as it arrives rather than reading all of it first
+        payload_stream = io.TextIOWrapper(self.rfile, encoding='utf-8')
+
+        # Send the output of the alert back to the process that forwarded the payload
+        lock = threading.Lock()
+        out_stream = RelayStream(self.wfile, OUTPUT_STDOUT, lock)
+        err_stream = RelayStream(self.wfile, OUTPUT_STDERR, lock)
+
+        try:
+            result = self.server.execute(payload_stream, out_stream, err_stream)
+        finally:
+            payload_stream.detach()
+
+        # Read the rest of the payload (if the alert stopped early) so that the sender isn't left blocked
+        while self.rfile.read(CHUNK_SIZE):
+            pass
+
+        with lock:
+            if result:
+                self.wfile.write(RESPONSE_SUCCESS)
+            else:
+                self.wfile.write(RESPONSE_FAILURE)
+
+class AlertWorker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A server that executes forwarded payloads using warm alert instances. Each request is handled on
+    its own thread, with at most max_concurrency requests at once (the other connections wait to be
+    accepted). Alert instances are re-used between requests but an instance is only used by one
+    request at a time (since an alert instance holds the state of the execution in progress).
+
+    Each alert instance gets a logger of its own (unless it logs to a file) so that its log messages
+    can be relayed to the process that forwarded the payload it is executing.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, alert_class, socket_path, max_concurrency=MAX_CONCURRENCY):
+        """
+        Set up the worker and start listening on the socket.
+
+        Arguments:
+        alert_class -- The class of the alert (called without arguments to create an instance)
+        socket_path -- The path of the socket to listen on
+        max_concurrency -- The maximum number of payloads to execute at once
+        """
+
+        self.alert_class = alert_class
+        self.socket_path = socket_path
+
+        self._alerts = []
+        self._idle_alerts = []
+        self._log_handlers = {}
+        self._alerts_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        remove_stale_socket(socket_path)
+
+        # Only allow the user that is running the worker to connect to it (the socket is created
+        # with these permissions so that there isn't a window in which others can connect)
+        old_umask = os.umask(0o177)
+
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path, AlertRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def process_request(self, request, client_address):
+        # Wait for a slot before starting the thread so that neither the threads nor the alert instances grow without bound
+        self._slots.acquire()
+
+        try:
+            socketserver.ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            self._slots.release()
+
+    def make_alert(self):
+        """
+        Make an alert instance. Unless the alert logs to a file, it is given a logger of its own whose
+        handler can be pointed at the process that forwarded the payload (see execute()).
+        """
+
+        alert = self.alert_class()
+
+        if not alert.log_to_file:
+            logger = logging.getLogger('%s.worker%i' % (alert.logger_name, len(self._alerts)))
+            logger.propagate = False
+            logger.setLevel(alert.log_level)
+
+            handler = alert.make_log_handler()
+            logger.addHandler(handler)
+
+            alert.logger = logger
+            self._log_handlers[id(alert)] = handler
+
+        return alert
+
+    def execute(self, payload, out_stream=None, err_stream=None):
+        """
+        Execute the alert for the given payload using an idle alert instance (a new instance is
+        created if all of them are busy). Returns true if the alert executed successfully.
+
+        Arguments:
+        payload -- The payload from Splunk (as a string or a stream)
+        out_stream -- The stream to write the events to (defaults to the worker's standard output)
+        err_stream -- The stream to write the log messages to (defaults to the worker's standard error)
+        """
+
+        in_stream = io.StringIO(payload) if isinstance(payload, str) else payload
+
+        with self._alerts_lock:
+            if self._idle_alerts:
+                alert = self._idle_alerts.pop()
+            else:
+                alert = self.make_alert()
+                self._alerts.append(alert)
+
+        log_handler = self._log_handlers.get(id(alert))
+        alert.output_stream = out_stream
+
+        if log_handler is not None and err_stream is not None:
+            log_handler.setStream(err_stream)
+
+        # Only an explicit False is a failure (execute() returns None for alerts whose run() returns nothing)
+        try:
+            return alert.execute(in_stream) is not False
+        finally:
+            alert.output_stream = None
+
+            if log_handler is not None:
+                log_handler.setStream(sys.stderr)
+
+            with self._alerts_lock:
+                self._idle_alerts.append(alert)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+
+        with self._alerts_lock:
+            for alert in self._alerts:
+                alert.shutdown()
+
+            self._alerts = []
+            self._idle_alerts = []
+            self._log_handlers = {}
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
@@ -0,0 +1,794 @@
+"""
+Benchmarks for the modular alert library.
+
+Run this from the tests directory (like the unit tests):
+
+    python benchmark.py                 # Run all of the benchmarks
+    python benchmark.py iter_results    # Run only the named benchmarks
+"""
+
+import csv
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+import json
+import tracemalloc
+import io
+import re
+import multiprocessing
+import threading
+
+sys.path.append( os.path.join("..", "src", "bin") )
+sys.path.append( os.path.join("..", "src", "bin", "modular_alert_example_app") )
+
+from modular_alert_example_app.modular_alert import ModularAlert, Field, IntegerField, BooleanField, FieldValidationException
+from modular_alert_example_app.modular_alert import FloatField, DurationField, IPAddressField
+from modular_alert_example_app.payload import read_payload
+from modular_alert_example_app.results import iter_results_file, ResultSet
+from modular_alert_example_app.spool import Spool
+from modular_alert_example_app.filters import RowFilter
+from modular_alert_example_app.results_index import iter_indexed_results
+from modular_alert_example_app.composite import CompositeAlert
+from modular_alert_example_app.rate_limit import RateLimiter
+from modular_alert_example_app.rest import SplunkdClient
+from modular_alert_example_app.lookup_index import open_lookup_index
+
+RESULT_COUNTS = [10000, 100000, 1000000]
+
+def write_synthetic_results(path, row_count):
+    """
+    Write a gzipped CSV results file with the given number of rows.
+    """
+    with gzip.open(path, 'wt', newline='') as results_fp:
+        writer = csv.writer(results_fp)
+        writer.writerow(['_time', 'host', 'source', 'sourcetype', 'importance', '_raw'])
+
+        for i in range(row_count):
+            writer.writerow([1500000000 + i, 'host%i' % (i % 50), '/var/log/app%i.log' % (i % 7), 'app_log', i % 4, 'Something happened, event_id=%i status=ok' % i])
+
+def report(name, row_count, duration):
+    print("%-30s rows=%-10i time=%8.3fs rows/s=%12.0f" % (name, row_count, duration, row_count / duration))
+
+def benchmark_iter_results(tmp_dir):
+    """
+    Measure the throughput of streaming the results file.
+    """
+    alert = ModularAlert()
+
+    for row_count in RESULT_COUNTS:
+        results_file = os.path.join(tmp_dir, 'results_%i.csv.gz' % row_count)
+        write_synthetic_results(results_file, row_count)
+
+        start = time.time()
+
+        for _ in alert.iter_results({'results_file' : results_file}):
+            pass
+
+        report('iter_results', row_count, time.time() - start)
+
+def validate_nested_loop(parameters, arguments):
+    """
+    The original implementation of ModularAlert.validate() which searches the list of parameters for each argument.
+    """
+    cleaned_params = {}
+
+    for name, value in arguments.items():
+        arg_recognized = False
+
+        for parameter in parameters:
+            if parameter.name == name:
+                cleaned_params[name] = parameter.to_python(value)
+                arg_recognized = True
+
+        if not arg_recognized:
+            raise FieldValidationException("The argument '%s' is not valid" % (name))
+
+    return cleaned_params
+
+def benchmark_validate(tmp_dir):
+    """
+    Measure validation of an alert with many parameters.
+    """
+    field_types = [Field, IntegerField, BooleanField]
+    parameters = [field_types[i % 3]("param%i" % i) for i in range(150)]
+    values = ['a message', '42', 'true']
+    configuration = dict(("param%i" % i, values[i % 3]) for i in range(150))
+
+    alert = ModularAlert(parameters)
+    iterations = 2000
+
+    start = time.time()
+    for _ in range(iterations):
+        validate_nested_loop(parameters, configuration)
+    report('validate (nested loop)', iterations, time.time() - start)
+
+    start = time.time()
+    for _ in range(iterations):
+        alert.validate(configuration)
+    report('validate (schema)', iterations, time.time() - start)
+
+    start = time.time()
+    for _ in alert.schema.validate_many(configuration for _ in range(iterations)):
+        pass
+    report('validate_many (schema)', iterations, time.time() - start)
+
+def benchmark_validation_cache(tmp_dir):
+    """
+    Measure validating a typical configuration without memoization, from the in-process cache and
+    from the persistent cache (as a new process would).
+    """
+    from modular_alert_example_app.modular_alert import RegexField, URLField
+    from modular_alert_example_app.validation_cache import validated_configurations
+
+    parameters = [Field("message"), IntegerField("importance"), RegexField("pattern"), URLField("url"), DurationField("window")]
+    configuration = {'message' : 'a message', 'importance' : '3', 'pattern' : r'(?P<user>[a-z0-9._-]+)@(?P<domain>[a-z0-9.-]+\.[a-z]{2,})',
+                     'url' : 'https://tickets.example.com:8443/api/v2/issues', 'window' : '15m', 'batch_size' : '100', 'dedup_ttl' : '1d'}
+
+    alert = ModularAlert(parameters)
+    alert.state_dir = tmp_dir
+    iterations = 20000
+
+    alert.memoize_validation = False
+    start = time.time()
+    for _ in range(iterations):
+        # Clear the regular expression module's own cache like a new process would have
+        re.purge()
+        alert.validate_configuration(configuration)
+    report('validate (not memoized)', iterations, time.time() - start)
+
+    alert.memoize_validation = True
+    start = time.time()
+    for _ in range(iterations):
+        alert.validate_configuration(configuration)
+    report('validate (in-process cache)', iterations, time.time() - start)
+
+    persistent_configuration = dict(configuration, validation_cache='1')
+    alert.validate_configuration(persistent_configuration)
+
+    start = time.time()
+    for _ in range(iterations // 10):
+        re.purge()
+        validated_configurations.clear()
+        alert.validate_configuration(persistent_configuration)
+    report('validate (persistent cache)', iterations // 10, time.time() - start)
+
+    alert.shutdown()
+
+class NullStream(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+def benchmark_output_events(tmp_dir):
+    """
+    Measure writing events one at a time with output_event() versus in bulk with output_events() (as
+    key-value pairs and as JSON lines).
+    """
+    alert = ModularAlert()
+    events = [{'host' : 'host%i' % (i % 50), 'message' : 'Something "happened" here', 'count' : i, 'tags' : ['a', 'b c']} for i in range(100000)]
+    out = NullStream()
+
+    start = time.time()
+    for event in events:
+        alert.output_event(event, 'stanza', out=out)
+    report('output_event', len(events), time.time() - start)
+
+    start = time.time()
+    alert.output_events(events, 'stanza', out=out)
+    report('output_events', len(events), time.time() - start)
+
+    # Write the events as JSON lines with each of the JSON libraries that is installed
+    from modular_alert_example_app.events import EventWriter, JSONEventEncoder, JSON_BACKENDS
+
+    for backend in JSON_BACKENDS:
+        try:
+            encoder = JSONEventEncoder(index='main', sourcetype='alert:json', host='benchmark', backend=backend)
+        except ValueError:
+            continue
+
+        start = time.time()
+        with EventWriter(out, encoder=encoder) as writer:
+            for event in events:
+                writer.write(event)
+        report('output_events (json, %s)' % backend, len(events), time.time() - start)
+
+BIN_DIRECTORY = os.path.abspath(os.path.join("..", "src", "bin"))
+
+FIRST_EXECUTE_SCRIPT = '''
+import time
+start = time.time()
+from io import StringIO
+from modular_alert_example_app.modular_alert import ModularAlert, Field
+
+class Alert(ModularAlert):
+    def run(self, cleaned_params, payload):
+        return True
+
+Alert([Field("message")]).execute(StringIO('{"configuration" : {"message" : "hi"}, "result" : {"source" : "a"}}'))
+print(time.time() - start)
+'''
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+def benchmark_startup(tmp_dir):
+    """
+    Measure the time taken to import the modular alert module (as reported by "python -X importtime")
+    and the time taken from the start of the interpreter to the end of the first call to execute().
+    """
+    runs = 5
+    module_name = 'modular_alert_example_app.modular_alert'
+    import_times = []
+
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name], cwd=BIN_DIRECTORY, stderr=subprocess.PIPE, universal_newlines=True).stderr
+
+        # Each line looks like "import time:  self [us] | cumulative | imported package"
+        imports = {}
+
+        for line in output.splitlines():
+            if line.startswith('import time:') and not line.endswith('imported package'):
+                self_us, cumulative_us, name = line[len('import time:'):].split('|')
+                imports[name.strip()] = (int(self_us), int(cumulative_us))
+
+        import_times.append((imports[module_name][1], imports))
+
+    # Report the slowest imports from the run with the median import time
+    module_time, imports = sorted(import_times, key=lambda import_time: import_time[0])[runs // 2]
+    print("%-30s time=%8.1fms" % ('import ' + module_name.split('.')[-1], module_time / 1000.0))
+
+    for name, (self_us, cumulative_us) in sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:10]:
+        print("    %-40s self=%8.1fms cumulative=%8.1fms" % (name, self_us / 1000.0, cumulative_us / 1000.0))
+
+    # Measure the time to the first execute() call (both within the interpreter and for the entire process)
+    in_process = []
+    process = []
+
+    for _ in range(runs):
+        start = time.time()
+        output = subprocess.run([sys.executable, '-c', FIRST_EXECUTE_SCRIPT], cwd=BIN_DIRECTORY, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        process.append(time.time() - start)
+        in_process.append(float(output))
+
+    print("%-30s time=%8.1fms" % ('import and first execute()', median(in_process) * 1000))
+    print("%-30s time=%8.1fms" % ('process with first execute()', median(process) * 1000))
+
+def benchmark_to_python_many(tmp_dir):
+    """
+    Measure converting columns of values with to_python_many() versus calling to_python() for each value.
+    """
+    count = 1000000
+    columns = [
+        (IntegerField("count"), [str(i) for i in range(count)]),
+        (FloatField("ratio"), [str(i / 4.0) for i in range(count)]),
+        (BooleanField("enabled"), ['true', '0', 'False', '1'] * (count // 4)),
+        (DurationField("period"), ['%im' % (i % 60) for i in range(count)]),
+        (IPAddressField("ip"), ['10.0.%i.%i' % (i % 8, i % 250) for i in range(count)]),
+    ]
+
+    for field, values in columns:
+        name = field.__class__.__name__
+
+        start = time.time()
+        for value in values:
+            try:
+                field.to_python(value)
+            except FieldValidationException:
+                pass
+        report(name + '.to_python', count, time.time() - start)
+
+        start = time.time()
+        field.to_python_many(values)
+        report(name + '.to_python_many', count, time.time() - start)
+
+class FileLoggingAlert(ModularAlert):
+    """
+    A modular alert that logs to a file in the given directory.
+    """
+
+    def __init__(self, log_dir, **kwargs):
+        self.log_dir = log_dir
+        super(FileLoggingAlert, self).__init__(**kwargs)
+
+    def make_log_handler(self):
+        from logging import handlers
+
+        handler = handlers.RotatingFileHandler(os.path.join(self.log_dir, self.logger_name + '.log'), maxBytes=25000000, backupCount=5)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+
+        return handler
+
+def benchmark_logging(tmp_dir):
+    """
+    Measure the per-row overhead of logging synchronously versus through the queue (the time taken to
+    drain the queue on shutdown() is reported separately).
+    """
+    count = 100000
+
+    for log_async in [False, True]:
+        alert = FileLoggingAlert(tmp_dir, logger_name='benchmark_logging_%s' % log_async, log_async=log_async)
+        logger = alert.logger
+
+        start = time.time()
+        for i in range(count):
+            logger.info("Processed result, source=%s, count=%i", '/var/log/app.log', i)
+        report('logging (log_async=%s)' % log_async, count, time.time() - start)
+
+        start = time.time()
+        alert.shutdown()
+        print("%-30s time=%8.3fs" % ('shutdown (log_async=%s)' % log_async, time.time() - start))
+
+def measure_peak_memory(function):
+    """
+    Call the function and return the time it took along with the peak memory allocated while it ran
+    (the function is called twice since tracing the allocations slows it down).
+    """
+    start = time.time()
+    function()
+    duration = time.time() - start
+
+    tracemalloc.start()
+
+    try:
+        function()
+        return duration, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmark_payload(tmp_dir):
+    """
+    Compare the time and peak memory of parsing large payloads all at once and incrementally.
+    """
+    for field_count in [10000, 100000]:
+        payload = {
+            'configuration' : {'message' : 'test', 'importance' : '1'},
+            'results_file' : None,
+            'session_key' : 'abc123',
+            'result' : dict(('field%i' % i, 'value %i' % i) for i in range(field_count))
+        }
+
+        payload_file = os.path.join(tmp_dir, 'payload_%i.json' % field_count)
+
+        with open(payload_file, 'w') as payload_fp:
+            json.dump(payload, payload_fp)
+
+        size = os.path.getsize(payload_file)
+
+        def parse_all():
+            with open(payload_file) as payload_fp:
+                json.loads(payload_fp.read())['configuration']
+
+        def parse_incrementally():
+            with open(payload_file) as payload_fp:
+                read_payload(payload_fp)['configuration']
+
+        def parse_incrementally_with_result():
+            with open(payload_file) as payload_fp:
+                read_payload(payload_fp)['result']
+
+        for name, function in [('json.loads', parse_all), ('read_payload', parse_incrementally), ('read_payload+result', parse_incrementally_with_result)]:
+            duration, peak = measure_peak_memory(function)
+            print("%-30s size=%7.2fMB time=%8.3fs peak=%7.2fMB" % ('payload (%s)' % name, size / 1048576.0, duration, peak / 1048576.0))
+
+def benchmark_result_set(tmp_dir):
+    """
+    Compare the time and peak memory of loading the results into a list of dictionaries and into a ResultSet.
+    """
+    for row_count in RESULT_COUNTS[:2]:
+        results_file = os.path.join(tmp_dir, 'results_set_%i.csv.gz' % row_count)
+        write_synthetic_results(results_file, row_count)
+
+        def load_dicts():
+            rows = list(iter_results_file(results_file))
+            return sum(1 for row in rows if row.get('source'))
+
+        def load_result_set():
+            rows = ResultSet.from_results_file(results_file)
+            return sum(1 for row in rows if row.get('source'))
+
+        for name, function in [('dicts', load_dicts), ('ResultSet', load_result_set)]:
+            duration, peak = measure_peak_memory(function)
+            print("%-30s rows=%-10i time=%8.3fs peak=%7.2fMB" % ('result_set (%s)' % name, row_count, duration, peak / 1048576.0))
+
+def benchmark_spool(tmp_dir):
+    """
+    Measure the throughput of appending entries to the spool and replaying them.
+    """
+    count = 100000
+    spool = Spool(os.path.join(tmp_dir, 'benchmark.spool'))
+
+    try:
+        start = time.time()
+        for i in range(count):
+            spool.append({'attempts' : 0, 'rows' : [{'source' : '/var/log/app.log', 'count' : i}]})
+        spool.sync()
+        report('spool append', count, time.time() - start)
+
+        start = time.time()
+        spool.replay(lambda entry: None, concurrency=8)
+        report('spool replay', count, time.time() - start)
+    finally:
+        spool.close()
+
+def benchmark_row_filter(tmp_dir):
+    """
+    Compare filtering the results in Python with the row filter (with and without the sidecar index).
+    """
+    row_filter = RowFilter().add(IntegerField("importance"), '>=', 3).add(Field("host"), '==', 'host7')
+
+    for row_count in RESULT_COUNTS:
+        results_file = os.path.join(tmp_dir, 'results_filter_%i.csv.gz' % row_count)
+        write_synthetic_results(results_file, row_count)
+
+        start = time.time()
+        matched = sum(1 for row in iter_results_file(results_file) if row_filter.matches(row))
+        report('row_filter (in run())', row_count, time.time() - start)
+
+        start = time.time()
+        assert sum(1 for row in iter_results_file(results_file, row_filter)) == matched
+        report('row_filter (pushdown)', row_count, time.time() - start)
+
+        start = time.time()
+        assert sum(1 for row in iter_indexed_results(results_file, row_filter)) == matched
+        report('row_filter (index build)', row_count, time.time() - start)
+
+        start = time.time()
+        assert sum(1 for row in iter_indexed_results(results_file, row_filter)) == matched
+        report('row_filter (index)', row_count, time.time() - start)
+
+class CountingAlert(ModularAlert):
+    """
+    A batched alert that just counts the results.
+    """
+    def __init__(self, **kwargs):
+        super(CountingAlert, self).__init__([Field("message")], logger_name='benchmark_counting', log_level=logging.CRITICAL, **kwargs)
+        self.count = 0
+
+    def run_batch(self, cleaned_params, rows):
+        self.count += len(rows)
+
+def benchmark_composite(tmp_dir):
+    """
+    Compare executing several alerts separately against the same payload with a CompositeAlert.
+    """
+    row_count = RESULT_COUNTS[1]
+    results_file = os.path.join(tmp_dir, 'results_composite.csv.gz')
+    write_synthetic_results(results_file, row_count)
+
+    payload = json.dumps({'configuration' : {'message' : 'hi', 'batch_size' : '1000'}, 'results_file' : results_file, 'result' : {'source' : 'a'}})
+
+    for action_count in [1, 3]:
+        start = time.time()
+        for _ in range(action_count):
+            CountingAlert().execute(io.StringIO(payload))
+        report('composite (%i separate)' % action_count, row_count * action_count, time.time() - start)
+
+        actions = [(CountingAlert(), {'message' : 'hi', 'batch_size' : '1000'}) for _ in range(action_count)]
+
+        start = time.time()
+        CompositeAlert(actions, log_level=logging.CRITICAL).execute(io.StringIO(payload))
+        report('composite (%i combined)' % action_count, row_count * action_count, time.time() - start)
+
+def take_tokens(path, duration):
+    limiter = RateLimiter(path)
+    taken = 0
+
+    try:
+        start = time.time()
+        while time.time() - start < duration:
+            if limiter.acquire('benchmark', 1000.0, 10, block=False):
+                taken += 1
+        return taken, start, time.time()
+    finally:
+        limiter.close()
+
+def benchmark_rate_limit(tmp_dir):
+    """
+    Measure the cost of taking a token and the accuracy of the limit with many processes contending for it.
+    """
+    count = 100000
+    limiter = RateLimiter(os.path.join(tmp_dir, 'rate_limits'))
+
+    try:
+        start = time.time()
+        for i in range(count):
+            limiter.acquire('benchmark', 1e9, count, block=False)
+        report('rate_limit acquire', count, time.time() - start)
+    finally:
+        limiter.close()
+
+    for process_count in [2, 8]:
+        path = os.path.join(tmp_dir, 'rate_limits_%i' % process_count)
+
+        with multiprocessing.Pool(process_count) as pool:
+            results = pool.starmap(take_tokens, [(path, 1.0)] * process_count)
+
+        taken = sum(result[0] for result in results)
+        duration = max(result[2] for result in results) - min(result[1] for result in results)
+
+        print("%-30s processes=%-5i taken=%-8i limit=%.0f" % ('rate_limit contention', process_count, taken, 10 + 1000.0 * duration))
+
+def sort_results(results_file, memory_budget):
+    """
+    Sort the results by host in a new process using a list (if memory_budget is None) or a row buffer.
+    """
+    from modular_alert_example_app.modular_alert import get_peak_rss
+
+    sort_key = lambda row: row['host']
+    start = time.time()
+
+    if memory_budget is None:
+        rows = list(iter_results_file(results_file))
+        rows.sort(key=sort_key)
+        spilled_count = 0
+    else:
+        alert = ModularAlert()
+        alert.execution_params['memory_budget'] = memory_budget
+        rows = alert.make_row_buffer(sort_key)
+        rows.extend(iter_results_file(results_file))
+        spilled_count = rows.spilled_count
+
+    for row in rows:
+        pass
+
+    return time.time() - start, get_peak_rss(), spilled_count
+
+def benchmark_row_buffer(tmp_dir):
+    """
+    Compare sorting the results in a list with sorting them in a row buffer with a memory budget.
+    """
+    # Each sort runs in a new process so that the peak RSS is its own
+    context = multiprocessing.get_context('spawn')
+
+    for row_count in RESULT_COUNTS[1:]:
+        results_file = os.path.join(tmp_dir, 'results_buffer_%i.csv.gz' % row_count)
+        write_synthetic_results(results_file, row_count)
+
+        for memory_budget in [None, 64, 16]:
+            with context.Pool(1) as pool:
+                duration, peak_rss, spilled_count = pool.apply(sort_results, (results_file, memory_budget))
+
+            name = 'row_buffer (list)' if memory_budget is None else 'row_buffer (%iMB budget)' % memory_budget
+            report(name, row_count, duration)
+            print("%-30s peak_rss=%iMB spilled=%i" % ('', peak_rss // 1024, spilled_count))
+
+class PrefetchAlert(ModularAlert):
+    """
+    A batched alert that either waits (like an alert sending requests) or does some work for each chunk of results.
+    """
+    def __init__(self, wait=0.0, work=False, **kwargs):
+        super(PrefetchAlert, self).__init__([Field("message")], logger_name='benchmark_prefetch', log_level=logging.CRITICAL, **kwargs)
+        self.wait = wait
+        self.work = work
+
+    def run_batch(self, cleaned_params, rows):
+        if self.wait:
+            time.sleep(self.wait)
+
+        if self.work:
+            for row in rows:
+                sum(len(value) for value in row.values())
+
+def benchmark_prefetch(tmp_dir):
+    """
+    Compare reading the results on the alert's thread with reading them ahead on a thread or a process.
+    """
+    row_count = RESULT_COUNTS[-1] * 2
+    results_file = os.path.join(tmp_dir, 'results_prefetch.csv.gz')
+    write_synthetic_results(results_file, row_count)
+
+    with gzip.open(results_file, 'rb') as results_fp:
+        size = sum(len(data) for data in iter(lambda: results_fp.read(1048576), b''))
+
+    # Reading the results on a process only helps when there is a spare CPU for it
+    print("%-30s size=%iMB (uncompressed) cpus=%i" % ('prefetch', size // 1048576, multiprocessing.cpu_count()))
+
+    for name, kwargs in [('reading only', {}), ('waiting 2ms per batch', {'wait' : 0.002}), ('working', {'work' : True})]:
+        for prefetch in ['', 'thread', 'process']:
+            configuration = {'message' : 'hi', 'batch_size' : '1000', 'prefetch' : prefetch}
+            payload = json.dumps({'configuration' : configuration, 'results_file' : results_file, 'result' : {'source' : 'a'}})
+
+            start = time.time()
+            PrefetchAlert(**kwargs).execute(io.StringIO(payload))
+            report('prefetch (%s, %s)' % (name, prefetch or 'none'), row_count, time.time() - start)
+
+class ActionAlert(ModularAlert):
+    """
+    An alert whose action takes a fixed amount of time (like a request to another system).
+    """
+    def __init__(self, **kwargs):
+        super(ActionAlert, self).__init__([], logger_name='benchmark_grouping', log_level=logging.CRITICAL, **kwargs)
+        self.actions = 0
+
+    def run(self, cleaned_params, payload):
+        self.actions += 1
+        time.sleep(0.0001)
+
+def benchmark_grouping(tmp_dir):
+    """
+    Compare running the alert for each of the results with running it once for each host.
+    """
+    row_count = RESULT_COUNTS[1]
+    results_file = os.path.join(tmp_dir, 'results_grouping.csv.gz')
+    write_synthetic_results(results_file, row_count)
+
+    for name, configuration in [('per result', {'batch_size' : '1000'}), ('group_by host', {'group_by' : 'host', 'group_distinct' : 'source'})]:
+        alert = ActionAlert()
+        payload = json.dumps({'configuration' : configuration, 'results_file' : results_file, 'result' : {'source' : 'a'}})
+
+        start = time.time()
+        alert.execute(io.StringIO(payload))
+
+        report('grouping (%s)' % name, row_count, time.time() - start)
+        print("%-30s actions=%i" % ('', alert.actions))
+
+def start_splunkd_stand_in(delay):
+    """
+    Start a local HTTP server that answers KV store look-ups after the given delay (like splunkd).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        # Send the headers and the body without waiting for an acknowledgement in between (as splunkd does)
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(delay)
+            body = json.dumps([{'ip' : self.path, 'owner' : 'alice'}]).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+def benchmark_rest(tmp_dir):
+    """
+    Compare looking up an entry for each result over a new connection with the pooled and caching REST client.
+    """
+    import http.client
+
+    row_count = 2000
+    ips = ['10.0.%i.%i' % (i % 200 // 100, i % 100) for i in range(row_count)]
+    path = '/servicesNS/nobody/search/storage/collections/data/assets'
+
+    server = start_splunkd_stand_in(0.001)
+    server_uri = 'http://127.0.0.1:%i' % server.server_address[1]
+
+    try:
+        start = time.time()
+
+        for ip in ips:
+            connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+            connection.request('GET', SplunkdClient.make_url(path, {'query' : json.dumps({'ip' : ip})}), headers={'Authorization' : 'Splunk key'})
+            json.loads(connection.getresponse().read())
+            connection.close()
+
+        report('rest (connection per result)', row_count, time.time() - start)
+
+        client = SplunkdClient(server_uri, 'key', cache_ttl=0)
+        start = time.time()
+
+        for ip in ips:
+            client.get(path, {'query' : json.dumps({'ip' : ip})})
+
+        report('rest (pooled)', row_count, time.time() - start)
+        client.close()
+
+        client = SplunkdClient(server_uri, 'key')
+        start = time.time()
+
+        for offset in range(0, row_count, 500):
+            client.batch_get([(path, {'query' : json.dumps({'ip' : ip})}) for ip in ips[offset:offset + 500]])
+
+        report('rest (batch_get, cached)', row_count, time.time() - start)
+        client.close()
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def enrich_results(lookup_file, index_path, keys):
+    """
+    Enrich the results against the lookup in a new process by loading it into a dictionary (if
+    index_path is None) or by using its index.
+    """
+    from modular_alert_example_app.modular_alert import get_peak_rss
+
+    rows = [{'src' : key} for key in keys]
+    start = time.time()
+
+    if index_path is None:
+        with open(lookup_file, newline='') as lookup_fp:
+            lookup = dict((row['ip'], row) for row in csv.DictReader(lookup_fp))
+
+        enriched = [dict(row, owner=lookup[row['src']]['owner']) if row['src'] in lookup else row for row in rows]
+    else:
+        index = open_lookup_index(lookup_file, 'ip', index_path)
+        enriched = index.enrich(rows, 'src', ['owner'])
+        index.close()
+
+    return time.time() - start, get_peak_rss(), sum(1 for row in enriched if 'owner' in row)
+
+def benchmark_lookup(tmp_dir):
+    """
+    Compare enriching results by loading a large lookup into a dictionary with using its memory-mapped index.
+    """
+    lookup_size = RESULT_COUNTS[-1] * 2
+    lookup_file = os.path.join(tmp_dir, 'assets.csv')
+    index_path = os.path.join(tmp_dir, 'assets.idx')
+
+    with open(lookup_file, 'w', newline='') as lookup_fp:
+        writer = csv.writer(lookup_fp)
+        writer.writerow(['ip', 'owner', 'location', 'category'])
+
+        for i in range(lookup_size):
+            writer.writerow(['10.%i.%i.%i' % (i >> 16, (i >> 8) & 255, i & 255), 'owner%i' % (i % 5000), 'dc%i' % (i % 7), 'server'])
+
+    keys = ['10.%i.%i.%i' % (i >> 16, (i >> 8) & 255, i & 255) for i in range(0, lookup_size * 2, 20)]
+
+    start = time.time()
+    open_lookup_index(lookup_file, 'ip', index_path).close()
+    report('lookup (build index)', lookup_size, time.time() - start)
+
+    # Each enrichment runs in a new process so that the peak RSS is its own
+    context = multiprocessing.get_context('spawn')
+
+    for name, path in [('dict', None), ('index', index_path)]:
+        with context.Pool(1) as pool:
+            duration, peak_rss, matched = pool.apply(enrich_results, (lookup_file, path, keys))
+
+        report('lookup (%s)' % name, len(keys), duration)
+        print("%-30s peak_rss=%iMB matched=%i" % ('', peak_rss // 1024, matched))
+
+BENCHMARKS = {
+    'composite' : benchmark_composite,
+    'iter_results' : benchmark_iter_results,
+    'logging' : benchmark_logging,
+    'output_events' : benchmark_output_events,
+    'payload' : benchmark_payload,
+    'prefetch' : benchmark_prefetch,
+    'grouping' : benchmark_grouping,
+    'rest' : benchmark_rest,
+    'lookup' : benchmark_lookup,
+    'rate_limit' : benchmark_rate_limit,
+    'result_set' : benchmark_result_set,
+    'row_buffer' : benchmark_row_buffer,
+    'row_filter' : benchmark_row_filter,
+    'spool' : benchmark_spool,
+    'startup' : benchmark_startup,
+    'to_python_many' : benchmark_to_python_many,
+    'validate' : benchmark_validate,
+    'validation_cache' : benchmark_validation_cache,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    tmp_dir = tempfile.mkdtemp(prefix="modular_alert_benchmark")
+
+    try:
+        for name in names:
+            BENCHMARKS[name](tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
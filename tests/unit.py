@@ -4,11 +4,62 @@ import errno
 import sys
 import os
 import re
+import logging
+import csv
+import gzip
+import shutil
+import tempfile
+import json
+import asyncio
+import threading
+import time
+import multiprocessing
+import pickle
+import tracemalloc
+import socket
+import stat
+
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 
 sys.path.append( os.path.join("..", "src", "bin") )
 sys.path.append( os.path.join("..", "src", "bin", "modular_alert_example_app") )
 
-from modular_alert_example_app.modular_alert import ModularAlert, URLField
+from modular_alert_example_app.modular_alert import ModularAlert, AsyncModularAlert, URLField, Field, IntegerField, BooleanField
+from modular_alert_example_app.modular_alert import ParameterSchema, FieldValidationException, FieldValidationErrors, PhaseTimer
+from modular_alert_example_app.modular_alert import FloatField, DurationField, IPAddressField, PortField, ListField, RegexField
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from modular_alert_example_app.results import iter_results_file, ResultSet, share_values
+from modular_alert_example_app.events import EventWriter, JSONEventEncoder, JSON_BACKENDS, make_json_dumps
+from modular_alert_example_app.payload import read_payload, Payload
+from modular_alert_example_app.cache import PersistentCache
+from modular_alert_example_app.validation_cache import ValidationCache, validated_configurations, get_validation_key, get_signature
+from modular_alert_example_app.filters import RowFilter
+from modular_alert_example_app.results_index import iter_indexed_results, get_index_path, ResultsIndex
+from modular_alert_example_app.composite import CompositeAlert, ResultsQueue, read_alert_action_params
+from modular_alert_example_app.row_buffer import RowBuffer
+from modular_alert_example_app.prefetch import iter_prefetched
+from modular_alert_example_app.grouping import GroupAggregator
+from modular_alert_example_app.rest import SplunkdClient, SplunkdException, STALE_CONNECTION_ERRORS
+from modular_alert_example_app import lookup_index
+from modular_alert_example_app.lookup_index import LookupIndex, LookupIndexException, open_lookup_index, build_lookup_index
+from modular_alert_example_app.rate_limit import RateLimiter, RateLimiterFullException
+from modular_alert_example_app.spool import Spool, SpoolLockedException, replay_spool, CHECKPOINT_RECORD
+from modular_alert_example_app.worker import AlertWorker, CHUNK_SIZE, execute_alert, forward_payload, get_socket_path, WorkerAlreadyRunningException, WorkerUnavailableException
+
+def write_results_file(path, header, rows):
+    """
+    Write out a gzipped CSV results file like the one Splunk provides to modular alerts.
+    """
+    with gzip.open(path, 'wt', newline='') as results_fp:
+        writer = csv.writer(results_fp)
+        writer.writerow(header)
+        writer.writerows(rows)
 
 class TestModularAlert(unittest.TestCase):
     """
@@ -29,6 +80,2547 @@ class TestModularAlert(unittest.TestCase):
         self.assertEqual(ModularAlert.create_event_string({'a' : 'A'}), "a=A")
         self.assertEqual(ModularAlert.create_event_string({'a' : ['A', 'a']}), "a=A a=a")
 
+def create_event_string_reference(data_dict, encapsulate_value_in_double_quotes=False):
+    """
+    The original implementation of create_event_string() that the encoder must remain compatible with.
+    """
+
+    def escape_spaces(s, encapsulate_in_double_quotes=False):
+        if s is not None:
+            s = str(s)
+
+        if s is not None:
+            s = s.replace('"', '\\"')
+            s = s.replace("'", "\\'")
+
+        if s is not None and (" " in s or encapsulate_in_double_quotes):
+            return '"' + s + '"'
+        else:
+            return s
+
+    data_str = ''
+
+    for k, v in data_dict.items():
+        if isinstance(v, list):
+            values = v
+        else:
+            values = [v]
+
+        k_escaped = escape_spaces(k)
+
+        for v in values:
+            v_escaped = escape_spaces(v, encapsulate_in_double_quotes=encapsulate_value_in_double_quotes)
+
+            if len(data_str) > 0:
+                data_str += ' '
+
+            data_str += '%s=%s' % (k_escaped, v_escaped)
+
+    return data_str
+
+class TestEventEncoder(unittest.TestCase):
+    """
+    Test the encoding of events.
+    """
+
+    EVENTS = [
+        {},
+        {'a' : 'A'},
+        {'a' : ['A', 'a'], 'b' : []},
+        {'message' : 'hello world', 'quote' : 'it\'s "quoted"', 'none' : None, 'int' : 4, 'float' : 1.5},
+        {'key with space' : 'v', 'tuple' : ('a', 'b'), 'mv' : ['x y', None, 3]},
+        {'tab' : 'a\tb', 'newline' : 'a\nb', 'unicode' : u'caf\u00e9 ok', 'empty' : ''},
+    ]
+
+    def test_compatibility(self):
+        for event in self.EVENTS:
+            for encapsulate in [False, True]:
+                self.assertEqual(ModularAlert.create_event_string(event, encapsulate), create_event_string_reference(event, encapsulate))
+
+    def test_escape_spaces(self):
+        self.assertEqual(ModularAlert.escape_spaces('a b'), '"a b"')
+        self.assertEqual(ModularAlert.escape_spaces('it\'s'), "it\\'s")
+        self.assertEqual(ModularAlert.escape_spaces('a', True), '"a"')
+        self.assertEqual(ModularAlert.escape_spaces(None), None)
+
+    def test_output_events(self):
+        out = StringIO()
+
+        ModularAlert().output_events(self.EVENTS, 'stanza', out=out)
+
+        self.assertEqual(out.getvalue(), ''.join(create_event_string_reference(event) + '\n' for event in self.EVENTS))
+
+    def test_flush_size(self):
+        out = StringIO()
+        writer = EventWriter(out, flush_size=20, flush_interval=3600)
+
+        writer.write({'a' : 'A'})
+        self.assertEqual(out.getvalue(), '')
+
+        writer.write({'message' : 'a longer message'})
+        self.assertEqual(out.getvalue(), 'a=A\nmessage="a longer message"\n')
+
+        writer.write({'b' : 'B'})
+        writer.close()
+        self.assertEqual(out.getvalue(), 'a=A\nmessage="a longer message"\nb=B\n')
+
+class TestJSONEvents(unittest.TestCase):
+    """
+    Test the output of events as JSON lines.
+    """
+
+    def parse(self, event_string):
+        return json.loads(event_string)
+
+    def test_encode(self):
+        encoder = JSONEventEncoder(index='main', sourcetype='alert:json', host='web1', backend='json')
+        event = {'_time' : '1500000000.5', 'quote' : 'it\'s "quoted"', 'mv' : ['a b', None, 3], 'unicode' : u'café'}
+
+        self.assertEqual(self.parse(encoder.encode(event)), {'index' : 'main', 'sourcetype' : 'alert:json', 'host' : 'web1', 'time' : 1500000000.5, 'event' : event})
+
+        # The time is only included if the event has one
+        self.assertEqual(self.parse(encoder.encode({'a' : 'A'})), {'index' : 'main', 'sourcetype' : 'alert:json', 'host' : 'web1', 'event' : {'a' : 'A'}})
+
+    def test_backends(self):
+        events = [dict(event, tuple=('a', 'b'), set=set(['c'])) for event in TestEventEncoder.EVENTS]
+        expected = [self.parse(JSONEventEncoder(source='s', backend='json').encode(event)) for event in events]
+
+        for backend in JSON_BACKENDS:
+            try:
+                encoder = JSONEventEncoder(source='s', backend=backend)
+            except ValueError:
+                continue
+
+            self.assertEqual([self.parse(encoder.encode(event)) for event in events], expected, backend)
+
+        self.assertEqual(expected[4]['event']['tuple'], ['a', 'b'])
+        self.assertRaises(ValueError, make_json_dumps, 'missing')
+
+    def test_result_row(self):
+        result_set = ResultSet(['host', 'count'], [['a', '1']])
+
+        self.assertEqual(self.parse(JSONEventEncoder().encode(result_set[0])), {'event' : {'host' : 'a', 'count' : '1'}})
+
+    def test_output_events(self):
+        alert = ModularAlert()
+        alert.execution_params['output_format'] = 'json'
+        out = StringIO()
+
+        alert.output_events(TestEventEncoder.EVENTS, 'stanza', index='main', sourcetype='alert:json', out=out)
+        alert.output_event({'a' : 'A'}, 'stanza', host='web1', out=out)
+
+        lines = [self.parse(line) for line in out.getvalue().splitlines()]
+
+        self.assertEqual(len(lines), len(TestEventEncoder.EVENTS) + 1)
+        self.assertEqual(lines[1], {'index' : 'main', 'sourcetype' : 'alert:json', 'event' : {'a' : 'A'}})
+        self.assertEqual(lines[-1], {'host' : 'web1', 'event' : {'a' : 'A'}})
+
+class TestResults(unittest.TestCase):
+    """
+    Test the reading of the results file.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_iter_results_file(self):
+        write_results_file(self.results_file, ['source', 'count', '__mv_source'], [['a', '1', ''], ['b b', '2', '']])
+
+        rows = list(iter_results_file(self.results_file))
+
+        self.assertEqual(rows, [{'source' : 'a', 'count' : '1'}, {'source' : 'b b', 'count' : '2'}])
+
+    def test_iter_results(self):
+        write_results_file(self.results_file, ['source'], [[str(i)] for i in range(100)])
+
+        rows = ModularAlert().iter_results({'results_file' : self.results_file, 'result' : {'source' : '0'}})
+
+        # Make sure the rows are returned lazily
+        self.assertFalse(isinstance(rows, list))
+        self.assertEqual(len(list(rows)), 100)
+
+    def test_iter_results_no_file(self):
+        rows = list(ModularAlert().iter_results({'result' : {'source' : 'a'}}))
+
+        self.assertEqual(rows, [{'source' : 'a'}])
+
+    def test_result_set(self):
+        write_results_file(self.results_file, ['source', '__mv_source', 'count'], [['a', '', '1'], ['b b', '', '2']])
+
+        result_set = ResultSet.from_results_file(self.results_file)
+
+        self.assertEqual(len(result_set), 2)
+        self.assertEqual(result_set.columns, ['source', 'count'])
+        self.assertEqual(result_set.to_dicts(), list(iter_results_file(self.results_file)))
+        self.assertEqual(result_set[1].get('source'), 'b b')
+        self.assertEqual(result_set[1].get('missing', 'default'), 'default')
+        self.assertEqual(result_set.column('count'), ['1', '2'])
+        self.assertEqual(result_set.column('count', IntegerField('count')), ([1, 2], bytearray(2)))
+
+    def test_share_values(self):
+        rows = list(share_values([['value %i' % (i % 2), str(i)] for i in range(2000)], 2))
+
+        # Repeated values are shared until a column has too many distinct values
+        self.assertIs(rows[0][0], rows[-2][0])
+        self.assertEqual([row[1] for row in rows], [str(i) for i in range(2000)])
+
+    def test_result_set_from_dicts(self):
+        result_set = ResultSet.from_dicts([{'source' : 'a'}, {'count' : 1, 'source' : 'b'}])
+        first, second = list(result_set)
+
+        # The first row was added before the "count" field was seen
+        self.assertEqual(first, {'source' : 'a'})
+        self.assertFalse('count' in first)
+        self.assertEqual(first.get('count'), None)
+        self.assertRaises(KeyError, lambda: first['count'])
+        self.assertEqual(dict(second), {'count' : 1, 'source' : 'b'})
+        self.assertEqual(result_set.column('count'), [None, 1])
+
+        # Views can be pickled (e.g. to be sent to a process executor)
+        self.assertEqual(pickle.loads(pickle.dumps(first)), {'source' : 'a'})
+
+    def test_get_result_set(self):
+        write_results_file(self.results_file, ['source'], [[str(i)] for i in range(10)])
+
+        alert = RecordingAlert()
+        alert.execute(make_payload({'message' : 'test'}, results_file=self.results_file))
+
+        self.assertEqual([row['source'] for row in alert.get_result_set()], [str(i) for i in range(10)])
+
+class RecordingAlert(ModularAlert):
+    """
+    A modular alert that records what it was asked to do.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(RecordingAlert, self).__init__([Field("message")], logger_name="recording_alert", **kwargs)
+        self.results = []
+        self.batches = []
+
+    def run(self, cleaned_params, payload):
+        self.results.append(payload['result'])
+        return True
+
+    def run_batch(self, cleaned_params, rows):
+        self.batches.append(len(rows))
+        super(RecordingAlert, self).run_batch(cleaned_params, rows)
+
+def make_payload(configuration, results_file=None, result=None):
+    return StringIO(json.dumps({
+        'configuration' : configuration,
+        'results_file' : results_file,
+        'result' : result if result is not None else {'source' : 'first'},
+    }))
+
+class TestBatchExecution(unittest.TestCase):
+    """
+    Test the execution of the alert against each of the results.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(self.results_file, ['source'], [[str(i)] for i in range(25)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_not_batched(self):
+        alert = RecordingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi'}, self.results_file)))
+        self.assertEqual(alert.results, [{'source' : 'first'}])
+        self.assertEqual(alert.batches, [])
+
+    def test_batched(self):
+        alert = RecordingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi', 'batch_size' : '10'}, self.results_file)))
+        self.assertEqual(alert.batches, [10, 10, 5])
+        self.assertEqual([row['source'] for row in alert.results], [str(i) for i in range(25)])
+
+    def test_blank_batch_size(self):
+        alert = RecordingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi', 'batch_size' : ''}, self.results_file)))
+        self.assertEqual(alert.batches, [])
+
+    def test_invalid_batch_size(self):
+        alert = RecordingAlert()
+
+        self.assertFalse(alert.execute(make_payload({'message' : 'hi', 'batch_size' : '0'}, self.results_file)))
+
+class FailingAlert(ModularAlert):
+    """
+    A modular alert that fails for the results with an odd source.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(FailingAlert, self).__init__([], logger_name="failing_alert", **kwargs)
+
+    def run(self, cleaned_params, payload):
+        value = int(payload['result']['source'])
+
+        if value % 2 == 1:
+            raise ValueError("Odd result")
+
+        return value
+
+class RejectingAlert(FailingAlert):
+    """
+    A modular alert that returns False for the results with an odd source.
+    """
+
+    def run(self, cleaned_params, payload):
+        return int(payload['result']['source']) % 2 == 0
+
+class SlowAlert(ModularAlert):
+    """
+    A modular alert whose results take less time the higher their source is.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(SlowAlert, self).__init__([], logger_name="slow_alert", **kwargs)
+        self.batch_results = []
+
+    def run(self, cleaned_params, payload):
+        value = int(payload['result']['source'])
+        time.sleep(0.02 * (5 - value))
+
+        return value
+
+    def on_batch_results(self, cleaned_params, rows, results):
+        self.batch_results.append((len(rows), results))
+
+class TestExecutor(unittest.TestCase):
+    """
+    Test the execution of the alert against each of the results using an executor.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(self.results_file, ['source'], [[str(i)] for i in range(20)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_thread_executor(self):
+        alert = RecordingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi', 'executor' : 'thread', 'max_workers' : '4', 'batch_size' : '8'}, self.results_file)))
+        self.assertEqual(sorted(int(row['source']) for row in alert.results), list(range(20)))
+
+    def test_ordered_results(self):
+        alert = FailingAlert()
+        alert.execution_params = dict(alert.execution_defaults, executor='thread', max_workers=4)
+        alert._executor = alert.make_executor()
+
+        try:
+            results = alert.run_batch({}, [{'source' : str(i)} for i in range(20)])
+        finally:
+            alert._executor.shutdown()
+
+        self.assertEqual(results, list(range(0, 20, 2)))
+        self.assertEqual(alert.failure_count, 10)
+
+    def test_batch_results(self):
+        write_results_file(self.results_file, ['source'], [[str(i)] for i in range(5)])
+
+        # The results are passed in the order of the rows unless the "ordered" parameter is false
+        for ordered, expected in [('true', [0, 1, 2, 3, 4]), ('false', [4, 3, 2, 1, 0])]:
+            alert = SlowAlert()
+
+            self.assertTrue(alert.execute(make_payload({'executor' : 'thread', 'max_workers' : '5', 'ordered' : ordered}, self.results_file)))
+            self.assertEqual(alert.batch_results, [(5, expected)])
+
+    def test_failure_ratio(self):
+        self.assertFalse(FailingAlert().execute(make_payload({'executor' : 'thread'}, self.results_file)))
+        self.assertFalse(FailingAlert().execute(make_payload({'executor' : 'thread', 'max_failure_ratio' : '0.4'}, self.results_file)))
+        self.assertTrue(FailingAlert().execute(make_payload({'executor' : 'thread', 'max_failure_ratio' : '0.5', 'ordered' : 'false'}, self.results_file)))
+
+    def test_failures_without_executor(self):
+        alert = FailingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'batch_size' : '3', 'max_failure_ratio' : '0.5'}, self.results_file)))
+        self.assertEqual(alert.result_count, 20)
+        self.assertEqual(alert.failure_count, 10)
+
+    def test_false_results(self):
+        # Returning False counts as a failure (and the ratio may be reached but not exceeded)
+        for executor in ('', 'thread'):
+            alert = RejectingAlert()
+
+            self.assertFalse(alert.execute(make_payload({'executor' : executor, 'batch_size' : '3'}, self.results_file)))
+            self.assertEqual(alert.failure_count, 10)
+            self.assertTrue(RejectingAlert().execute(make_payload({'executor' : executor, 'batch_size' : '3', 'max_failure_ratio' : '0.5'}, self.results_file)))
+
+    def test_process_executor(self):
+        alert = FailingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'executor' : 'process', 'max_workers' : '2', 'max_failure_ratio' : '0.5'}, self.results_file)))
+        self.assertEqual(alert.failure_count, 10)
+
+    def test_invalid_executor(self):
+        self.assertFalse(FailingAlert().execute(make_payload({'executor' : 'fiber'}, self.results_file)))
+
+class StandInServer(object):
+    """
+    A local asyncio server that stands in for a downstream system. It replies to each line with the
+    line in upper-case after the given delay (or after a long delay if the line is "slow").
+    """
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    async def handle(self, reader, writer):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        try:
+            line = (await reader.readline()).strip()
+            await asyncio.sleep(5 if line == b'slow' else self.delay)
+
+            writer.write(line.upper() + b'\n')
+            await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+
+    def close(self):
+        async def stop():
+            self.server.close()
+            await self.server.wait_closed()
+
+            # Stop the requests that are still being handled
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+class EchoAlert(AsyncModularAlert):
+    """
+    An asynchronous modular alert that sends the source of each result to the stand-in server.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(EchoAlert, self).__init__([IntegerField("port")], logger_name="echo_alert", **kwargs)
+        self.replies = []
+
+    async def run(self, cleaned_params, payload):
+        reader, writer = await asyncio.open_connection('127.0.0.1', cleaned_params['port'])
+        writer.write(payload['result']['source'].encode('utf-8') + b'\n')
+
+        try:
+            reply = (await reader.readline()).strip().decode('utf-8')
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+        self.replies.append(reply)
+        return reply
+
+class AsyncRejectingAlert(AsyncModularAlert):
+    """
+    An asynchronous modular alert that returns False for the results with an odd source.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(AsyncRejectingAlert, self).__init__([], logger_name="async_rejecting_alert", **kwargs)
+        self.batch_results = []
+
+    async def run(self, cleaned_params, payload):
+        return int(payload['result']['source']) % 2 == 0
+
+    def on_batch_results(self, cleaned_params, rows, results):
+        self.batch_results.extend(results)
+
+class TestAsyncModularAlert(unittest.TestCase):
+    """
+    Test the asynchronous modular alert against a stand-in server.
+    """
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_not_batched(self):
+        alert = EchoAlert()
+
+        self.assertEqual(alert.execute(make_payload({'port' : str(self.server.port)}, result={'source' : 'abc'})), 'ABC')
+
+    def test_concurrency_limit(self):
+        write_results_file(self.results_file, ['source'], [['row%i' % i] for i in range(50)])
+        alert = EchoAlert()
+
+        self.assertTrue(alert.execute(make_payload({'port' : str(self.server.port), 'max_concurrency' : '10'}, self.results_file)))
+        self.assertEqual(sorted(alert.replies), sorted('ROW%i' % i for i in range(50)))
+        self.assertLessEqual(self.server.max_active, 10)
+        self.assertGreater(self.server.max_active, 1)
+
+    def test_row_timeout(self):
+        write_results_file(self.results_file, ['source'], [['fast'], ['slow'], ['fast']])
+        alert = EchoAlert()
+
+        self.assertFalse(alert.execute(make_payload({'port' : str(self.server.port), 'max_concurrency' : '5', 'row_timeout' : '0.5'}, self.results_file)))
+        self.assertEqual(alert.failure_count, 1)
+        self.assertEqual(alert.replies, ['FAST', 'FAST'])
+
+    def test_false_results(self):
+        write_results_file(self.results_file, ['source'], [[str(i)] for i in range(20)])
+        alert = AsyncRejectingAlert()
+
+        self.assertFalse(alert.execute(make_payload({'max_concurrency' : '4'}, self.results_file)))
+        self.assertEqual(alert.failure_count, 10)
+        self.assertEqual(alert.batch_results, [i % 2 == 0 for i in range(20)])
+
+    def test_pickle(self):
+        write_results_file(self.results_file, ['source'], [['0']])
+        alert = AsyncRejectingAlert()
+        alert.execute(make_payload({'max_concurrency' : '4'}, self.results_file))
+
+        # The semaphore isn't sent to the workers of a process executor
+        self.assertIsNone(pickle.loads(pickle.dumps(alert))._semaphore)
+
+class SplunkdStandIn(object):
+    """
+    A local HTTP server that stands in for splunkd's REST API. It serves a KV store collection of
+    assets and a stanza of alert_actions.conf, and counts the connections and requests that it gets.
+    """
+
+    SESSION_KEY = 'abc123'
+
+    ASSETS = {
+        '10.0.0.1' : {'ip' : '10.0.0.1', 'owner' : 'alice'},
+        '10.0.0.2' : {'ip' : '10.0.0.2', 'owner' : 'bob'}
+    }
+
+    def __init__(self, delay=0.0, keep_alive=True, drop_after=None):
+        self.delay = delay
+        self.keep_alive = keep_alive
+        self.drop_after = drop_after
+        self.connections = 0
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            # Send the headers and the body without waiting for an acknowledgement in between (as splunkd does)
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+
+                with stand_in.lock:
+                    stand_in.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stand_in.handle(self)
+
+            def do_POST(self):
+                stand_in.handle(self)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server_uri = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def respond(self, handler, status, value):
+        body = json.dumps(value).encode('utf-8')
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+        # Close the connection without saying so (like a server whose keep-alive timeout expired)
+        if not self.keep_alive:
+            handler.close_connection = True
+
+    def handle(self, handler):
+        with self.lock:
+            self.requests.append((handler.command, handler.path))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+
+            url = urlsplit(handler.path)
+            query = parse_qs(url.query)
+
+            if int(handler.headers.get('Content-Length') or 0) > 0:
+                handler.rfile.read(int(handler.headers['Content-Length']))
+
+            # Close the connection without responding once it has served "drop_after" requests (like a server that went away while handling the request)
+            handler.handled_count = getattr(handler, 'handled_count', 0) + 1
+
+            if self.drop_after is not None and handler.handled_count > self.drop_after:
+                handler.close_connection = True
+                return
+
+            if handler.headers.get('Authorization') != 'Splunk ' + self.SESSION_KEY:
+                self.respond(handler, 401, {'messages' : [{'type' : 'WARN', 'text' : 'call not properly authenticated'}]})
+
+            elif query.get('output_mode') != ['json']:
+                self.respond(handler, 400, {'messages' : [{'type' : 'ERROR', 'text' : 'expected output_mode=json'}]})
+
+            elif url.path == '/servicesNS/nobody/search/storage/collections/data/assets':
+                if handler.command == 'POST':
+                    self.respond(handler, 201, {'_key' : 'new'})
+                else:
+                    ip = json.loads(query['query'][0])['ip'] if 'query' in query else None
+                    self.respond(handler, 200, [asset for asset in self.ASSETS.values() if ip is None or asset['ip'] == ip])
+
+            elif url.path == '/servicesNS/nobody/search/configs/conf-alert_actions/make_a_log_message':
+                self.respond(handler, 200, {'entry' : [{'name' : 'make_a_log_message', 'content' : {'param.importance' : '0'}}]})
+
+            else:
+                self.respond(handler, 404, {'messages' : [{'type' : 'ERROR', 'text' : 'Not Found'}]})
+
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def make_client(self, **kwargs):
+        return SplunkdClient(self.server_uri, self.SESSION_KEY, app='search', **kwargs)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+class LookupAlert(ModularAlert):
+    """
+    A modular alert that looks up the owner of the IP address of each result in the KV store.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(LookupAlert, self).__init__([], logger_name="lookup_alert", **kwargs)
+        self.owners = []
+
+    def run_batch(self, cleaned_params, rows):
+        path = self.rest_client.get_namespace_path('storage/collections/data/assets')
+        assets = self.rest_client.batch_get([(path, {'query' : json.dumps({'ip' : row['ip']})}) for row in rows])
+
+        self.owners.extend(entries[0]['owner'] if entries else None for entries in assets)
+
+class TestSplunkdClient(unittest.TestCase):
+    """
+    Test the client of splunkd's REST API against a stand-in server.
+    """
+
+    def setUp(self):
+        self.server = SplunkdStandIn()
+        self.client = self.server.make_client()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_get(self):
+        self.assertEqual(self.client.get_kvstore_entries('assets', {'ip' : '10.0.0.2'}), [{'ip' : '10.0.0.2', 'owner' : 'bob'}])
+        self.assertEqual(self.client.get_conf_stanza('alert_actions', 'make_a_log_message'), {'param.importance' : '0'})
+
+    def test_keep_alive(self):
+        for i in range(10):
+            self.client.get('/servicesNS/nobody/search/storage/collections/data/assets', {'i' : str(i)})
+
+        self.assertEqual(len(self.server.requests), 10)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stale_connection(self):
+        self.client.close()
+        self.server.close()
+
+        self.server = SplunkdStandIn(keep_alive=False)
+        self.client = self.server.make_client()
+
+        for i in range(3):
+            self.assertEqual(len(self.client.get_kvstore_entries('assets', limit=str(i))), 2)
+
+        self.assertEqual(self.server.connections, 3)
+
+    def test_dropped_request(self):
+        self.client.close()
+        self.server.close()
+
+        self.server = SplunkdStandIn(drop_after=1)
+        self.client = self.server.make_client()
+
+        path = '/servicesNS/nobody/search/storage/collections/data/assets'
+        self.client.post(path, json_body={'ip' : '10.0.0.3'})
+
+        # A POST that was sent on a kept-alive connection isn't made again (the server may have acted on it)
+        self.assertRaises(STALE_CONNECTION_ERRORS, self.client.post, path, json_body={'ip' : '10.0.0.3'})
+        self.assertEqual((self.client.request_count, len(self.server.requests)), (1, 2))
+
+        # But a GET is made again on a new connection
+        self.client.post(path, json_body={'ip' : '10.0.0.3'})
+        self.assertEqual(len(self.client.get(path, cache=False)), 2)
+        self.assertEqual((self.client.request_count, len(self.server.requests), self.server.connections), (3, 5, 3))
+
+    def test_cache(self):
+        path = '/servicesNS/nobody/search/storage/collections/data/assets'
+
+        self.assertEqual(self.client.get(path), self.client.get(path))
+        self.assertEqual(len(self.server.requests), 1)
+
+        self.client.get(path, cache=False)
+        self.assertEqual(len(self.server.requests), 2)
+
+        # Modifying the collection forgets the responses for it
+        self.client.post(path, json_body={'ip' : '10.0.0.3'})
+        self.client.get(path)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_cache_expires(self):
+        self.client.close()
+        self.client = self.server.make_client(cache_ttl=0.1)
+
+        self.client.get_kvstore_entries('assets')
+        self.client.get_kvstore_entries('assets')
+        time.sleep(0.2)
+        self.client.get_kvstore_entries('assets')
+
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_error(self):
+        with self.assertRaises(SplunkdException) as context:
+            self.client.get('/services/missing')
+
+        self.assertEqual(context.exception.status, 404)
+        self.assertIn('Not Found', str(context.exception))
+
+        # Errors aren't cached
+        self.assertRaises(SplunkdException, self.client.get, '/services/missing')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_not_authenticated(self):
+        client = SplunkdClient(self.server.server_uri, 'wrong')
+
+        try:
+            with self.assertRaises(SplunkdException) as context:
+                client.get_conf_stanza('alert_actions', 'make_a_log_message', app='search')
+
+            self.assertEqual(context.exception.status, 401)
+        finally:
+            client.close()
+
+    def test_batch_get(self):
+        self.client.close()
+        self.server.delay = 0.05
+        self.client = self.server.make_client(pool_size=4)
+
+        path = '/servicesNS/nobody/search/storage/collections/data/assets'
+        requests = [(path, {'query' : json.dumps({'ip' : '10.0.0.%i' % (i % 8)})}) for i in range(32)] + ['/services/missing']
+
+        results = self.client.batch_get(requests, return_exceptions=True)
+
+        self.assertEqual(len(results), 33)
+        self.assertEqual(results[1], [{'ip' : '10.0.0.1', 'owner' : 'alice'}])
+        self.assertEqual(results[2], [{'ip' : '10.0.0.2', 'owner' : 'bob'}])
+        self.assertEqual(results[3], [])
+        self.assertIsInstance(results[-1], SplunkdException)
+
+        # Each distinct request is only made once, over no more connections than the pool holds
+        self.assertEqual(len(self.server.requests), 9)
+        self.assertLessEqual(self.server.connections, 4)
+        self.assertGreater(self.server.max_active, 1)
+
+        self.assertRaises(SplunkdException, self.client.batch_get, ['/services/missing'])
+
+    def test_invalid_uri(self):
+        self.assertRaises(ValueError, SplunkdClient, 'ftp://127.0.0.1', 'key')
+        self.assertRaises(ValueError, SplunkdClient.from_payload, {'server_uri' : self.server.server_uri})
+
+    def test_alert(self):
+        alert = LookupAlert()
+
+        def execute(session_key):
+            payload = {
+                'configuration' : {'batch_size' : '100'},
+                'server_uri' : self.server.server_uri,
+                'session_key' : session_key,
+                'app' : 'search',
+                'result' : {'ip' : '10.0.0.1'}
+            }
+
+            return alert.execute(StringIO(json.dumps(payload)))
+
+        self.assertTrue(execute(SplunkdStandIn.SESSION_KEY))
+        self.assertTrue(execute(SplunkdStandIn.SESSION_KEY))
+        self.assertEqual(alert.owners, ['alice', 'alice'])
+
+        # The client (and its cache) is kept between executions with the same session key
+        self.assertEqual(len(self.server.requests), 1)
+
+        self.assertFalse(execute('expired'))
+
+        alert.shutdown()
+        self.assertIsNone(alert._rest_client)
+
+class TestParameterSchema(unittest.TestCase):
+    """
+    Test the compiled parameter schema.
+    """
+
+    def setUp(self):
+        self.schema = ParameterSchema([IntegerField("count"), BooleanField("enabled"), Field("message")])
+
+    def test_validate(self):
+        self.assertEqual(self.schema.validate({'count' : '4', 'enabled' : 'true'}), {'count' : 4, 'enabled' : True})
+
+    def test_validate_unknown(self):
+        self.assertRaises(FieldValidationException, self.schema.validate, {'other' : '1'})
+
+        schema = ParameterSchema([IntegerField("count")], allow_unknown=True)
+        self.assertEqual(schema.validate({'count' : '4', 'other' : '1'}), {'count' : 4, 'other' : '1'})
+
+    def test_validate_collect_errors(self):
+        with self.assertRaises(FieldValidationErrors) as context:
+            self.schema.validate({'count' : 'four', 'enabled' : 'maybe', 'message' : 'hi'}, fail_fast=False)
+
+        self.assertEqual(len(context.exception.errors), 2)
+
+    def test_validate_many(self):
+        rows = [{'count' : '1'}, {'count' : 'two'}, {'count' : '3', 'enabled' : '0'}]
+
+        results = list(self.schema.validate_many(rows, fail_fast=False))
+
+        self.assertEqual([cleaned for cleaned, _ in results], [{'count' : 1}, {}, {'count' : 3, 'enabled' : False}])
+        self.assertEqual([len(errors) for _, errors in results], [0, 1, 0])
+
+        self.assertRaises(FieldValidationException, list, self.schema.validate_many(rows))
+
+    def test_alert_schema(self):
+        alert = ModularAlert([IntegerField("count")])
+        self.assertEqual(alert.validate({'count' : '1'}), {'count' : 1})
+
+        # Make sure the schema is updated when a parameter is added
+        alert.addParameter(Field("message"))
+        self.assertEqual(alert.validate({'count' : '1', 'message' : 'hi'}), {'count' : 1, 'message' : 'hi'})
+
+        # And when the list of parameters is changed or replaced directly
+        alert.parameters.append(Field("other"))
+        self.assertEqual(alert.validate({'count' : '1', 'other' : 'x'}), {'count' : 1, 'other' : 'x'})
+
+        alert.parameters = [BooleanField("enabled")]
+        self.assertEqual(alert.validate({'enabled' : 'true'}), {'enabled' : True})
+        self.assertRaises(FieldValidationException, alert.validate, {'count' : '1'})
+
+class CountingField(Field):
+    """
+    A field that counts how many times values are converted.
+    """
+
+    conversions = 0
+
+    def to_python(self, value):
+        CountingField.conversions += 1
+        return Field.to_python(self, value)
+
+class TestValidationCache(unittest.TestCase):
+    """
+    Test the memoization of validated configurations.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        validated_configurations.clear()
+        CountingField.conversions = 0
+
+    def tearDown(self):
+        validated_configurations.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_alert(self):
+        alert = ModularAlert([CountingField("message"), RegexField("pattern"), URLField("url", none_allowed=True)])
+        alert.state_dir = self.tmp_dir
+        self.addCleanup(alert.shutdown)
+
+        return alert
+
+    def test_memoized(self):
+        alert = self.make_alert()
+        configuration = {'message' : 'hi', 'pattern' : '[a-z]+', 'batch_size' : '10'}
+
+        cleaned_params, execution_params = alert.validate_configuration(configuration)
+        self.assertEqual(cleaned_params['pattern'].pattern, '[a-z]+')
+        self.assertEqual(execution_params['batch_size'], 10)
+
+        # The cached values are returned in new dictionaries
+        cleaned_params['message'] = 'changed'
+        execution_params['batch_size'] = 1
+
+        cleaned_params, execution_params = self.make_alert().validate_configuration(dict(configuration))
+        self.assertEqual((cleaned_params['message'], execution_params['batch_size']), ('hi', 10))
+        self.assertEqual(CountingField.conversions, 1)
+
+        # A different configuration is validated
+        alert.validate_configuration(dict(configuration, message='bye'))
+        self.assertEqual(CountingField.conversions, 2)
+
+    def test_mutable_values(self):
+        alert = ModularAlert([ListField("hosts")])
+        configuration = {'hosts' : 'a,b'}
+
+        # Modifying a cleaned list doesn't change it for the executions that follow
+        for _ in range(2):
+            cleaned_params, _ = alert.validate_configuration(configuration)
+            self.assertEqual(cleaned_params['hosts'], ['a', 'b'])
+            cleaned_params['hosts'].append('c')
+
+    def test_schema_changed(self):
+        alert = self.make_alert()
+        alert.validate_configuration({'message' : 'hi'})
+
+        alert.addParameter(IntegerField("count"))
+        alert.validate_configuration({'message' : 'hi'})
+        self.assertEqual(CountingField.conversions, 2)
+
+    def test_invalid(self):
+        alert = self.make_alert()
+
+        for _ in range(2):
+            self.assertRaises(FieldValidationException, alert.validate_configuration, {'message' : 'hi', 'pattern' : '[a-'})
+
+        self.assertEqual(len(validated_configurations), 0)
+
+    def test_persistent(self):
+        configuration = {'message' : 'hi', 'pattern' : '[a-z]+', 'url' : 'https://example.com/path', 'validation_cache' : '1'}
+        self.make_alert().validate_configuration(configuration)
+
+        # Another process only has the persistent cache
+        validated_configurations.clear()
+        cleaned_params, _ = self.make_alert().validate_configuration(configuration)
+
+        self.assertEqual(CountingField.conversions, 1)
+        self.assertEqual(cleaned_params['message'], 'hi')
+        self.assertEqual(cleaned_params['pattern'].pattern, '[a-z]+')
+        self.assertEqual(cleaned_params['url'].hostname, 'example.com')
+
+    def test_not_memoized(self):
+        alert = self.make_alert()
+        alert.memoize_validation = False
+
+        alert.validate_configuration({'message' : 'hi'})
+        alert.validate_configuration({'message' : 'hi'})
+        self.assertEqual(CountingField.conversions, 2)
+
+    def test_lru(self):
+        cache = ValidationCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_validation_key(self):
+        self.assertEqual(get_validation_key('s', {'a' : '1', 'b' : '2'}), get_validation_key('s', {'b' : '2', 'a' : '1'}))
+        self.assertNotEqual(get_validation_key('s', {'a' : '1'}), get_validation_key('t', {'a' : '1'}))
+        self.assertNotEqual(get_signature([IntegerField("a", min_value=1)]), get_signature([IntegerField("a", min_value=2)]))
+
+class ChattyAlert(ModularAlert):
+    """
+    A modular alert that logs a message and outputs an event for the result, counting the alerts
+    that are running at once.
+    """
+
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.INFO)
+        super(ChattyAlert, self).__init__([], logger_name="chatty_alert", **kwargs)
+
+    def run(self, cleaned_params, payload):
+        with ChattyAlert.lock:
+            ChattyAlert.active += 1
+            ChattyAlert.max_active = max(ChattyAlert.max_active, ChattyAlert.active)
+
+        try:
+            time.sleep(0.05)
+            self.logger.info("The source was: %s", payload['result']['source'])
+            self.output_event({'source' : payload['result']['source']}, 'chatty')
+        finally:
+            with ChattyAlert.lock:
+                ChattyAlert.active -= 1
+
+        return True
+
+class TestWorker(unittest.TestCase):
+    """
+    Test the execution of alerts by a worker.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.socket_path = os.path.join(self.tmp_dir, "worker.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def start_worker(self, alert_class=RecordingAlert, **kwargs):
+        worker = AlertWorker(alert_class, self.socket_path, **kwargs)
+
+        thread = threading.Thread(target=worker.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            worker.shutdown()
+            worker.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return worker
+
+    def test_forward_payload(self):
+        worker = self.start_worker()
+
+        for i in range(3):
+            self.assertTrue(execute_alert(RecordingAlert, self.socket_path, make_payload({'message' : 'hi'}, result={'source' : str(i)})))
+
+        self.assertFalse(forward_payload(self.socket_path, make_payload({'not_a_param' : 'hi'}).getvalue()))
+
+        # An alert whose run() returns nothing succeeded
+        none_worker = AlertWorker(NoneAlert, os.path.join(self.tmp_dir, "none.sock"))
+        self.assertTrue(none_worker.execute(make_payload({}).getvalue()))
+        none_worker.server_close()
+        self.assertTrue(execute_alert(NoneAlert, os.path.join(self.tmp_dir, "none.sock"), make_payload({})))
+
+        # Make sure the alert instance was re-used
+        self.assertEqual(len(worker._alerts), 1)
+        self.assertEqual(worker._alerts[0].results, [{'source' : '0'}, {'source' : '1'}, {'source' : '2'}])
+
+    def test_relay_output(self):
+        self.start_worker(ChattyAlert)
+        out_stream, err_stream = StringIO(), StringIO()
+
+        # The events and log messages are written by the process that forwarded the payload
+        self.assertTrue(execute_alert(ChattyAlert, self.socket_path, make_payload({}, result={'source' : 'abc'}), out_stream=out_stream, err_stream=err_stream))
+        self.assertEqual(out_stream.getvalue(), 'source=abc')
+        self.assertIn(" INFO The source was: abc\n", err_stream.getvalue())
+
+    def test_max_concurrency(self):
+        worker = self.start_worker(ChattyAlert, max_concurrency=2)
+        ChattyAlert.max_active = 0
+        results = []
+
+        def forward(i):
+            results.append(forward_payload(self.socket_path, make_payload({}, result={'source' : str(i)}), out_stream=StringIO(), err_stream=StringIO()))
+
+        threads = [threading.Thread(target=forward, args=(i,)) for i in range(6)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        # The connections beyond the limit wait rather than getting a thread and an alert of their own
+        self.assertEqual(results, [True] * 6)
+        self.assertLessEqual(ChattyAlert.max_active, 2)
+        self.assertLessEqual(len(worker._alerts), 2)
+
+    def test_socket_path(self):
+        splunk_home = os.environ.pop('SPLUNK_HOME', None)
+
+        if splunk_home is not None:
+            self.addCleanup(os.environ.__setitem__, 'SPLUNK_HOME', splunk_home)
+
+        # The socket isn't put in a shared directory such as /tmp when SPLUNK_HOME isn't set
+        self.assertIsNone(get_socket_path("test"))
+        self.assertTrue(execute_alert(RecordingAlert, None, make_payload({'message' : 'hi'})))
+
+        os.environ['SPLUNK_HOME'] = self.tmp_dir
+        self.addCleanup(os.environ.pop, 'SPLUNK_HOME', None)
+        self.assertEqual(get_socket_path("test"), os.path.join(self.tmp_dir, 'var', 'run', 'splunk', 'test.sock'))
+
+    def test_worker_unavailable(self):
+        self.assertRaises(WorkerUnavailableException, forward_payload, self.socket_path, '{}')
+
+        # The alert should be executed in-process when the worker isn't running
+        self.assertTrue(execute_alert(RecordingAlert, self.socket_path, make_payload({'message' : 'hi'})))
+
+    def test_stale_socket(self):
+        # A socket left behind by a worker that didn't shut down cleanly should be replaced
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.socket_path)
+        stale.close()
+
+        self.start_worker()
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+        # But the socket of a running worker should be left alone
+        self.assertRaises(WorkerAlreadyRunningException, AlertWorker, RecordingAlert, self.socket_path)
+        self.assertTrue(execute_alert(RecordingAlert, self.socket_path, make_payload({'message' : 'hi'})))
+
+    def test_stream_payload(self):
+        worker = self.start_worker()
+
+        # A payload larger than the socket's buffers should be forwarded a chunk at a time
+        large_result = {'source' : 'x' * (4 * CHUNK_SIZE)}
+        self.assertTrue(execute_alert(RecordingAlert, self.socket_path, make_payload({'message' : 'hi'}, result=large_result)))
+        self.assertEqual(worker._alerts[0].results, [large_result])
+
+        # The rest of the payload should be drained when the alert fails without reading all of it
+        self.assertFalse(forward_payload(self.socket_path, make_payload({'not_a_param' : 'hi'}, result=large_result)))
+
+class RecordingHandler(logging.Handler):
+    """
+    A log handler that keeps the messages that were logged.
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def make_recording_logger(name):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = []
+
+    handler = RecordingHandler()
+    logger.addHandler(handler)
+
+    return logger, handler
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test the instrumentation of the execution of the alert.
+    """
+
+    def test_phase_timer(self):
+        timer = PhaseTimer()
+
+        with timer.phase('run'):
+            sum(range(10000))
+
+        timer.add('run', 0.5, 0.25)
+        metrics = timer.to_dict()
+
+        self.assertGreaterEqual(metrics['run_wall_ms'], 500)
+        self.assertGreaterEqual(metrics['run_cpu_ms'], 250)
+
+    def test_log_metrics(self):
+        alert = RecordingAlert()
+        alert.logger, handler = make_recording_logger("test_log_metrics")
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi', 'log_metrics' : '1', 'batch_size' : '10'})))
+
+        metrics = [message for message in handler.messages if message.startswith("Execution metrics")]
+        self.assertEqual(len(metrics), 1)
+
+        for phase in ['read', 'parse', 'validate', 'run', 'execute']:
+            self.assertIn(phase + '_wall_ms=', metrics[0])
+            self.assertIn(phase + '_cpu_ms=', metrics[0])
+
+        self.assertIn('success=1', metrics[0])
+        self.assertIn('results=1', metrics[0])
+
+    def test_none_result(self):
+        # An alert whose run() returns nothing succeeded
+        alert = NoneAlert()
+        alert.logger, handler = make_recording_logger("test_none_result")
+
+        self.assertIsNone(alert.execute(make_payload({'log_metrics' : '1'})))
+        self.assertIn('success=1', [message for message in handler.messages if message.startswith("Execution metrics")][0])
+
+        alert.result = False
+        self.assertFalse(alert.execute(make_payload({'log_metrics' : '1'})))
+        self.assertIn('success=0', [message for message in handler.messages if message.startswith("Execution metrics")][1])
+
+    def test_output_phase(self):
+        alert = ModularAlert()
+        alert.output_events([{'a' : 'A'}], 'stanza', out=StringIO())
+
+        self.assertIn('output_wall_ms', alert.timer.to_dict())
+
+        # Each event is only timed when the metrics are logged
+        alert = ModularAlert()
+        alert.output_event({'a' : 'A'}, 'stanza', out=StringIO())
+        self.assertNotIn('output_wall_ms', alert.timer.to_dict())
+
+        alert.execution_params['log_metrics'] = True
+        alert.output_event({'a' : 'A'}, 'stanza', out=StringIO())
+        self.assertIn('output_wall_ms', alert.timer.to_dict())
+
+    def test_metrics_not_logged(self):
+        alert = RecordingAlert()
+        alert.logger, handler = make_recording_logger("test_metrics_not_logged")
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi'})))
+        self.assertEqual([message for message in handler.messages if message.startswith("Execution metrics")], [])
+
+def add_keys_to_cache(path, keys):
+    cache = PersistentCache(path)
+
+    try:
+        return sorted(cache.add_new(keys))
+    finally:
+        cache.close()
+
+class TestPersistentCache(unittest.TestCase):
+    """
+    Test the persistent cache.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.path = os.path.join(self.tmp_dir, "cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_add_new(self):
+        cache = PersistentCache(self.path)
+        self.addCleanup(cache.close)
+
+        self.assertEqual(cache.add_new(['a', 'b']), set(['a', 'b']))
+        self.assertEqual(cache.add_new(['b', 'c']), set(['c']))
+
+    def test_get_set(self):
+        cache = PersistentCache(self.path)
+        self.addCleanup(cache.close)
+
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', 'value')
+        self.assertEqual(cache.get('a'), 'value')
+
+    def test_ttl(self):
+        cache = PersistentCache(self.path, ttl=0.1)
+        self.addCleanup(cache.close)
+
+        cache.add_new(['a'])
+        self.assertEqual(cache.add_new(['a']), set())
+
+        time.sleep(0.15)
+        self.assertEqual(cache.add_new(['a']), set(['a']))
+
+    def test_lru(self):
+        cache = PersistentCache(self.path, max_entries=2)
+        self.addCleanup(cache.close)
+
+        cache.add_new(['a'])
+        time.sleep(0.01)
+        cache.add_new(['b'])
+        time.sleep(0.01)
+        cache.add_new(['a'])
+        time.sleep(0.01)
+        cache.add_new(['c'])
+
+        # "b" was the least recently used
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.add_new(['a', 'b']), set(['b']))
+
+    def test_concurrent_processes(self):
+        keys = [str(i) for i in range(200)]
+        pool = multiprocessing.Pool(4)
+
+        try:
+            results = pool.starmap(add_keys_to_cache, [(self.path, keys)] * 8)
+        finally:
+            pool.close()
+            pool.join()
+
+        # Each key must have been new to exactly one process
+        self.assertEqual(sorted(key for result in results for key in result), sorted(keys))
+
+class BrokenBatchAlert(FailingAlert):
+    """
+    A modular alert whose execution fails entirely after it read the results.
+    """
+
+    def process_results(self, cleaned_params, rows):
+        list(rows)
+        raise ValueError("Broken")
+
+class TestDeduplication(unittest.TestCase):
+    """
+    Test the suppression of results that were already processed.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def execute(self, rows, configuration):
+        write_results_file(self.results_file, ['host', 'count'], rows)
+
+        alert = RecordingAlert()
+        alert.state_dir = self.tmp_dir
+        alert.execute(make_payload(dict(configuration, message='hi'), self.results_file))
+        alert.shutdown()
+
+        return [(row['host'], row['count']) for row in alert.results]
+
+    def test_dedup_fields(self):
+        self.assertEqual(self.execute([['a', '1'], ['b', '1'], ['a', '2']], {'dedup_fields' : 'host'}), [('a', '1'), ('b', '1')])
+        self.assertEqual(self.execute([['a', '3'], ['c', '1']], {'dedup_fields' : 'host'}), [('c', '1')])
+
+    def test_all_fields(self):
+        self.assertEqual(self.execute([['a', '1'], ['a', '2']], {'dedup_fields' : ','}), [('a', '1'), ('a', '2')])
+        self.assertEqual(self.execute([['a', '1'], ['a', '3']], {'dedup_fields' : ','}), [('a', '3')])
+
+    def execute_failing(self, alert_class):
+        alert = alert_class()
+        alert.state_dir = self.tmp_dir
+        alert.execute(make_payload({'dedup_fields' : 'source', 'batch_size' : '10', 'max_failure_ratio' : '1'}, self.results_file))
+        alert.shutdown()
+
+        return alert
+
+    def test_failed_results(self):
+        write_results_file(self.results_file, ['source'], [['1'], ['2'], ['3']])
+
+        alert = self.execute_failing(FailingAlert)
+        self.assertEqual((alert.result_count, alert.failure_count), (3, 2))
+
+        # The results that failed aren't suppressed the next time (even though they weren't spooled)
+        alert = self.execute_failing(FailingAlert)
+        self.assertEqual((alert.result_count, alert.failure_count), (2, 2))
+
+    def test_failed_execution(self):
+        write_results_file(self.results_file, ['source'], [['2'], ['4']])
+
+        self.assertEqual(self.execute_failing(BrokenBatchAlert).result_count, 0)
+
+        # None of the results are suppressed after the whole execution failed
+        alert = self.execute_failing(FailingAlert)
+        self.assertEqual((alert.result_count, alert.failure_count), (2, 0))
+
+    def test_fingerprint(self):
+        alert = ModularAlert()
+        alert.execution_params['dedup_fields'] = ['host', ' source']
+
+        self.assertEqual(alert.fingerprint({'host' : 'a', 'source' : 'b', 'other' : 1}), alert.fingerprint({'source' : 'b', 'host' : 'a'}))
+        self.assertNotEqual(alert.fingerprint({'host' : 'a', 'source' : 'b'}), alert.fingerprint({'host' : 'ab', 'source' : ''}))
+
+class FixedAlert(FailingAlert):
+    """
+    A FailingAlert whose results no longer fail (as if the problem was fixed before the replay).
+    """
+
+    replayed = []
+
+    def __init__(self, **kwargs):
+        super(FixedAlert, self).__init__(**kwargs)
+        self.state_dir = FixedAlert.state_directory
+
+    def run(self, cleaned_params, payload):
+        FixedAlert.replayed.append(payload['result']['source'])
+        return True
+
+class NoneAlert(ModularAlert):
+    """
+    A modular alert whose run() returns None when it succeeds (like MakeLogMessageAlert).
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(NoneAlert, self).__init__([], logger_name="none_alert", **kwargs)
+        self.runs = 0
+        self.result = None
+
+    def run(self, cleaned_params, payload):
+        self.runs += 1
+        return self.result
+
+class TestSpool(unittest.TestCase):
+    """
+    Test the spooling and replaying of failed executions.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.spool = Spool(os.path.join(self.tmp_dir, "test.spool"))
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_iter_entries(self):
+        for i in range(3):
+            self.spool.append({'id' : i})
+
+        # A partially written entry is skipped
+        with open(self.spool.path, 'a') as spool_fp:
+            spool_fp.write('{"id"')
+
+        self.assertEqual([entry['id'] for _, _, entry in self.spool.iter_entries()], [0, 1, 2])
+
+    def test_replay(self):
+        for i in range(20):
+            self.spool.append({'id' : i})
+
+        handled = []
+
+        def handler(entry):
+            # Complete the entries out of order and retry the multiples of five
+            time.sleep(0.001 * (entry['id'] % 3))
+            handled.append(entry['id'])
+
+            if entry['id'] < 100 and entry['id'] % 5 == 0:
+                return {'id' : entry['id'] + 100}
+
+        self.assertEqual(self.spool.replay(handler, concurrency=4), 20)
+        self.assertEqual(sorted(handled), list(range(20)))
+
+        # The retried entries are replayed by the next call
+        del handled[:]
+        self.assertEqual(self.spool.replay(handler), 4)
+        self.assertEqual(sorted(handled), [100, 105, 110, 115])
+
+        # The spool is emptied once everything was replayed
+        self.assertEqual(os.path.getsize(self.spool.path), 0)
+        self.assertEqual(self.spool.replay(handler), 0)
+
+    def test_entry_ids(self):
+        for i in range(3):
+            self.spool.append({'id' : i})
+
+        ids = []
+
+        def handler(entry):
+            ids.append(entry['entry_id'])
+
+            # Retry the first entry (as a copy, including its ID)
+            if entry['id'] == 0:
+                return dict(entry, id=100)
+
+        self.spool.replay(handler)
+        self.spool.replay(handler)
+
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(len(set(ids)), 4)
+
+    def test_resume_from_checkpoint(self):
+        for i in range(5):
+            self.spool.append({'id' : i})
+
+        offsets = [(offset, next_offset) for offset, next_offset, _ in self.spool.iter_entries()]
+
+        # The third entry and the first entry were replayed before the process stopped (mid-record)
+        with open(self.spool.checkpoint_path, 'wb') as checkpoint_fp:
+            checkpoint_fp.write(CHECKPOINT_RECORD.pack(*offsets[2]) + CHECKPOINT_RECORD.pack(*offsets[0]) + b'\x00')
+
+        self.assertEqual(self.spool.read_checkpoint(), (offsets[0][1], {offsets[2][0] : offsets[2][1]}))
+
+        handled = []
+        self.spool.replay(lambda entry: handled.append(entry['id']))
+
+        self.assertEqual(sorted(handled), [1, 3, 4])
+
+    def test_locked(self):
+        self.spool.append({'id' : 1})
+        errors = []
+
+        def handler(entry):
+            try:
+                Spool(self.spool.path).replay(lambda entry: None)
+            except SpoolLockedException as e:
+                errors.append(e)
+
+        self.spool.replay(handler)
+        self.assertEqual(len(errors), 1)
+
+    def test_spool_failures(self):
+        results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(results_file, ['source'], [[str(i)] for i in range(10)])
+
+        alert = FailingAlert()
+        alert.state_dir = self.tmp_dir
+        self.assertFalse(alert.execute(make_payload({'batch_size' : '3', 'spool_failures' : '1'}, results_file)))
+        alert.shutdown()
+
+        # The failed results are spooled in chunks of the batch size
+        entries = [entry for _, _, entry in Spool(alert.get_state_path('failures.spool')).iter_entries()]
+        self.assertEqual([[row['source'] for row in entry['rows']] for entry in entries], [['1', '3', '5'], ['7', '9']])
+
+        # Replaying runs the alert against the failed results only (the results file may be gone by then)
+        os.remove(results_file)
+        FixedAlert.state_directory = self.tmp_dir
+        FixedAlert.replayed = []
+
+        self.assertEqual(replay_spool(FixedAlert), 2)
+        self.assertEqual(sorted(FixedAlert.replayed), ['1', '3', '5', '7', '9'])
+
+    def test_spool_failed_execution(self):
+        results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(results_file, ['source'], [[str(i)] for i in range(5)])
+
+        alert = BrokenBatchAlert()
+        alert.state_dir = self.tmp_dir
+        self.assertFalse(alert.execute(make_payload({'batch_size' : '3', 'spool_failures' : '1'}, results_file)))
+        alert.shutdown()
+
+        # All of the results are spooled since the results file may be gone when the entries are replayed
+        entries = [entry for _, _, entry in Spool(alert.get_state_path('failures.spool')).iter_entries()]
+        self.assertEqual([[row['source'] for row in entry['rows']] for entry in entries], [['0', '1', '2'], ['3', '4']])
+
+        os.remove(results_file)
+        FixedAlert.state_directory = self.tmp_dir
+        FixedAlert.replayed = []
+
+        self.assertEqual(replay_spool(FixedAlert), 2)
+        self.assertEqual(sorted(FixedAlert.replayed), ['0', '1', '2', '3', '4'])
+
+    def test_replay_missing_results_file(self):
+        FixedAlert.state_directory = self.tmp_dir
+        FixedAlert.replayed = []
+        alert = FixedAlert()
+        entry = {'attempts' : 0, 'payload' : {'configuration' : {'batch_size' : '3'}, 'results_file' : os.path.join(self.tmp_dir, "missing.csv.gz"), 'result' : {'source' : '1'}}, 'rows' : None}
+
+        # The entry is kept rather than replaying only the first result
+        self.assertEqual(alert.replay(entry)['attempts'], 1)
+        self.assertEqual(FixedAlert.replayed, [])
+
+    def test_replay_failures_again(self):
+        alert = FailingAlert()
+        entry = {'attempts' : 0, 'payload' : {'configuration' : {}}, 'rows' : [{'source' : '1'}, {'source' : '2'}]}
+
+        retry_entry = alert.replay(entry)
+
+        self.assertEqual(retry_entry['rows'], [{'source' : '1'}])
+        self.assertEqual(retry_entry['attempts'], 1)
+
+        # Entries are given up on after too many attempts
+        self.assertEqual(alert.replay(dict(entry, attempts=FailingAlert.MAX_REPLAY_ATTEMPTS - 1)), None)
+
+    def test_replay_returns_none(self):
+        alert = NoneAlert()
+        entry = {'attempts' : 0, 'payload' : {'configuration' : {}, 'result' : {'source' : '1'}}, 'rows' : None}
+
+        # A run() that returns None (rather than raising an exception) succeeded, so it isn't retried
+        self.assertIsNone(alert.replay(entry))
+        self.assertEqual(alert.runs, 1)
+
+        alert.result = False
+        self.assertEqual(alert.replay(entry)['attempts'], 1)
+
+class FilteredAlert(RecordingAlert):
+    """
+    A RecordingAlert that only runs against the important results.
+    """
+
+    def get_row_filter(self):
+        return RowFilter().add(IntegerField("importance"), '>=', 2)
+
+class TestRowFilter(unittest.TestCase):
+    """
+    Test the filtering of the results.
+    """
+
+    HEADER = ['source', 'importance', '__mv_source']
+    ROWS = [['a', '1', ''], ['b', '2', ''], ['c', 'x', ''], ['multi\nline', '3', ''], ['d', '', ''], ['e', '2', '']]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(self.results_file, self.HEADER, self.ROWS)
+
+        self.row_filter = RowFilter().add(IntegerField("importance"), '>=', 2).add(Field("source"), 'in', ['b', 'multi\nline', 'e'])
+        self.expected = [{'source' : 'b', 'importance' : '2'}, {'source' : 'multi\nline', 'importance' : '3'}, {'source' : 'e', 'importance' : '2'}]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_matches(self):
+        self.assertTrue(self.row_filter.matches({'source' : 'b', 'importance' : '5'}))
+        self.assertFalse(self.row_filter.matches({'source' : 'b', 'importance' : '1'}))
+        self.assertFalse(self.row_filter.matches({'source' : 'b', 'importance' : 'x'}))
+        self.assertFalse(self.row_filter.matches({'source' : 'b'}))
+
+        self.assertRaises(ValueError, RowFilter().add, Field("source"), '=~', 'a')
+
+    def test_iter_results_file(self):
+        self.assertEqual(list(iter_results_file(self.results_file, self.row_filter)), self.expected)
+
+    def test_index(self):
+        index_path = get_index_path(self.results_file)
+        importance_filter = RowFilter().add(IntegerField("importance"), '==', 1)
+
+        # The index is built during the first scan and used by the next
+        self.assertEqual(list(iter_indexed_results(self.results_file, importance_filter)), [{'source' : 'a', 'importance' : '1'}])
+        self.assertTrue(os.path.exists(index_path))
+
+        index = ResultsIndex.load(index_path)
+        self.assertEqual(list(index.line_counts), [1, 1, 1, 2, 1, 1])
+        self.assertEqual(list(index.columns.keys()), ['importance'])
+        self.assertEqual(list(index.iter_results(self.results_file, importance_filter)), [{'source' : 'a', 'importance' : '1'}])
+
+        # The index is rebuilt (keeping the columns it had) when a filter refers to another column
+        self.assertEqual(list(iter_indexed_results(self.results_file, self.row_filter)), self.expected)
+        self.assertEqual(sorted(ResultsIndex.load(index_path).columns.keys()), ['importance', 'source'])
+        self.assertEqual(list(iter_indexed_results(self.results_file, self.row_filter)), self.expected)
+
+        # The index is rebuilt when the results file changes
+        write_results_file(self.results_file, self.HEADER, self.ROWS[:2])
+        os.utime(self.results_file, (0, 0))
+
+        self.assertEqual(list(iter_indexed_results(self.results_file, self.row_filter)), self.expected[:1])
+
+    def test_alert(self):
+        for use_index in ['0', '1']:
+            alert = FilteredAlert()
+            alert.execute(make_payload({'message' : 'test', 'batch_size' : '2', 'results_index' : use_index}, self.results_file))
+
+            self.assertEqual([row['source'] for row in alert.results], ['b', 'multi\nline', 'e'])
+
+class TestCompositeAlert(unittest.TestCase):
+    """
+    Test running several alerts against a single payload.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(self.results_file, ['source', 'importance'], [[str(i), str(i % 4)] for i in range(1000)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_execute(self):
+        batched = RecordingAlert()
+        filtered = FilteredAlert()
+        single = RecordingAlert()
+        failing = FailingAlert()
+
+        composite = CompositeAlert([
+            (batched, {'message' : 'a', 'batch_size' : '100'}),
+            (filtered, {'message' : 'b', 'batch_size' : '7'}),
+            (single, {'message' : 'c'}),
+            (failing, {'batch_size' : '10'})
+        ], log_level=logging.CRITICAL, chunk_size=50)
+
+        # The payload's own configuration is replaced by each alert's configuration
+        self.assertFalse(composite.execute(make_payload({'unknown' : '1'}, self.results_file, {'source' : 'first'})))
+        self.assertEqual(composite.results, [True, True, True, False])
+
+        self.assertEqual([row['source'] for row in batched.results], [str(i) for i in range(1000)])
+        self.assertEqual([row['source'] for row in filtered.results], [str(i) for i in range(1000) if i % 4 >= 2])
+        self.assertEqual(single.results, [{'source' : 'first'}])
+        self.assertEqual(failing.failure_count, 500)
+
+    def test_none_result(self):
+        # An alert whose run() returns nothing succeeded
+        composite = CompositeAlert([(NoneAlert(), {}), (RecordingAlert(), {'message' : 'a'})], log_level=logging.CRITICAL)
+        self.assertTrue(composite.execute(make_payload({}, self.results_file)))
+
+        composite.actions[0][0].result = False
+        self.assertFalse(composite.execute(make_payload({}, self.results_file)))
+
+    def test_not_batched(self):
+        composite = CompositeAlert([(RecordingAlert(), {'message' : 'a'}), (RecordingAlert(), {'message' : 'b'})], log_level=logging.CRITICAL)
+
+        # The results file isn't read when none of the alerts consumes the results
+        self.assertTrue(composite.execute(make_payload({}, os.path.join(self.tmp_dir, "missing.csv.gz"))))
+        self.assertEqual([alert.results for alert, _ in composite.actions], [[{'source' : 'first'}], [{'source' : 'first'}]])
+
+    def test_slow_alert(self):
+        # An alert that stops consuming results doesn't block the others
+        queue = ResultsQueue(1)
+        queue.put([1])
+        queue.close()
+        queue.put([2])
+        queue.finish()
+
+        self.assertEqual(list(queue), [])
+
+    def test_read_alert_action_params(self):
+        self.assertEqual(read_alert_action_params('make_a_log_message'), {'importance' : '0', 'group_by' : ''})
+        self.assertEqual(read_alert_action_params('missing'), {})
+
+def take_tokens(path, key, rate, burst, block, duration=None, count=None):
+    """
+    Take tokens from the rate limiter for the given duration (or until the given number are taken),
+    returning the number that were taken along with the time that the process started and stopped.
+    """
+
+    limiter = RateLimiter(path)
+    taken = 0
+
+    try:
+        start = time.time()
+
+        while (duration is not None and time.time() - start < duration) or (count is not None and taken < count):
+            if limiter.acquire(key, rate, burst, block=block):
+                taken += 1
+
+        return taken, start, time.time()
+    finally:
+        limiter.close()
+
+class RateLimitedAlert(RecordingAlert):
+    """
+    A RecordingAlert that only records the results allowed by the rate limit for their host.
+    """
+
+    def run(self, cleaned_params, payload):
+        if self.acquire_rate_limit(destination=payload['result']['host']):
+            self.results.append(payload['result'])
+
+        return True
+
+class TestRateLimiter(unittest.TestCase):
+    """
+    Test the rate limiter that is shared by the alert processes.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.path = os.path.join(self.tmp_dir, "rate_limits")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_limiter(self, **kwargs):
+        limiter = RateLimiter(self.path, **kwargs)
+        self.addCleanup(limiter.close)
+
+        return limiter
+
+    def test_burst(self):
+        limiter = self.make_limiter()
+
+        self.assertEqual([limiter.acquire('a', 0.001, 3, block=False) for _ in range(4)], [True, True, True, False])
+
+        # The keys have separate buckets
+        self.assertTrue(limiter.acquire('b', 0.001, 3, block=False))
+
+    def test_refill(self):
+        limiter = self.make_limiter()
+
+        self.assertTrue(limiter.acquire('a', 20.0, 1, block=False))
+        self.assertFalse(limiter.acquire('a', 20.0, 1, block=False))
+
+        time.sleep(0.06)
+        self.assertTrue(limiter.acquire('a', 20.0, 1, block=False))
+
+    def test_block(self):
+        limiter = self.make_limiter()
+        start = time.time()
+
+        for _ in range(5):
+            self.assertTrue(limiter.acquire('a', 20.0, 1))
+
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        # The wait would be longer than the timeout
+        self.assertFalse(limiter.acquire('a', 0.5, 1, timeout=0.1))
+
+    def test_shared_file(self):
+        first = self.make_limiter()
+        second = self.make_limiter(slot_count=10)
+
+        self.assertTrue(first.acquire('a', 0.001, 1, block=False))
+        self.assertFalse(second.acquire('a', 0.001, 1, block=False))
+
+        # The number of slots is that of the existing file
+        self.assertEqual(second.slot_count, 1024)
+
+    def test_full(self):
+        limiter = self.make_limiter(slot_count=2)
+
+        limiter.acquire('a', 1.0, 1)
+        limiter.acquire('b', 1.0, 1)
+
+        self.assertRaises(RateLimiterFullException, limiter.acquire, 'c', 1.0, 1)
+
+        # Idle buckets are replaced
+        limiter.IDLE_TIMEOUT = 0
+        time.sleep(0.01)
+        self.assertTrue(limiter.acquire('c', 1.0, 1))
+
+    def test_concurrent_processes_drop(self):
+        rate, burst = 200.0, 10
+        pool = multiprocessing.Pool(4)
+
+        try:
+            results = pool.starmap(take_tokens, [(self.path, 'a', rate, burst, False, 0.5)] * 4)
+        finally:
+            pool.close()
+            pool.join()
+
+        taken = sum(result[0] for result in results)
+        duration = max(result[2] for result in results) - min(result[1] for result in results)
+
+        # Every process was trying to take tokens throughout so the limit should be reached but not exceeded
+        self.assertLessEqual(taken, burst + rate * duration)
+        self.assertGreaterEqual(taken, 0.8 * (burst + rate * duration))
+
+    def test_concurrent_processes_block(self):
+        rate, burst = 100.0, 1
+        pool = multiprocessing.Pool(4)
+
+        try:
+            results = pool.starmap(take_tokens, [(self.path, 'a', rate, burst, True, None, 25)] * 4)
+        finally:
+            pool.close()
+            pool.join()
+
+        duration = max(result[2] for result in results) - min(result[1] for result in results)
+
+        self.assertEqual(sum(result[0] for result in results), 100)
+        self.assertGreaterEqual(duration, (100 - burst) / rate)
+
+    def test_acquire_rate_limit(self):
+        results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(results_file, ['host'], [['a'], ['a'], ['b'], ['a'], ['b']])
+
+        alert = RateLimitedAlert()
+        alert.state_dir = self.tmp_dir
+        self.addCleanup(alert.shutdown)
+
+        configuration = {'message' : 'hi', 'batch_size' : '10', 'rate_limit' : '0.001', 'rate_limit_burst' : '2', 'rate_limit_mode' : 'drop'}
+
+        self.assertTrue(alert.execute(make_payload(configuration, results_file)))
+        self.assertEqual([row['host'] for row in alert.results], ['a', 'a', 'b', 'b'])
+        self.assertEqual(alert.rate_limited_count, 1)
+        self.assertEqual(alert.get_metrics(True)['rate_limited'], 1)
+
+    def test_no_rate_limit(self):
+        alert = RateLimitedAlert()
+
+        self.assertTrue(alert.acquire_rate_limit('a'))
+        self.assertEqual(alert._rate_limiter, None)
+
+class SortingAlert(ModularAlert):
+    """
+    A modular alert that sorts the results using a row buffer.
+    """
+
+    def __init__(self, **kwargs):
+        super(SortingAlert, self).__init__([Field("message")], logger_name="sorting_alert", **kwargs)
+        self.counts = []
+
+    def run(self, cleaned_params, payload):
+        row_buffer = self.make_row_buffer(sort_key=lambda row: int(row['count']))
+        row_buffer.extend(self.get_results())
+
+        self.counts = [int(row['count']) for row in row_buffer]
+        self.spilled_count = row_buffer.spilled_count
+
+        return True
+
+class TestRowBuffer(unittest.TestCase):
+    """
+    Test the buffering of results that spills to disk.
+    """
+
+    def make_rows(self, count):
+        return [{'host' : 'host%i' % (i % 7), 'count' : str((i * 7919) % count), 'index' : i} for i in range(count)]
+
+    def test_in_memory(self):
+        rows = self.make_rows(100)
+
+        with RowBuffer() as row_buffer:
+            row_buffer.extend(rows)
+
+            self.assertEqual(list(row_buffer), rows)
+            self.assertEqual((len(row_buffer), row_buffer.spilled_count, row_buffer.run_count), (100, 0, 0))
+
+    def test_spill(self):
+        rows = self.make_rows(5000)
+
+        with RowBuffer(memory_budget=50000) as row_buffer:
+            row_buffer.extend(rows)
+
+            self.assertGreater(row_buffer.run_count, 1)
+            self.assertGreater(row_buffer.spilled_count, 4000)
+            self.assertLessEqual(row_buffer.peak_memory, 50000)
+
+            # The buffer can be read more than once
+            self.assertEqual(list(row_buffer), rows)
+            self.assertEqual(list(row_buffer), rows)
+
+    def test_sorted(self):
+        rows = self.make_rows(5000)
+        sort_key = lambda row: row['host']
+
+        with RowBuffer(memory_budget=50000, sort_key=sort_key) as row_buffer:
+            row_buffer.extend(rows)
+
+            # The rows with the same key stay in the order they were added
+            self.assertEqual(list(row_buffer), sorted(rows, key=sort_key))
+
+    def test_merge_fan_in(self):
+        rows = self.make_rows(5000)
+        sort_key = lambda row: row['host']
+
+        with RowBuffer(memory_budget=5000, sort_key=sort_key, max_merge_runs=4) as row_buffer:
+            row_buffer.extend(rows)
+            self.assertGreater(row_buffer.run_count, 16)
+
+            # The runs are merged into longer runs until few enough are left to merge at once
+            self.assertEqual(list(row_buffer), sorted(rows, key=sort_key))
+            self.assertLessEqual(row_buffer.run_count, 3)
+            self.assertEqual(list(row_buffer), sorted(rows, key=sort_key))
+
+    def test_alert(self):
+        tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.addCleanup(shutil.rmtree, tmp_dir)
+
+        results_file = os.path.join(tmp_dir, "results.csv.gz")
+        write_results_file(results_file, ['count', '_raw'], [[str((i * 7919) % 20000), 'x' * 100] for i in range(20000)])
+
+        alert = SortingAlert()
+        alert.logger, handler = make_recording_logger("test_row_buffer_alert")
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi', 'memory_budget' : '1', 'trace_memory' : '1'}, results_file)))
+
+        self.assertEqual(alert.counts, list(range(20000)))
+        self.assertGreater(alert.spilled_count, 0)
+        self.assertEqual(alert._row_buffers, [])
+
+        usage = [message for message in handler.messages if message.startswith("Memory usage")]
+        self.assertEqual(len(usage), 1)
+        self.assertIn('spilled_results=%i' % alert.spilled_count, usage[0])
+        self.assertIn('traced_peak_kb=', usage[0])
+        self.assertTrue(any(message.startswith("Memory allocated") for message in handler.messages))
+        self.assertFalse(tracemalloc.is_tracing())
+
+class TestPrefetch(unittest.TestCase):
+    """
+    Test reading the results ahead of the alert.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(self.results_file, ['source', 'importance', '__mv_source'], [[str(i), str(i % 4), ''] for i in range(5000)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_prefetched(self):
+        row_filter = RowFilter().add(IntegerField("importance"), '>=', 2)
+
+        for mode in ['thread', 'process']:
+            self.assertEqual(list(iter_prefetched(self.results_file, mode, chunk_size=100)), list(iter_results_file(self.results_file)))
+            self.assertEqual(list(iter_prefetched(self.results_file, mode, row_filter)), list(iter_results_file(self.results_file, row_filter)))
+
+    def test_empty_file(self):
+        empty_file = os.path.join(self.tmp_dir, "empty.csv")
+        open(empty_file, 'w').close()
+
+        for mode in ['thread', 'process']:
+            self.assertEqual(list(iter_prefetched(empty_file, mode)), [])
+
+    def test_missing_file(self):
+        for mode in ['thread', 'process']:
+            self.assertRaises(IOError, list, iter_prefetched(os.path.join(self.tmp_dir, "missing.csv.gz"), mode))
+
+    def test_stop_early(self):
+        for mode in ['thread', 'process']:
+            rows = iter_prefetched(self.results_file, mode, chunk_size=10)
+            self.assertEqual(next(rows)['source'], '0')
+            rows.close()
+
+        self.assertFalse(any(thread.name == 'results-prefetch' for thread in threading.enumerate()))
+        self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_bounded(self):
+        # The filter converts the value of every row that the thread reads
+        CountingField.conversions = 0
+        rows = iter_prefetched(self.results_file, 'thread', RowFilter().add(CountingField("source"), '!=', ''), chunk_size=100, queue_size=2)
+
+        next(rows)
+        time.sleep(0.2)
+
+        self.assertLessEqual(CountingField.conversions, 500)
+        self.assertEqual(len(list(rows)), 4999)
+
+    def test_alert(self):
+        for mode in ['thread', 'process']:
+            alert = RecordingAlert()
+            self.assertTrue(alert.execute(make_payload({'message' : 'hi', 'batch_size' : '1000', 'prefetch' : mode}, self.results_file)))
+            self.assertEqual([row['source'] for row in alert.results], [str(i) for i in range(5000)])
+
+class GroupingAlert(ModularAlert):
+    """
+    A modular alert that records the groups that it was run for.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(GroupingAlert, self).__init__([], logger_name="grouping_alert", **kwargs)
+        self.groups = []
+
+    def run(self, cleaned_params, payload):
+        if payload['group']['by']['host'] == 'bad':
+            raise ValueError("Bad host")
+
+        self.groups.append((payload['result'], payload['group']))
+        return True
+
+class AsyncGroupingAlert(AsyncModularAlert):
+    """
+    An asynchronous modular alert that records the groups that it was run for.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(AsyncGroupingAlert, self).__init__([], logger_name="async_grouping_alert", **kwargs)
+        self.groups = []
+
+    async def run(self, cleaned_params, payload):
+        await asyncio.sleep(0)
+        self.groups.append(payload['group'])
+        return True
+
+class TestGrouping(unittest.TestCase):
+    """
+    Test running the alert once for each group of results.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(self.results_file, ['host', 'source', 'user'], [['web%i' % (i % 3), str(i), 'user%i' % (i % 5)] for i in range(30)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_aggregator(self):
+        groups = GroupAggregator(['host'], ['user'], max_distinct=3)
+        groups.extend([{'host' : 'a', 'user' : 'u%i' % i} for i in range(5)] + [{'host' : 'b', 'user' : 'u1'}, {'user' : 'u2'}])
+
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(groups.row_count, 7)
+
+        a, b, missing = list(groups)
+
+        self.assertEqual(a['by'], {'host' : 'a'})
+        self.assertEqual(a['count'], 5)
+        self.assertEqual(a['first'], {'host' : 'a', 'user' : 'u0'})
+        self.assertEqual(a['last'], {'host' : 'a', 'user' : 'u4'})
+        self.assertEqual(a['distinct'], {'user' : ['u0', 'u1', 'u2']})
+        self.assertEqual(a['truncated'], ['user'])
+
+        self.assertEqual(b['distinct'], {'user' : ['u1']})
+        self.assertEqual(b['truncated'], [])
+        self.assertEqual(missing['by'], {'host' : ''})
+
+    def test_several_fields(self):
+        groups = GroupAggregator(['host', ' source'])
+        groups.extend([{'host' : 'a', 'source' : 'x'}, {'host' : 'a', 'source' : 'y'}, {'host' : 'a', 'source' : 'x'}, {'host' : 'a', 'source' : ['x', 'y']}])
+
+        self.assertEqual([(group['by'], group['count']) for group in groups], [
+            ({'host' : 'a', 'source' : 'x'}, 2),
+            ({'host' : 'a', 'source' : 'y'}, 1),
+            ({'host' : 'a', 'source' : ('x', 'y')}, 1)
+        ])
+
+    def test_no_fields(self):
+        self.assertRaises(ValueError, GroupAggregator, [' '])
+
+    def test_alert(self):
+        alert = GroupingAlert()
+        alert.logger, handler = make_recording_logger("test_grouping_alert")
+
+        self.assertTrue(alert.execute(make_payload({'group_by' : 'host', 'group_distinct' : 'user', 'log_metrics' : '1'}, self.results_file)))
+        self.assertEqual([(result['source'], group['by']['host'], group['count'], group['last']['source']) for result, group in alert.groups], [
+            ('0', 'web0', 10, '27'),
+            ('1', 'web1', 10, '28'),
+            ('2', 'web2', 10, '29')
+        ])
+
+        # Every user shows up for each host since 3 and 5 are co-prime
+        self.assertEqual(sorted(alert.groups[0][1]['distinct']['user']), ['user%i' % i for i in range(5)])
+
+        metrics = [message for message in handler.messages if message.startswith("Execution metrics")][0]
+        self.assertIn('groups=3', metrics)
+        self.assertIn('results=30', metrics)
+        self.assertIn('group_wall_ms=', metrics)
+
+    def test_blank_group_by(self):
+        alert = RecordingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'message' : 'hi', 'group_by' : ''}, self.results_file)))
+        self.assertEqual(alert.results, [{'source' : 'first'}])
+
+    def test_failed_group(self):
+        write_results_file(self.results_file, ['host'], [['bad']] + [['good']] * 3)
+
+        alert = GroupingAlert()
+        self.assertFalse(alert.execute(make_payload({'group_by' : 'host'}, self.results_file)))
+        self.assertEqual(alert.failure_count, 1)
+        self.assertEqual(alert.result_count, 4)
+
+        alert = GroupingAlert()
+        self.assertTrue(alert.execute(make_payload({'group_by' : 'host', 'max_failure_ratio' : '0.25'}, self.results_file)))
+        self.assertEqual([group['count'] for _, group in alert.groups], [3])
+
+    def test_async_alert(self):
+        alert = AsyncGroupingAlert()
+
+        self.assertTrue(alert.execute(make_payload({'group_by' : 'host'}, self.results_file)))
+        self.assertEqual(sorted(group['by']['host'] for group in alert.groups), ['web0', 'web1', 'web2'])
+
+    def test_memory_bounded_by_groups(self):
+        groups = GroupAggregator(['host'])
+
+        tracemalloc.start()
+
+        try:
+            groups.extend({'host' : 'web%i' % (i % 10), 'message' : 'x' * 100} for i in range(100000))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(len(groups), 10)
+        self.assertLess(peak, 1024 * 1024)
+
+def write_lookup_file(path, rows, header=('ip', 'owner', 'location')):
+    with (gzip.open(path, 'wt', newline='') if path.endswith('.gz') else open(path, 'w', newline='')) as lookup_fp:
+        writer = csv.writer(lookup_fp)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def look_up_owners(lookup_file, index_path, keys):
+    """
+    Open the index of the lookup (building it unless another process already did) and look up the keys.
+    """
+
+    index = open_lookup_index(lookup_file, 'ip', index_path)
+
+    try:
+        return [index.get(key)['owner'] for key in keys]
+    finally:
+        index.close()
+
+class EnrichingAlert(ModularAlert):
+    """
+    A modular alert that records its results after enriching them from a lookup.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('log_level', logging.CRITICAL)
+        super(EnrichingAlert, self).__init__([], logger_name="enriching_alert", **kwargs)
+        self.results = []
+
+    def run_batch(self, cleaned_params, rows):
+        self.results.extend(self.enrich(rows, 'src', lookup_field='ip', output_fields=['owner']))
+
+class TestLookupIndex(unittest.TestCase):
+    """
+    Test the memory-mapped index of lookup files.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="modular_alert_test")
+        self.lookup_file = os.path.join(self.tmp_dir, "assets.csv")
+        self.index_path = os.path.join(self.tmp_dir, "assets.idx")
+        write_lookup_file(self.lookup_file, [['10.0.0.%i' % i, 'owner%i' % i, 'dc%i' % (i % 3)] for i in range(1000)] + [['10.0.0.1', 'duplicate', ''], ['10.0.0.9', 'caf\u00e9', 'x,y']])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get(self):
+        index = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+
+        try:
+            self.assertEqual(len(index), 1000)
+            self.assertEqual(index.fields, ['ip', 'owner', 'location'])
+            self.assertEqual(index.get('10.0.0.5'), {'ip' : '10.0.0.5', 'owner' : 'owner5', 'location' : 'dc2'})
+            self.assertIsNone(index.get('10.0.0.5 '))
+            self.assertIsNone(index.get('192.168.0.1'))
+
+            # The first row with a key is used
+            self.assertEqual(index.get('10.0.0.1')['owner'], 'owner1')
+        finally:
+            index.close()
+
+    def test_gzipped_lookup(self):
+        lookup_file = os.path.join(self.tmp_dir, "assets.csv.gz")
+        write_lookup_file(lookup_file, [['10.0.0.1', 'caf\u00e9', 'x,y']])
+
+        index = open_lookup_index(lookup_file, 'ip', self.index_path)
+
+        try:
+            self.assertEqual(index.get('10.0.0.1'), {'ip' : '10.0.0.1', 'owner' : 'caf\u00e9', 'location' : 'x,y'})
+        finally:
+            index.close()
+
+    def test_empty_lookup(self):
+        write_lookup_file(self.lookup_file, [])
+        index = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+
+        try:
+            self.assertEqual(len(index), 0)
+            self.assertIsNone(index.get('10.0.0.1'))
+        finally:
+            index.close()
+
+    def test_build(self):
+        build_lookup_index(self.lookup_file, 'owner', self.index_path)
+        index = LookupIndex(self.index_path)
+
+        try:
+            self.assertEqual(index.key_field, 'owner')
+            self.assertEqual(index.get('owner7')['ip'], '10.0.0.7')
+            self.assertTrue(index.is_current(self.lookup_file, 'owner'))
+            self.assertFalse(index.is_current(self.lookup_file, 'ip'))
+        finally:
+            index.close()
+
+        # A failed build leaves the existing index in place and removes its temporary file
+        self.assertRaises(LookupIndexException, build_lookup_index, self.lookup_file, 'mac', self.index_path)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['assets.csv', 'assets.idx'])
+
+    def test_missing_key_field(self):
+        self.assertRaises(LookupIndexException, open_lookup_index, self.lookup_file, 'mac', self.index_path)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['assets.csv', 'assets.idx.lock'])
+
+    def test_hash_collisions(self):
+        original_hash_key = lookup_index.hash_key
+        lookup_index.hash_key = lambda key: 7
+
+        try:
+            write_lookup_file(self.lookup_file, [['10.0.0.%i' % i, 'owner%i' % i, ''] for i in range(20)] + [['10.0.0.3', 'duplicate', '']])
+            index = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+
+            try:
+                self.assertEqual(len(index), 20)
+                self.assertEqual([index.get('10.0.0.%i' % i)['owner'] for i in range(20)], ['owner%i' % i for i in range(20)])
+                self.assertIsNone(index.get('10.0.0.20'))
+            finally:
+                index.close()
+        finally:
+            lookup_index.hash_key = original_hash_key
+
+    def test_rebuilt_when_changed(self):
+        index = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+        inode = os.stat(self.index_path).st_ino
+
+        # The index is re-used while the lookup is unchanged
+        index_again = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+        index_again.close()
+        self.assertEqual(os.stat(self.index_path).st_ino, inode)
+
+        write_lookup_file(self.lookup_file, [['10.0.0.5', 'changed', '']])
+        self.assertFalse(index.is_current(self.lookup_file, 'ip'))
+
+        new_index = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+
+        try:
+            self.assertNotEqual(os.stat(self.index_path).st_ino, inode)
+            self.assertEqual(new_index.get('10.0.0.5')['owner'], 'changed')
+
+            # The index that was already open still works since the new one replaced it rather than overwriting it
+            self.assertEqual(index.get('10.0.0.5')['owner'], 'owner5')
+        finally:
+            index.close()
+            new_index.close()
+
+    def test_invalid_index(self):
+        with open(self.index_path, 'wb') as index_fp:
+            index_fp.write(b'x' * 100)
+
+        self.assertRaises(LookupIndexException, LookupIndex, self.index_path)
+
+        # An invalid index is rebuilt
+        index = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+        self.assertEqual(index.get('10.0.0.2')['owner'], 'owner2')
+        index.close()
+
+    def test_concurrent_processes(self):
+        keys = ['10.0.0.%i' % i for i in range(0, 1000, 50)]
+        pool = multiprocessing.Pool(4)
+
+        try:
+            results = pool.starmap(look_up_owners, [(self.lookup_file, self.index_path, keys)] * 8)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(results, [['owner%i' % i for i in range(0, 1000, 50)]] * 8)
+
+    def test_enrich(self):
+        index = open_lookup_index(self.lookup_file, 'ip', self.index_path)
+
+        try:
+            rows = [{'src' : '10.0.0.1'}, {'src' : '10.0.0.2', 'owner' : 'old'}, {'src' : 'unknown'}, {'dest' : '10.0.0.1'}, {'src' : '10.0.0.1'}]
+            enriched = index.enrich(rows, 'src', ['owner'])
+
+            self.assertEqual(enriched, [{'src' : '10.0.0.1', 'owner' : 'owner1'}, {'src' : '10.0.0.2', 'owner' : 'owner2'}, {'src' : 'unknown'}, {'dest' : '10.0.0.1'}, {'src' : '10.0.0.1', 'owner' : 'owner1'}])
+
+            # The rows aren't modified
+            self.assertEqual(rows[0], {'src' : '10.0.0.1'})
+            self.assertIs(enriched[2], rows[2])
+
+            self.assertEqual(index.enrich([{'ip' : '10.0.0.4'}], 'ip'), [{'ip' : '10.0.0.4', 'owner' : 'owner4', 'location' : 'dc1'}])
+        finally:
+            index.close()
+
+    def test_alert(self):
+        results_file = os.path.join(self.tmp_dir, "results.csv.gz")
+        write_results_file(results_file, ['src'], [['10.0.0.%i' % (i % 5)] for i in range(20)])
+
+        alert = EnrichingAlert()
+        alert.state_dir = os.path.join(self.tmp_dir, "state")
+        alert.logger, handler = make_recording_logger("test_enriching_alert")
+
+        try:
+            self.assertTrue(alert.execute(make_payload({'batch_size' : '10', 'lookup_file' : self.lookup_file, 'log_metrics' : '1'}, results_file)))
+            self.assertEqual([row['owner'] for row in alert.results], ['owner%i' % (i % 5) for i in range(20)])
+            self.assertEqual(len(os.listdir(alert.state_dir)), 2)
+            self.assertIn('enrich_wall_ms=', [message for message in handler.messages if message.startswith("Execution metrics")][0])
+
+            # A changed lookup is picked up by the next execution
+            write_lookup_file(self.lookup_file, [['10.0.0.%i' % i, 'new%i' % i, ''] for i in range(5)])
+            alert.results = []
+
+            self.assertTrue(alert.execute(make_payload({'batch_size' : '10', 'lookup_file' : self.lookup_file}, results_file)))
+            self.assertEqual([row['owner'] for row in alert.results], ['new%i' % (i % 5) for i in range(20)])
+
+            # The alert fails without a lookup
+            self.assertFalse(alert.execute(make_payload({'batch_size' : '10'}, results_file)))
+        finally:
+            alert.shutdown()
+
+        self.assertEqual(alert._lookup_indexes, {})
+
+    def test_lookup_path(self):
+        alert = EnrichingAlert()
+
+        self.assertEqual(alert.get_lookup_path(self.lookup_file), self.lookup_file)
+        self.assertEqual(os.path.basename(os.path.dirname(alert.get_lookup_path('assets.csv'))), 'lookups')
+
+class TestToPythonMany(unittest.TestCase):
+    """
+    Test the conversion of columns of values.
+    """
+
+    VALUES = ['1', ' 2 ', '3.5', '', None, 'true', 'False', '0', '-7', 'abc', '1h', '5 m', '10.0.0.1', '256.1.1.1', True, 4, 70000]
+
+    def assertMatchesToPython(self, field, values=None):
+        values = values if values is not None else self.VALUES
+        converted, errors = field.to_python_many(values)
+
+        self.assertEqual(len(converted), len(values))
+        self.assertEqual(len(errors), len(values))
+
+        for value, converted_value, error in zip(values, converted, errors):
+            try:
+                expected = field.to_python(value)
+                self.assertFalse(error, "%r should be valid for %s" % (value, field.__class__.__name__))
+                self.assertEqual(converted_value, expected)
+                self.assertEqual(type(converted_value), type(expected))
+            except (FieldValidationException, ValueError, TypeError, AttributeError):
+                self.assertTrue(error, "%r should be invalid for %s" % (value, field.__class__.__name__))
+                self.assertEqual(converted_value, None)
+
+    def test_matches_to_python(self):
+        fields = [Field("f"), Field("f", empty_allowed=False), IntegerField("f"), IntegerField("f", none_allowed=True), IntegerField("f", min_value=0, max_value=3),
+                  FloatField("f"), BooleanField("f"), DurationField("f"), IPAddressField("f"), PortField("f"), ListField("f", none_allowed=True)]
+
+        for field in fields:
+            self.assertMatchesToPython(field)
+
+    def test_all_valid(self):
+        self.assertMatchesToPython(IntegerField("f"), [str(i) for i in range(100)])
+        self.assertMatchesToPython(FloatField("f"), [str(i / 2.0) for i in range(100)])
+        self.assertMatchesToPython(BooleanField("f"), ['true', 'false', '1', '0', ' TRUE '] * 20)
+        self.assertMatchesToPython(DurationField("f"), ['1h', '2d', '30'] * 20)
+
+    def test_error_mask(self):
+        converted, errors = IntegerField("f").to_python_many(['1', 'two', '3'])
+
+        self.assertEqual(converted, [1, None, 3])
+        self.assertEqual(errors, bytearray([0, 1, 0]))
+
+    @unittest.skipUnless(numpy is not None, "NumPy is not installed")
+    def test_as_array(self):
+        converted, errors = IntegerField("f").to_python_many(['1', 'two', '3'], as_array=True)
+
+        self.assertEqual(converted.tolist(), [1, 0, 3])
+        self.assertEqual(errors, bytearray([0, 1, 0]))
+
+        converted, errors = FloatField("f").to_python_many(['1.5', ''], as_array=True)
+
+        self.assertEqual(converted[0], 1.5)
+        self.assertTrue(numpy.isnan(converted[1]))
+
+class TestPayload(unittest.TestCase):
+    """
+    Test the incremental parsing of the payload.
+    """
+
+    PAYLOAD = {
+        'configuration' : {'message' : 'say "hi" \\ {[', 'importance' : '1'},
+        'result' : {'source' : 'a}b', 'count' : ['1', '2'], 'unicode' : u'caf\u00e9'},
+        'session_key' : 'abc',
+        'sid' : 12.5,
+        'owner' : None,
+        'empty' : {},
+        'flag' : True
+    }
+
+    def test_matches_json(self):
+        text = json.dumps(self.PAYLOAD, indent=2)
+
+        # Use tiny chunks so that the values (and escape sequences) span chunks
+        for chunk_size in [1, 2, 3, 7, 65536]:
+            payload = read_payload(StringIO(text), chunk_size=chunk_size)
+            self.assertEqual(payload.to_dict(), self.PAYLOAD)
+
+    def test_lazy(self):
+        payload = read_payload(StringIO(json.dumps(self.PAYLOAD)))
+
+        self.assertFalse(payload.is_loaded('result'))
+        self.assertTrue(payload.is_loaded('configuration'))
+        self.assertTrue('result' in payload)
+
+        # Copies don't parse the value and don't share the parsed value with the original
+        copy = payload.copy()
+        copy['result'] = {'source' : 'b'}
+
+        self.assertFalse(payload.is_loaded('result'))
+        self.assertEqual(payload.get('result'), self.PAYLOAD['result'])
+        self.assertEqual(copy['result'], {'source' : 'b'})
+
+    def test_lazy_threshold(self):
+        payload = read_payload(StringIO(json.dumps(self.PAYLOAD)), lazy_keys=(), lazy_threshold=10)
+
+        self.assertFalse(payload.is_loaded('configuration'))
+        self.assertTrue(payload.is_loaded('session_key'))
+        self.assertEqual(payload['configuration'], self.PAYLOAD['configuration'])
+
+    def test_invalid(self):
+        for text in ['', '[]', '{"a" : 1', '{"a" : "b}', '{"a" 1}']:
+            with self.assertRaises(ValueError):
+                read_payload(StringIO(text))
+
+        self.assertEqual(len(read_payload(StringIO(' { } '))), 0)
+
+    def test_execute(self):
+        alert = RecordingAlert()
+        self.assertTrue(alert.execute(make_payload({'message' : 'test'}, result={'source' : 'a'})))
+
+        self.assertIsInstance(alert.payload, Payload)
+        self.assertEqual(alert.results, [{'source' : 'a'}])
+
+class CapturingAlert(ModularAlert):
+    """
+    A modular alert whose log messages are kept by a RecordingHandler.
+    """
+
+    def __init__(self, handler, **kwargs):
+        self.handler = handler
+        super(CapturingAlert, self).__init__(**kwargs)
+
+    def make_log_handler(self):
+        return self.handler
+
+class TestLogging(unittest.TestCase):
+    """
+    Test the setup of the logger.
+    """
+
+    def tearDown(self):
+        logging.getLogger("test_logging").handlers = []
+
+    def get_alert_handlers(self):
+        # Only count the handlers added by the alert (test runners such as pytest add their own)
+        return [handler for handler in logging.getLogger("test_logging").handlers if getattr(handler, 'modular_alert_handler', False)]
+
+    def test_handlers_added_once(self):
+        handler = RecordingHandler()
+
+        CapturingAlert(handler, logger_name="test_logging").logger.info("one")
+        CapturingAlert(handler, logger_name="test_logging").logger.info("two")
+
+        self.assertEqual(len(self.get_alert_handlers()), 1)
+        self.assertEqual(handler.messages, ["one", "two"])
+
+    def test_async_logging(self):
+        handler = RecordingHandler()
+        alert = CapturingAlert(handler, logger_name="test_logging", log_async=True)
+
+        for i in range(1000):
+            alert.logger.info("message %i", i)
+
+        alert.shutdown()
+
+        self.assertEqual(handler.messages, ["message %i" % i for i in range(1000)])
+
+        # Messages logged after shutdown are written directly
+        alert.logger.info("after")
+        self.assertEqual(handler.messages[-1], "after")
+        self.assertEqual(len(self.get_alert_handlers()), 1)
+
+    def test_async_logging_is_lazy(self):
+        records = []
+
+        class KeepingHandler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        alert = CapturingAlert(KeepingHandler(), logger_name="test_logging", log_async=True)
+        alert.logger.info("value=%i", 4)
+        alert.shutdown()
+
+        # The message is formatted by the listener rather than when it is logged
+        self.assertEqual(records[0].msg, "value=%i")
+        self.assertEqual(records[0].getMessage(), "value=4")
+
 class TestURLField(unittest.TestCase):
     """
     Test the ability to construct the modular alert.